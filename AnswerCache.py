@@ -0,0 +1,158 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from Checkers import normalize_query
+
+
+def make_cache_key(user_input, handbook_version, prompt_hash):
+    """Key on the normalized question, the handbook it was answered from and the prompt used"""
+    raw_key = "\x1f".join([normalize_query(user_input), handbook_version, prompt_hash])
+    return hashlib.sha256(raw_key.encode("utf-8")).hexdigest()
+
+
+def hash_prompt(*parts):
+    """Short hash of the tone and template, so prompt edits never serve stale answers"""
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+class MemoryTier:
+    """In-process LRU with a time-to-live per entry"""
+
+    def __init__(self, max_entries=512, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (stored_at, answer)
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry[0] > self.ttl:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, answer):
+        with self.lock:
+            self.entries[key] = (time.time(), answer)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class SQLiteTier:
+    """Answers stored in a SQLite file, shared by every process and kept across restarts"""
+
+    def __init__(self, path, ttl=7 * 24 * 3600):
+        self.path = path
+        self.ttl = ttl
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self.lock = threading.Lock()
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")  # readers in other processes are not blocked by writes
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS answers ("
+                "key TEXT PRIMARY KEY, handbook_version TEXT NOT NULL, answer TEXT NOT NULL, stored_at REAL NOT NULL)"
+            )
+            self.conn.commit()
+
+    def get(self, key):
+        with self.lock:
+            row = self.conn.execute("SELECT answer, stored_at FROM answers WHERE key = ?", (key,)).fetchone()
+        if row is None or time.time() - row[1] > self.ttl:
+            return None
+        return row[0]
+
+    def put(self, key, handbook_version, answer):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO answers (key, handbook_version, answer, stored_at) VALUES (?, ?, ?, ?)",
+                (key, handbook_version, answer, time.time())
+            )
+            self.conn.commit()
+
+    def purge_other_versions(self, handbook_version):
+        """Drop answers generated from any other version of the handbook"""
+        with self.lock:
+            deleted = self.conn.execute(
+                "DELETE FROM answers WHERE handbook_version != ?", (handbook_version,)
+            ).rowcount
+            self.conn.commit()
+        return deleted
+
+
+class AnswerCache:
+    """Two-tier cache of model answers (memory LRU in front of a shared SQLite file)"""
+
+    def __init__(self, path, max_entries=512, memory_ttl=3600, disk_ttl=7 * 24 * 3600):
+        self.memory = MemoryTier(max_entries, memory_ttl)
+        self.disk = SQLiteTier(path, disk_ttl)
+        self.handbook_version = None
+        self.lock = threading.Lock()
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "invalidations": 0}
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def check_version(self, handbook_version):
+        """Forget every answer once the handbook changes"""
+        if handbook_version == self.handbook_version:
+            return
+        with self.lock:
+            if handbook_version == self.handbook_version:
+                return
+            if self.handbook_version is not None:
+                self.counters["invalidations"] += 1
+            self.handbook_version = handbook_version
+        self.memory.clear()
+        self.disk.purge_other_versions(handbook_version)
+
+    def get(self, user_input, handbook_version, prompt_hash):
+        self.check_version(handbook_version)
+        key = make_cache_key(user_input, handbook_version, prompt_hash)
+
+        answer = self.memory.get(key)
+        if answer is not None:
+            self.count("memory_hits")
+            return answer
+
+        answer = self.disk.get(key)
+        if answer is not None:
+            self.count("disk_hits")
+            self.memory.put(key, answer)  # promote so the next hit stays in memory
+            return answer
+
+        self.count("misses")
+        return None
+
+    def put(self, user_input, handbook_version, prompt_hash, answer):
+        self.check_version(handbook_version)
+        key = make_cache_key(user_input, handbook_version, prompt_hash)
+        self.memory.put(key, answer)
+        self.disk.put(key, handbook_version, answer)
+        self.count("stores")
+
+    def stats(self):
+        """Hit/miss counters; every hit is one model call saved"""
+        with self.lock:
+            stats = dict(self.counters)
+        stats["llm_calls_saved"] = stats["memory_hits"] + stats["disk_hits"]
+        lookups = stats["llm_calls_saved"] + stats["misses"]
+        stats["hit_rate"] = stats["llm_calls_saved"] / lookups if lookups else 0.0
+        return stats
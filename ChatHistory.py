@@ -1,91 +1,107 @@
 import streamlit as st
 import json
 import os
-from datetime import datetime
+import threading
 import uuid
+from functools import lru_cache
+from ChatStore import CHAT_HISTORY_BACKEND, CHAT_HISTORY_DB, CHAT_HISTORY_DIR, CHAT_SAVE_MODE, create_chat_store
+
+# Chat avatars
+USER_AVATAR = 'https://raw.githubusercontent.com/vennDiagramm/MMCMate_An_AI_Chatbot_for_School_Policy_Assistance/main/icons/user_icon.ico'
+ASSISTANT_AVATAR = 'https://raw.githubusercontent.com/vennDiagramm/MMCMate_An_AI_Chatbot_for_School_Policy_Assistance/main/icons/mapua_icon_83e_icon.ico'
+
+# Messages shown at once || older ones are behind a "load earlier" button, so a rerun costs the same however long the chat is
+TRANSCRIPT_WINDOW = int(os.getenv("TRANSCRIPT_WINDOW", "20"))
+
+def justified_html(content):
+    return f"<div style='text-align: justify;'>{content}</div>" # for justify
+
+# Formatted HTML of finished messages, shared by every session || the same content is only formatted once
+@lru_cache(maxsize=2048)
+def message_html(content):
+    return justified_html(content)
 
 class ChatHistoryManager:
-    def __init__(self, storage_dir="chat_history"): 
+    def __init__(self, storage_dir=CHAT_HISTORY_DIR, backend=CHAT_HISTORY_BACKEND, db_path=CHAT_HISTORY_DB):
         self.storage_dir = storage_dir
-        self.ensure_storage_directory()
+        self.store = create_chat_store(backend, storage_dir, db_path)
+        
+        # Sidebar listings by (limit, offset) || dropped after any write here or in another process
+        self.listing_cache = {}
+        self.listing_version = None
+        self.writes = 0
+        self.lock = threading.Lock()
     
-    def ensure_storage_directory(self):
-        """Create storage directory if it doesn't exist"""
-        if not os.path.exists(self.storage_dir):
-            os.makedirs(self.storage_dir)
+    def changed(self):
+        """Forget cached listings after a write"""
+        with self.lock:
+            self.writes += 1
     
     def generate_chat_id(self):
         """Generate a unique chat ID"""
         return str(uuid.uuid4())[:8]
     
-    def get_chat_filename(self, chat_id):
-        """Generate filename for a chat session"""
-        return os.path.join(self.storage_dir, f"chat_{chat_id}.json")
-    
     def save_chat_session(self, chat_id, messages, title=None):
-        """Save current chat session to JSON file"""
+        """Save current chat session"""
         try:
-            chat_data = {
-                "chat_id": chat_id,
-                "title": title or f"Chat {chat_id}",
-                "created_at": datetime.now().isoformat(),
-                "last_updated": datetime.now().isoformat(),
-                "messages": messages
-            }
-            
-            filename = self.get_chat_filename(chat_id)
-            with open(filename, 'w', encoding='utf-8') as f:
-                json.dump(chat_data, f, indent=2, ensure_ascii=False)
-            
+            self.store.save(chat_id, messages, title)
+            self.changed()
             return True
         except Exception as e:
             st.error(f"Error saving chat: {str(e)}")
             return False
     
+    def append_message(self, chat_id, message, position):
+        """Persist a single message as it arrives"""
+        try:
+            self.store.append(chat_id, message, position)
+            self.changed()
+            return True
+        except Exception as e:
+            st.error(f"Error saving message: {str(e)}")
+            return False
+    
     def load_chat_session(self, chat_id):
-        """Load a specific chat session from JSON file"""
+        """Load a specific chat session"""
         try:
-            filename = self.get_chat_filename(chat_id)
-            if os.path.exists(filename):
-                with open(filename, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            return None
+            return self.store.load(chat_id)
         except Exception as e:
             st.error(f"Error loading chat: {str(e)}")
             return None
     
-    def get_all_chat_sessions(self):
-        """Get list of all saved chat sessions"""
+    def cached_listing(self, key, compute):
+        """Listing results are reused until the history changes"""
+        with self.lock:
+            version = (self.writes, self.store.data_version())
+            if version != self.listing_version:
+                self.listing_cache = {}
+                self.listing_version = version
+            if key not in self.listing_cache:
+                self.listing_cache[key] = compute()
+            return self.listing_cache[key]
+    
+    def get_all_chat_sessions(self, limit=None, offset=0):
+        """Get list of saved chat sessions (most recent first)"""
         try:
-            chat_sessions = []
-            for filename in os.listdir(self.storage_dir):
-                if filename.startswith("chat_") and filename.endswith(".json"):
-                    chat_id = filename.replace("chat_", "").replace(".json", "")
-                    chat_data = self.load_chat_session(chat_id)
-                    if chat_data:
-                        chat_sessions.append({
-                            "chat_id": chat_id,
-                            "title": chat_data.get("title", f"Chat {chat_id}"),
-                            "created_at": chat_data.get("created_at"),
-                            "last_updated": chat_data.get("last_updated"),
-                            "message_count": len(chat_data.get("messages", []))
-                        })
-            
-            # Sort by last updated (most recent first)
-            chat_sessions.sort(key=lambda x: x["last_updated"], reverse=True)
-            return chat_sessions
+            return self.cached_listing(("page", limit, offset), lambda: self.store.list_sessions(limit, offset))
         except Exception as e:
             st.error(f"Error getting chat sessions: {str(e)}")
             return []
     
+    def count_chat_sessions(self):
+        """Number of saved chat sessions"""
+        try:
+            return self.cached_listing("count", self.store.count_sessions)
+        except Exception as e:
+            st.error(f"Error getting chat sessions: {str(e)}")
+            return 0
+    
     def delete_chat_session(self, chat_id):
         """Delete a specific chat session"""
         try:
-            filename = self.get_chat_filename(chat_id)
-            if os.path.exists(filename):
-                os.remove(filename)
-                return True
-            return False
+            deleted = self.store.delete(chat_id)
+            self.changed()
+            return deleted
         except Exception as e:
             st.error(f"Error deleting chat: {str(e)}")
             return False
@@ -109,6 +125,9 @@ def init_chat():
     
     if "current_chat_id" not in st.session_state:
         st.session_state.current_chat_id = None
+
+    if "transcript_window" not in st.session_state:
+        st.session_state.transcript_window = TRANSCRIPT_WINDOW
     
     if "chat_manager" not in st.session_state:
         st.session_state.chat_manager = get_chat_manager()
@@ -117,21 +136,26 @@ def add_message(role, content):
     """Add message to current session"""
     st.session_state.messages.append({"role": role, "content": content})
     
-    # Auto-save every few messages
-    if len(st.session_state.messages) % 5 == 0:
+    # Persist each message as it arrives || or auto-save every few messages in snapshot mode
+    if CHAT_SAVE_MODE == "append":
+        persist_last_message()
+    elif len(st.session_state.messages) % 5 == 0:
         auto_save_current_chat()
 
 def display_chat():
-    """Display current chat messages"""
-    for message in st.session_state.messages:
-        avatar_path = (
-            'https://raw.githubusercontent.com/vennDiagramm/MMCMate_An_AI_Chatbot_for_School_Policy_Assistance/main/icons/user_icon.ico'
-            if message["role"] == "user" else
-            'https://raw.githubusercontent.com/vennDiagramm/MMCMate_An_AI_Chatbot_for_School_Policy_Assistance/main/icons/mapua_icon_83e_icon.ico'
-        )
+    """Display the latest chat messages, older ones on request"""
+    messages = st.session_state.messages
+    hidden = max(len(messages) - st.session_state.transcript_window, 0)
+
+    if hidden:
+        if st.button(f"⬆️ Load earlier messages ({hidden} hidden)", key="load_earlier"):
+            st.session_state.transcript_window += TRANSCRIPT_WINDOW
+            st.rerun()
+
+    for message in messages[hidden:]:
+        avatar_path = USER_AVATAR if message["role"] == "user" else ASSISTANT_AVATAR
         with st.chat_message(message["role"], avatar=avatar_path):
-            justified_content = f"<div style='text-align: justify;'>{message['content']}</div>" # for justify
-            st.markdown(justified_content, unsafe_allow_html=True)
+            st.markdown(message_html(message["content"]), unsafe_allow_html=True)
 
 def start_new_chat():
     """Start a new chat session"""
@@ -141,6 +165,7 @@ def start_new_chat():
     
     # Reset for new chat
     st.session_state.messages = []
+    st.session_state.transcript_window = TRANSCRIPT_WINDOW
     st.session_state.current_chat_id = st.session_state.chat_manager.generate_chat_id()
 
 def save_current_chat(title=None):
@@ -164,18 +189,35 @@ def auto_save_current_chat():
             st.session_state.messages
         )
 
+def persist_last_message():
+    """Append the newest message to the current chat (creates new chat ID if none exists)"""
+    if not st.session_state.current_chat_id:
+        st.session_state.current_chat_id = st.session_state.chat_manager.generate_chat_id()
+    
+    position = len(st.session_state.messages) - 1
+    return st.session_state.chat_manager.append_message(
+        st.session_state.current_chat_id,
+        st.session_state.messages[position],
+        position
+    )
+
 def load_chat_session(chat_id):
     """Load a specific chat session"""
     chat_data = st.session_state.chat_manager.load_chat_session(chat_id)
     if chat_data:
         st.session_state.messages = chat_data.get("messages", [])
         st.session_state.current_chat_id = chat_id
+        st.session_state.transcript_window = TRANSCRIPT_WINDOW
         return True
     return False
 
-def get_chat_sessions():
-    """Get all available chat sessions"""
-    return st.session_state.chat_manager.get_all_chat_sessions()
+def get_chat_sessions(limit=None, offset=0):
+    """Get available chat sessions, one page at a time when limit is given"""
+    return st.session_state.chat_manager.get_all_chat_sessions(limit, offset)
+
+def count_chat_sessions():
+    """Count saved chat sessions"""
+    return st.session_state.chat_manager.count_chat_sessions()
 
 def delete_chat_session(chat_id):
     """Delete a specific chat session"""
@@ -0,0 +1,361 @@
+import argparse
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+# Chat history settings || "sqlite" (default) or "json" for the old one-file-per-chat layout
+CHAT_HISTORY_BACKEND = os.getenv("CHAT_HISTORY_BACKEND", "sqlite")
+CHAT_HISTORY_DIR = os.getenv("CHAT_HISTORY_DIR", "chat_history")
+CHAT_HISTORY_DB = os.getenv("CHAT_HISTORY_DB", os.path.join(CHAT_HISTORY_DIR, "chats.db"))
+
+# "append" writes every message as it arrives, "snapshot" rewrites the whole chat every 5 messages (old behavior)
+CHAT_SAVE_MODE = os.getenv("CHAT_SAVE_MODE", "append")
+
+# Appended messages are fsynced in batches || whichever comes first, a message count or seconds since the last fsync
+CHAT_FSYNC_EVERY = int(os.getenv("CHAT_FSYNC_EVERY", "8"))
+CHAT_FSYNC_INTERVAL = float(os.getenv("CHAT_FSYNC_INTERVAL", "1.0"))
+
+# Appended messages are folded back into the canonical record after this many
+CHAT_COMPACT_EVERY = int(os.getenv("CHAT_COMPACT_EVERY", "100"))
+
+
+class JSONChatStore:
+    """One chat_<id>.json file per chat (the original layout)
+
+    Appended messages go to a chat_<id>.jsonl journal next to it, one {"position", "role", "content"} line each,
+    and are folded into the .json file every CHAT_COMPACT_EVERY messages or on a full save.
+    """
+
+    def __init__(self, storage_dir=CHAT_HISTORY_DIR, fsync_every=CHAT_FSYNC_EVERY, fsync_interval=CHAT_FSYNC_INTERVAL,
+                 compact_every=CHAT_COMPACT_EVERY):
+        self.storage_dir = storage_dir
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.compact_every = compact_every
+        self.journals = {}  # chat_id -> [open journal, lines written, lines not yet fsynced, last fsync time]
+        self.lock = threading.RLock()
+        if not os.path.exists(storage_dir):
+            os.makedirs(storage_dir)
+        atexit.register(self.flush)
+
+    def get_chat_filename(self, chat_id):
+        return os.path.join(self.storage_dir, f"chat_{chat_id}.json")
+
+    def get_journal_filename(self, chat_id):
+        return os.path.join(self.storage_dir, f"chat_{chat_id}.jsonl")
+
+    def chat_ids(self):
+        for filename in os.listdir(self.storage_dir):
+            if filename.startswith("chat_") and filename.endswith(".json"):
+                yield filename[len("chat_"):-len(".json")]
+
+    def read_canonical(self, chat_id):
+        filename = self.get_chat_filename(chat_id)
+        if not os.path.exists(filename):
+            return None
+        with open(filename, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def write_canonical(self, chat_data):
+        # Write aside then rename, so a crash never leaves half a file behind
+        filename = self.get_chat_filename(chat_data["chat_id"])
+        with open(filename + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(chat_data, f, indent=2, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(filename + ".tmp", filename)
+
+    def read_journal(self, chat_id):
+        filename = self.get_journal_filename(chat_id)
+        if not os.path.exists(filename):
+            return []
+        entries = []
+        with open(filename, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    break  # torn last line from a crash
+        return entries
+
+    def close_journal(self, chat_id, remove=False):
+        journal = self.journals.pop(chat_id, None)
+        if journal is not None:
+            journal[0].close()
+        if remove and os.path.exists(self.get_journal_filename(chat_id)):
+            os.remove(self.get_journal_filename(chat_id))
+
+    def save(self, chat_id, messages, title=None):
+        """Rewrite the whole chat (this is also the compaction step); created_at and a custom title are kept"""
+        with self.lock:
+            existing = self.read_canonical(chat_id) or {}
+            now = datetime.now().isoformat()
+            self.write_canonical({
+                "chat_id": chat_id,
+                "title": title or existing.get("title") or f"Chat {chat_id}",
+                "created_at": existing.get("created_at") or now,
+                "last_updated": now,
+                "messages": messages
+            })
+            self.close_journal(chat_id, remove=True)
+
+    def append(self, chat_id, message, position):
+        """Write one message at the given position || constant cost, flushed at once and fsynced in batches"""
+        with self.lock:
+            journal = self.journals.get(chat_id)
+            if journal is None:
+                if not os.path.exists(self.get_chat_filename(chat_id)):
+                    self.save(chat_id, [])  # fixes created_at
+                journal = [open(self.get_journal_filename(chat_id), 'a', encoding='utf-8'),
+                           len(self.read_journal(chat_id)), 0, time.monotonic()]
+                self.journals[chat_id] = journal
+
+            entry = {"position": position, "role": message["role"], "content": message["content"]}
+            journal[0].write(json.dumps(entry, ensure_ascii=False) + "\n")
+            journal[0].flush()  # in the OS from here on, so a crashed process loses nothing
+            journal[1] += 1
+            journal[2] += 1
+            if journal[2] >= self.fsync_every or time.monotonic() - journal[3] >= self.fsync_interval:
+                os.fsync(journal[0].fileno())
+                journal[2] = 0
+                journal[3] = time.monotonic()
+
+            if journal[1] >= self.compact_every:
+                self.compact(chat_id)
+
+    def compact(self, chat_id):
+        """Fold the journal into chat_<id>.json"""
+        with self.lock:
+            chat_data = self.load(chat_id)
+            if chat_data is not None:
+                self.save(chat_id, chat_data["messages"], chat_data["title"])
+
+    def flush(self):
+        """fsync every open journal"""
+        with self.lock:
+            for journal in self.journals.values():
+                if journal[2]:
+                    os.fsync(journal[0].fileno())
+                    journal[2] = 0
+                    journal[3] = time.monotonic()
+
+    def load(self, chat_id):
+        with self.lock:
+            chat_data = self.read_canonical(chat_id)
+            if chat_data is None:
+                return None
+            entries = self.read_journal(chat_id)
+        if entries:
+            # Positions make replaying idempotent (a journal that survived its compaction is harmless)
+            messages = chat_data.get("messages", [])
+            for entry in entries:
+                message = {"role": entry["role"], "content": entry["content"]}
+                if entry["position"] < len(messages):
+                    messages[entry["position"]] = message
+                else:
+                    messages.append(message)
+            chat_data["messages"] = messages
+            chat_data["last_updated"] = datetime.fromtimestamp(
+                os.path.getmtime(self.get_journal_filename(chat_id))
+            ).isoformat()
+        return chat_data
+
+    def list_sessions(self, limit=None, offset=0):
+        sessions = []
+        for chat_id in self.chat_ids():
+            chat_data = self.load(chat_id)
+            if chat_data:
+                sessions.append({
+                    "chat_id": chat_id,
+                    "title": chat_data.get("title", f"Chat {chat_id}"),
+                    "created_at": chat_data.get("created_at"),
+                    "last_updated": chat_data.get("last_updated"),
+                    "message_count": len(chat_data.get("messages", []))
+                })
+        sessions.sort(key=lambda x: x["last_updated"], reverse=True)
+        return sessions[offset:offset + limit if limit is not None else None]
+
+    def count_sessions(self):
+        return sum(1 for _ in self.chat_ids())
+
+    def data_version(self):
+        """Changes when another process adds or deletes a chat"""
+        return os.stat(self.storage_dir).st_mtime_ns
+
+    def delete(self, chat_id):
+        with self.lock:
+            self.close_journal(chat_id, remove=True)
+            filename = self.get_chat_filename(chat_id)
+            if os.path.exists(filename):
+                os.remove(filename)
+                return True
+            return False
+
+
+class SQLiteChatStore:
+    """Chats in one SQLite file || session metadata and messages in separate tables, listing is an indexed query"""
+
+    def __init__(self, path=CHAT_HISTORY_DB, compact_every=CHAT_COMPACT_EVERY):
+        self.path = path
+        self.compact_every = compact_every
+        self.appends = 0
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self.lock = threading.Lock()
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")  # the sidebar can list chats while another tab saves
+            # Commits land in the WAL without an fsync (safe if the process dies), the fsync is batched into checkpoints
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute("PRAGMA foreign_keys=ON")
+            self.conn.executescript(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "chat_id TEXT PRIMARY KEY, title TEXT NOT NULL, created_at TEXT NOT NULL, "
+                "last_updated TEXT NOT NULL, message_count INTEGER NOT NULL DEFAULT 0);"
+                "CREATE INDEX IF NOT EXISTS sessions_last_updated ON sessions (last_updated DESC);"
+                "CREATE TABLE IF NOT EXISTS messages ("
+                "chat_id TEXT NOT NULL REFERENCES sessions (chat_id) ON DELETE CASCADE, "
+                "position INTEGER NOT NULL, role TEXT NOT NULL, content TEXT NOT NULL, "
+                "PRIMARY KEY (chat_id, position)) WITHOUT ROWID;"
+            )
+            self.conn.commit()
+
+    def save(self, chat_id, messages, title=None, created_at=None, last_updated=None):
+        """Write the whole chat; created_at and a custom title survive later saves"""
+        now = datetime.now().isoformat()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO sessions (chat_id, title, created_at, last_updated, message_count) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (chat_id) DO UPDATE SET title = COALESCE(?, sessions.title), "
+                "last_updated = excluded.last_updated, message_count = excluded.message_count",
+                (chat_id, title or f"Chat {chat_id}", created_at or now, last_updated or now, len(messages), title)
+            )
+            self.conn.execute("DELETE FROM messages WHERE chat_id = ?", (chat_id,))
+            self.conn.executemany(
+                "INSERT INTO messages (chat_id, position, role, content) VALUES (?, ?, ?, ?)",
+                [(chat_id, position, message["role"], message["content"]) for position, message in enumerate(messages)]
+            )
+
+    def append(self, chat_id, message, position):
+        """Insert one message row || constant cost however long the chat is"""
+        now = datetime.now().isoformat()
+        with self.lock:
+            with self.conn:
+                self.conn.execute(
+                    "INSERT INTO sessions (chat_id, title, created_at, last_updated, message_count) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (chat_id) DO UPDATE SET last_updated = excluded.last_updated, "
+                    "message_count = MAX(sessions.message_count, excluded.message_count)",
+                    (chat_id, f"Chat {chat_id}", now, now, position + 1)
+                )
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO messages (chat_id, position, role, content) VALUES (?, ?, ?, ?)",
+                    (chat_id, position, message["role"], message["content"])
+                )
+            self.appends += 1
+            if self.appends % self.compact_every == 0:
+                self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")  # fold the WAL back into the database file
+
+    def flush(self):
+        with self.lock:
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def load(self, chat_id):
+        with self.lock:
+            session = self.conn.execute(
+                "SELECT title, created_at, last_updated FROM sessions WHERE chat_id = ?", (chat_id,)
+            ).fetchone()
+            if session is None:
+                return None
+            rows = self.conn.execute(
+                "SELECT role, content FROM messages WHERE chat_id = ? ORDER BY position", (chat_id,)
+            ).fetchall()
+        return {
+            "chat_id": chat_id,
+            "title": session[0],
+            "created_at": session[1],
+            "last_updated": session[2],
+            "messages": [{"role": role, "content": content} for role, content in rows]
+        }
+
+    def list_sessions(self, limit=None, offset=0):
+        """Most recently updated first, without touching any message"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT chat_id, title, created_at, last_updated, message_count FROM sessions "
+                "ORDER BY last_updated DESC LIMIT ? OFFSET ?",
+                (-1 if limit is None else limit, offset)
+            ).fetchall()
+        return [
+            {"chat_id": row[0], "title": row[1], "created_at": row[2], "last_updated": row[3], "message_count": row[4]}
+            for row in rows
+        ]
+
+    def count_sessions(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def data_version(self):
+        """Changes whenever another connection (another process) commits"""
+        with self.lock:
+            return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def delete(self, chat_id):
+        with self.lock, self.conn:
+            return self.conn.execute("DELETE FROM sessions WHERE chat_id = ?", (chat_id,)).rowcount > 0
+
+
+def migrate_json_history(storage_dir, store):
+    """Copy every chat_<id>.json into the SQLite store, keeping its timestamps || chats already there are skipped"""
+    migrated = 0
+    existing = {session["chat_id"] for session in store.list_sessions()}
+    json_store = JSONChatStore(storage_dir)
+    for chat_id in json_store.chat_ids():
+        if chat_id in existing:
+            continue
+        try:
+            chat_data = json_store.load(chat_id)
+        except (OSError, ValueError) as e:
+            print(f"[ERROR] Skipping chat_{chat_id}.json: {e}")
+            continue
+        store.save(
+            chat_id,
+            chat_data.get("messages", []),
+            chat_data.get("title"),
+            created_at=chat_data.get("created_at"),
+            last_updated=chat_data.get("last_updated")
+        )
+        migrated += 1
+    return migrated
+
+
+def create_chat_store(backend=CHAT_HISTORY_BACKEND, storage_dir=CHAT_HISTORY_DIR, db_path=CHAT_HISTORY_DB):
+    """Build the store named by CHAT_HISTORY_BACKEND; a new SQLite store imports the old JSON chats once"""
+    if backend == "json":
+        return JSONChatStore(storage_dir)
+    if backend == "sqlite":
+        is_new = not os.path.exists(db_path)
+        store = SQLiteChatStore(db_path)
+        if is_new and os.path.isdir(storage_dir):
+            migrate_json_history(storage_dir, store)
+        return store
+    raise ValueError(f"Unknown chat history backend '{backend}', expected 'sqlite' or 'json'")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import chat_<id>.json files into the SQLite chat history")
+    parser.add_argument("--from-dir", default=CHAT_HISTORY_DIR)
+    parser.add_argument("--db", default=CHAT_HISTORY_DB)
+    args = parser.parse_args()
+
+    migrated = migrate_json_history(args.from_dir, SQLiteChatStore(args.db))
+    print(f"Migrated {migrated} chat(s) from {args.from_dir} into {args.db}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,71 +1,211 @@
-from langdetect import detect, DetectorFactory
+import os
 import re
-import nltk
-from nltk.corpus import words
+from collections import Counter, defaultdict
+from itertools import chain
 from fuzzywuzzy import fuzz
+from Startup import WORDS_ARTIFACT, load_word_list, timed_import, record_time
+from Tracing import debug, stage
+import time
+
+# Same punctuation stripping as InputChecker.remove_punctuation
+PUNCTUATION_PATTERN = re.compile(r'[^\w\s]')
+
+# Lowercase, strip punctuation and collapse spaces || used to key cached answers
+def normalize_query(text):
+    return " ".join(PUNCTUATION_PATTERN.sub('', text.lower()).split())
+
+# Long runs of consonants or vowels (e.g. "bcdfgh" or "aeiou")
+GIBBERISH_PATTERN = re.compile(r'(?i)([bcdfghjklmnpqrstvwxyz]{5,}|[aeiou]{5,})')
+
+# langdetect never decided anything, so it only runs when asked for (LANGUAGE_DETECTION=1)
+LANGUAGE_DETECTION = os.getenv("LANGUAGE_DETECTION", "0") == "1"
+
+# Math expression like "2 + 3 * (4 - 1)"
+MATH_PATTERN = re.compile(r'^[\d\s\+\-\*\/\%\(\)]+$')
+
+# Common SQL injection patterns || compiled once instead of on every call
+SQL_KEYWORDS = [
+    "select", "insert", "update", "delete", "drop", "alter", "exec", "union", 
+    "create", "truncate", "--", ";", "/*", "*/", "@@", "char(", "nchar(", 
+    "varchar(", "cast(", "convert(", "information_schema", "xp_"
+]
+SQL_KEYWORD_PATTERN = re.compile(r"|".join(re.escape(keyword) for keyword in SQL_KEYWORDS))
+
+# Generic suspicious characters
+SQL_SUSPICIOUS_PATTERN = re.compile(r"(;|'|\-\-|\bOR\b|\bAND\b).*(=|LIKE)")
+
+# Valid English words || bundled artifact first, NLTK corpus only as a fallback
+def load_valid_words():
+    start = time.perf_counter()
+    if os.path.exists(WORDS_ARTIFACT):
+        valid_words = load_word_list(WORDS_ARTIFACT)
+    elif os.getenv("OFFLINE_START") == "1":
+        raise RuntimeError(f"Word list not found at {WORDS_ARTIFACT}, run 'python Startup.py --build-words' first")
+    else:
+        # For Streamlit kasi di nya ma detect || only downloads when the corpus is missing
+        nltk = timed_import("nltk")
+        try:
+            nltk.data.find("corpora/words")
+        except LookupError:
+            nltk.download('words')
+        from nltk.corpus import words
+        valid_words = set(words.words())
+    record_time("word list", start)
+    return valid_words
+
+class FuzzyWordIndex:
+    """Bigram index over the word list, grouped by word length, for fast fuzz.ratio lookups
+
+    fuzz.ratio is 2 * LCS / (len(a) + len(b)), so a threshold caps how many characters two
+    words may differ by. Every surviving bigram still has to show up in the candidate, which
+    lets us count shared bigrams from posting lists and only run fuzz.ratio on the few words
+    that can possibly pass. Results are the same as scanning the whole list.
+    """
+
+    def __init__(self, valid_words):
+        self.words_by_length = defaultdict(list)
+        self.postings = defaultdict(list)  # (word length, bigram) -> positions in words_by_length
+
+        for word in valid_words:
+            bucket = self.words_by_length[len(word)]
+            position = len(bucket)
+            bucket.append(word)
+            for bigram in self.bigrams(word):
+                self.postings[(len(word), bigram)].append(position)
+
+    def bigrams(self, word):
+        padded = f"\0{word}\0"  # Padding so first/last letters count too
+        return [padded[i:i + 2] for i in range(len(padded) - 1)]
+
+    def max_difference(self, n, m, threshold):
+        """Largest indel distance between words of length n and m that can still reach the threshold"""
+        best = None
+        for d in range(abs(n - m), n + m + 1, 2):  # distance has the same parity as n + m
+            if int(round(100 * (n + m - d) / (n + m))) < threshold:
+                break
+            best = d
+        return best
+
+    def has_similar_word(self, word, threshold=80):
+        n = len(word)
+        if n == 0:
+            return False
+        query_bigrams = self.bigrams(word)
+
+        for m in sorted(self.words_by_length, key=lambda length: abs(length - n)):
+            d = self.max_difference(n, m, threshold)
+            if d is None:
+                continue
+
+            # Deleting da letters from the word and db from the candidate reaches their LCS
+            da, db = (n - m + d) // 2, (m - n + d) // 2
+            min_shared = max(n + 1 - 2 * da - db, m + 1 - 2 * db - da)
+            bucket = self.words_by_length[m]
+
+            if min_shared <= 0:
+                # Too short to filter by bigrams, compare against the whole (small) bucket
+                candidates = bucket
+            else:
+                # A word sharing min_shared bigrams must contain one of the rarest (total - min_shared + 1),
+                # so only those posting lists produce candidates; the common ones just add to their counts
+                lists = sorted((self.postings.get((m, bigram), ()) for bigram in query_bigrams), key=len)
+                probe_size = len(query_bigrams) - min_shared + 1
+                shared = Counter(chain.from_iterable(lists[:probe_size]))
+                for positions in lists[probe_size:]:
+                    shared.update(filter(shared.__contains__, positions))
+                candidates = [bucket[position] for position, count in shared.items() if count >= min_shared]
+
+            for candidate in candidates:
+                if fuzz.ratio(word, candidate) >= threshold:
+                    return True
+        return False
 
-# For Streamlit kasi di nya ma detect
-nltk.download('words')
 
 class InputChecker:
     def __init__(self):
-        self.valid_words = set(words.words())  # Load valid words once
-        DetectorFactory.seed = 0  # For consistent language detection
+        self.valid_words = load_valid_words()  # Load valid words once
+        start = time.perf_counter()
+        self.word_index = FuzzyWordIndex(self.valid_words)  # Built once, used for typo lookups
+        record_time("word index", start)
 
     # Check if the word is similar to any real word [fuzzy ratio] - So the input can be a typo
     def is_similar_to_valid_word(self, word, threshold=80):
-        for valid_word in self.valid_words:
-            if fuzz.ratio(word, valid_word) >= threshold: 
-                return True
-        return False
+        with stage("fuzzy_lookup"):
+            return self.word_index.has_similar_word(word, threshold)
 
     # Check if the input is nonsensical
     def is_nonsensical_input(self, user_input):
         input_words = user_input.lower().split() 
-        print(f"[DEBUG] Input words: {input_words}")
+        debug(f"Input words: {input_words}")
         if len(input_words) <= 2:
-            print("[DEBUG] Passed: Too short for nonsense detection")
+            debug("Passed: Too short for nonsense detection")
             return False # Skips gibberish detection for short inputs (1-2 words) - more flexibility
 
         # 1. Regex check: single word of lowercase letters > 7 characters (e.g., "asdkjflasj")
         if ' ' not in user_input and re.match(r'^[a-z]+$', user_input) and len(user_input) > 7:
-            print(f"[DEBUG] Rejected: Found gibberish sequence in '{word}'")
+            debug(f"Rejected: Found gibberish sequence in '{user_input}'")
             return True
 
         # 2. Regex check: long sequences of vowels or consonants (e.g., "aeiou" or "bcdfgh")
+        if self.has_gibberish_sequence(input_words):
+            return True
+
+        # 3. Fuzzy dictionary check: allow up to 40% of words to be invalid (e.g., typos)
+        if self.has_too_many_invalid_words(input_words):
+            return True
+        
+        # 4. Language detection (only logged, it never rejects) || off unless LANGUAGE_DETECTION=1
+        if LANGUAGE_DETECTION:
+            self.detect_language(user_input)
+
+        # If all checks passed, input is not nonsensical
+        debug("Passed all nonsense checks")
+        return False
+
+    def has_gibberish_sequence(self, input_words):
         for word in input_words:
-            if re.search(r'(?i)([bcdfghjklmnpqrstvwxyz]{5,}|[aeiou]{5,})', word):
-                print(f"[DEBUG] Rejected: Found gibberish sequence in '{word}'")
+            if GIBBERISH_PATTERN.search(word):
+                debug(f"Rejected: Found gibberish sequence in '{word}'")
                 return True
+        return False
 
-        # 3. Fuzzy dictionary check: allow up to 40% of words to be invalid (e.g., typos)
+    def has_too_many_invalid_words(self, input_words):
+        """More than 60% of the words are neither known nor close to a known word"""
+        # Exact lookups first, fuzzy lookups only until the outcome is settled
+        unknown_words = [word for word in input_words if word not in self.valid_words and word not in {"mmcm", "mcm"}]
+        allowed_invalid = len(input_words) * 3 // 5  # most invalid words still under the 60% limit
         invalid_words = 0
-        for word in input_words:
-            if word in self.valid_words or word in {"mmcm", "mcm"}:
-                print(f"[DEBUG] Valid word: {word}")
-                continue
+        for checked, word in enumerate(unknown_words):
+            if invalid_words + len(unknown_words) - checked <= allowed_invalid:
+                break  # even if every remaining word is invalid the ratio stays under 60%
             if not self.is_similar_to_valid_word(word):
-                print(f"[DEBUG] Invalid word: {word}")
+                debug(f"Invalid word: {word}")
                 invalid_words += 1
+                if invalid_words > allowed_invalid:
+                    break
 
-        invalid_ratio = invalid_words / len(input_words)
-        print(f"[DEBUG] Invalid ratio: {invalid_ratio:.2f}")
-        if invalid_ratio > 0.6:
-            print("[DEBUG] Rejected: Too many invalid words")
+        debug(f"Invalid words: {invalid_words} of {len(input_words)} (unknown {len(unknown_words)})")
+        if invalid_words / len(input_words) > 0.6:
+            debug("Rejected: Too many invalid words")
             return True
-        
-        # 4. Language detection
-        lang = detect(user_input)
-        print(f"[DEBUG] Detected language: {lang}")
-
-        # If all checks passed, input is not nonsensical
-        print("[DEBUG] Passed all nonsense checks")
         return False
 
+    def detect_language(self, user_input):
+        """langdetect is only imported the first time it is needed"""
+        with stage("language_detection"):
+            langdetect = timed_import("langdetect")
+            langdetect.DetectorFactory.seed = 0  # For consistent language detection
+            try:
+                lang = langdetect.detect(user_input)
+            except langdetect.LangDetectException:
+                lang = None
+        debug(f"Detected language: {lang}")
+        return lang
+
     # Check if math expression
     def is_mathematical_expression(self, user_input):
         # Check for a math expression like "2 + 3 * (4 - 1)"
-        return re.match(r'^[\d\s\+\-\*\/\%\(\)]+$', user_input.strip()) is not None
+        return MATH_PATTERN.match(user_input.strip()) is not None
 
     # Check for SQL injection attempts
     def is_sql_injection_attempt(self, user_input):
@@ -73,25 +213,18 @@ class InputChecker:
         lowered = user_input.lower()
 
         # Common SQL injection patterns
-        sql_keywords = [
-            "select", "insert", "update", "delete", "drop", "alter", "exec", "union", 
-            "create", "truncate", "--", ";", "/*", "*/", "@@", "char(", "nchar(", 
-            "varchar(", "cast(", "convert(", "information_schema", "xp_"
-        ]
-
-        pattern = r"|".join(re.escape(keyword) for keyword in sql_keywords)
-        if re.search(pattern, lowered):
+        if SQL_KEYWORD_PATTERN.search(lowered):
             return True
 
         # Generic suspicious characters
-        if re.search(r"(;|'|\-\-|\bOR\b|\bAND\b).*(=|LIKE)", lowered):
+        if SQL_SUSPICIOUS_PATTERN.search(lowered):
             return True
 
         return False
 
     # Remove punctuation from the input text and contains keywords section
     def remove_punctuation(self, text):
-        return re.sub(r'[^\w\s]', '', text)
+        return PUNCTUATION_PATTERN.sub('', text)
 
     def contains_keywords(self, user_input, keywords):
         cleaned_input = self.remove_punctuation(user_input.lower())
@@ -0,0 +1,282 @@
+import asyncio
+import threading
+from collections import deque
+
+from Tracing import annotate, debug
+
+
+class FlightAbandoned(Exception):
+    """The leader went away before its answer was finished and nobody could finish it"""
+
+
+class Flight:
+    """One in-flight model answer: the chunks produced so far and how it ended"""
+
+    def __init__(self, key, question):
+        self.key = key
+        self.question = question
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.abandoned = False
+        self.waiters = 0
+        self.condition = threading.Condition()
+
+    def push(self, chunk):
+        with self.condition:
+            self.chunks.append(chunk)
+            self.condition.notify_all()
+
+    def finish(self, error=None, abandoned=False):
+        with self.condition:
+            self.done = True
+            self.error = error
+            self.abandoned = abandoned
+            self.condition.notify_all()
+
+    def outcome(self):
+        """Raise how the flight ended, if it did not end with an answer"""
+        if self.abandoned:
+            raise FlightAbandoned("the answer was left unfinished")
+        if self.error is not None:
+            raise self.error
+
+    def follow(self):
+        """Every chunk from the start, as the leader produces them; re-raises the leader's error"""
+        index = 0
+        while True:
+            with self.condition:
+                while index >= len(self.chunks) and not self.done:
+                    self.condition.wait()
+                chunks, done = self.chunks[index:], self.done
+            index += len(chunks)
+            yield from chunks
+            if done and index >= len(self.chunks):
+                self.outcome()
+                return
+
+    async def follow_async(self, poll_interval=0.02):
+        """Async version of follow || polls so the leader can run in any thread or event loop"""
+        index = 0
+        while True:
+            with self.condition:
+                chunks, done = self.chunks[index:], self.done
+            index += len(chunks)
+            for chunk in chunks:
+                yield chunk
+            if done and index >= len(self.chunks):
+                self.outcome()
+                return
+            if not chunks:
+                await asyncio.sleep(poll_interval)
+
+
+class SingleFlight:
+    """Identical questions asked at the same time share one model call
+
+    The first request for a key leads: it calls the model and publishes the answer (or the error).
+    Requests for the same key arriving before it finishes wait for that answer instead of making
+    their own call. How many waited is recorded per key for the recent flights.
+
+    A leader whose reader goes away does not take the followers down with it: a stream is finished
+    in the background for them, and when that is not possible (the call itself was cancelled) the
+    followers that have not shown anything yet ask again on their own.
+    """
+
+    def __init__(self, history=200):
+        self.flights = {}  # key -> Flight
+        self.recent = deque(maxlen=history)  # (question, waiters) of finished flights
+        self.counters = {"flights": 0, "coalesced": 0, "handed_over": 0, "abandoned": 0}
+        self.background = set()  # tasks finishing async streams for followers
+        self.lock = threading.Lock()
+
+    def join(self, key, question):
+        """Return (flight, True) for the leader or (flight, False) for a waiter"""
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is None:
+                flight = self.flights[key] = Flight(key, question)
+                self.counters["flights"] += 1
+                return flight, True
+            flight.waiters += 1
+            self.counters["coalesced"] += 1
+        annotate(coalesced=True)
+        debug(f"Joined an in-flight answer ({flight.waiters} waiting)")
+        return flight, False
+
+    def land(self, flight, error=None, abandoned=False):
+        """End a flight; later requests for its key start a new one"""
+        with self.lock:
+            if self.flights.get(flight.key) is flight:
+                del self.flights[flight.key]
+            self.recent.append((flight.question, flight.waiters))
+            if abandoned:
+                self.counters["abandoned"] += 1
+        annotate(flight_waiters=flight.waiters)
+        flight.finish(error, abandoned)
+
+    def leave(self, flight):
+        """The leader's reader went away || True when followers wait for the rest of the answer"""
+        with self.lock:
+            if flight.waiters:
+                self.counters["handed_over"] += 1
+                return True
+            # Nobody waits, and nobody can join a flight that is no longer listed
+            if self.flights.get(flight.key) is flight:
+                del self.flights[flight.key]
+            return False
+
+    def run(self, key, question, fn):
+        """fn() once for every concurrent caller with this key; fn returns the answer text"""
+        flight, leader = self.join(key, question)
+        if not leader:
+            try:
+                return "".join(chunk for chunk in flight.follow() if isinstance(chunk, str))
+            except FlightAbandoned:
+                return self.run(key, question, fn)
+        try:
+            response = fn()
+        except Exception as e:
+            self.land(flight, e)
+            raise
+        except BaseException:
+            self.land(flight, abandoned=True)
+            raise
+        flight.push(response)
+        self.land(flight)
+        return response
+
+    async def run_async(self, key, question, fn):
+        """Async version of run, fn() returns an awaitable"""
+        flight, leader = self.join(key, question)
+        if not leader:
+            try:
+                return "".join([chunk async for chunk in flight.follow_async() if isinstance(chunk, str)])
+            except FlightAbandoned:
+                return await self.run_async(key, question, fn)
+        try:
+            response = await fn()
+        except Exception as e:
+            self.land(flight, e)
+            raise
+        except BaseException:
+            # Cancelled, the followers ask again themselves
+            self.land(flight, abandoned=True)
+            raise
+        flight.push(response)
+        self.land(flight)
+        return response
+
+    def finish_for_followers(self, flight, chunks):
+        """Rest of a stream whose leader went away, for the followers only"""
+        error = None
+        try:
+            for chunk in chunks:
+                flight.push(chunk)
+        except Exception as e:
+            error = e
+        finally:
+            self.land(flight, error)
+
+    async def finish_for_followers_async(self, flight, chunks):
+        error = None
+        try:
+            async for chunk in chunks:
+                flight.push(chunk)
+        except Exception as e:
+            error = e
+        finally:
+            self.land(flight, error)
+
+    def stream(self, key, question, open_stream):
+        """Chunks of open_stream(), produced once and shared with every concurrent caller"""
+        flight, leader = self.join(key, question)
+        if not leader:
+            shown = False
+            try:
+                for chunk in flight.follow():
+                    shown = shown or isinstance(chunk, str)
+                    yield chunk
+                return
+            except FlightAbandoned:
+                if shown:
+                    raise
+            # Nothing was shown yet, so ask again (the first follower to get here leads)
+            yield from self.stream(key, question, open_stream)
+            return
+        chunks = iter(open_stream())
+        try:
+            for chunk in chunks:
+                flight.push(chunk)
+                yield chunk
+        except GeneratorExit:
+            # The leader's reader went away between chunks (a rerun, a closed connection)
+            if self.leave(flight):
+                debug(f"Answer handed over to {flight.waiters} waiting request(s)")
+                threading.Thread(target=self.finish_for_followers, args=(flight, chunks), daemon=True).start()
+            else:
+                self.land(flight)
+            raise
+        except Exception as e:
+            self.land(flight, e)
+            raise
+        except BaseException:
+            self.land(flight, abandoned=True)
+            raise
+        self.land(flight)
+
+    async def astream(self, key, question, open_stream):
+        """Async version of stream"""
+        flight, leader = self.join(key, question)
+        if not leader:
+            shown = False
+            try:
+                async for chunk in flight.follow_async():
+                    shown = shown or isinstance(chunk, str)
+                    yield chunk
+                return
+            except FlightAbandoned:
+                if shown:
+                    raise
+            async for chunk in self.astream(key, question, open_stream):
+                yield chunk
+            return
+        chunks = open_stream()
+        try:
+            async for chunk in chunks:
+                flight.push(chunk)
+                yield chunk
+        except GeneratorExit:
+            if self.leave(flight):
+                debug(f"Answer handed over to {flight.waiters} waiting request(s)")
+                try:
+                    task = asyncio.get_running_loop().create_task(self.finish_for_followers_async(flight, chunks))
+                except RuntimeError:
+                    # Closed outside of a running loop, nothing can finish the stream
+                    self.land(flight, abandoned=True)
+                    raise
+                self.background.add(task)
+                task.add_done_callback(self.background.discard)
+            else:
+                self.land(flight)
+            raise
+        except Exception as e:
+            self.land(flight, e)
+            raise
+        except BaseException:
+            # Cancelled mid-call, the followers ask again themselves
+            self.land(flight, abandoned=True)
+            raise
+        self.land(flight)
+
+    def stats(self):
+        with self.lock:
+            counters = dict(self.counters)
+            counters["in_flight"] = len(self.flights)
+        return counters
+
+    def hot_questions(self, n=5):
+        """The recent flights most requests waited on, as (question, waiters)"""
+        with self.lock:
+            recent = list(self.recent)
+        return sorted((item for item in recent if item[1]), key=lambda item: -item[1])[:n]
@@ -0,0 +1,93 @@
+import re
+
+# Rough stand-in for the model tokenizer || words count as one token per 4 letters, punctuation as one each
+TOKEN_PATTERN = re.compile(r"\w{1,4}|[^\w\s]")
+
+# Runs of whitespace, including the literal '\n' escapes stored in some Description cells
+WHITESPACE_PATTERN = re.compile(r"(?:\\n|\s)+")
+
+
+def count_tokens(text):
+    """Estimate how many tokens the model will see for this text"""
+    return len(TOKEN_PATTERN.findall(text))
+
+
+def clip_tokens(text, max_tokens):
+    """The start of text holding at most max_tokens tokens"""
+    for index, match in enumerate(TOKEN_PATTERN.finditer(text)):
+        if index == max_tokens:
+            return text[:match.start()].rstrip() + " ..."
+    return text
+
+
+def format_entry(row):
+    """One handbook row without its headers and empty cells: '[ID] Description | Sanctions: ... | p. 46'"""
+    offense_id, _, _, description, sanctions, page = row
+    description = WHITESPACE_PATTERN.sub(" ", description or "").strip()
+    parts = [f"[{offense_id}] {description}" if offense_id else description]
+    if sanctions:
+        parts.append(f"Sanctions: {sanctions}")
+    if page:
+        parts.append(f"p. {page}")
+    return " | ".join(parts)
+
+
+class ContextBuilder:
+    """Packs handbook rows into the prompt under a token budget
+
+    Rows are taken in the order given (most relevant first) while they fit; a row that does not fit
+    is skipped so smaller ones after it can still be used. The packed rows are then written grouped
+    under their Type and Category headers, each header only once.
+    """
+
+    def __init__(self, budget_tokens=6000):
+        self.budget_tokens = budget_tokens
+        self.entries = {}  # row -> (formatted entry, tokens) || rows are plain tuples, the same ones every request
+
+    def preload(self, rows, entries):
+        """Use precompiled (formatted entry, tokens) pairs for a new handbook version, dropping the old ones"""
+        self.entries = dict(zip(rows, entries))
+
+    def entry(self, row):
+        cached = self.entries.get(row)
+        if cached is None:
+            text = format_entry(row)
+            cached = self.entries[row] = (text, count_tokens(text))
+        return cached
+
+    def select(self, rows):
+        """Pick the rows that fit the budget, counting each header the first time it is needed; returns (rows, tokens)"""
+        selected = []
+        seen_headers = set()
+        used = 0
+        for row in rows:
+            cost = self.entry(row)[1] + 1
+            new_headers = [header for header in ((row[1],), (row[1], row[2])) if header[-1] and header not in seen_headers]
+            cost += sum(count_tokens(header[-1]) + 2 for header in new_headers)
+            if self.budget_tokens and used + cost > self.budget_tokens:
+                continue
+            selected.append(row)
+            seen_headers.update(new_headers)
+            used += cost
+        return selected, used
+
+    def render(self, rows):
+        """Group rows under their headers, groups in order of first appearance"""
+        groups = {}
+        for row in rows:
+            groups.setdefault(row[1], {}).setdefault(row[2], []).append(row)
+
+        lines = []
+        for type_name, categories in groups.items():
+            if type_name:
+                lines.append(f"## {type_name}")
+            for category, category_rows in categories.items():
+                if category:
+                    lines.append(f"# {category}")
+                lines.extend(f"- {self.entry(row)[0]}" for row in category_rows)
+        return "\n".join(lines)
+
+    def build(self, rows):
+        """Return (context text, tokens used, rows packed)"""
+        selected, tokens = self.select(rows)
+        return self.render(selected), tokens, len(selected)
@@ -0,0 +1,197 @@
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+from Checkers import normalize_query
+from Offenses import LOOKUP_TYPES
+from Paraphrase import ParaphraseIndex
+from Tracing import debug
+
+# Artifact layout version || bump when the file format changes
+FAQ_FORMAT = 1
+
+# Section names as students say them
+SECTION_PREFIX_PATTERN = re.compile(r"^[A-Z]\.\s+")
+PARENTHESES_PATTERN = re.compile(r"\s*\([^)]*\)")
+
+# Other names students use for a section
+TOPIC_ALIASES = {
+    "STANDARD ATTIRE ON CAMPUS": ["dress code", "school uniform"],
+    "MCM GRADING SYSTEM": ["grading system"],
+    "TUITION FEES & OTHER CHARGES": ["tuition fees"],
+}
+
+# Canonical wordings asked for every topic
+QUESTION_TEMPLATES = ["what is the {topic}", "what are the rules on {topic}"]
+OFFENSE_TEMPLATES = ["what are the {topic}", "what are the sanctions for {topic}"]
+
+
+def topic_name(name):
+    """'A. Freedom of Expression' -> 'freedom of expression', 'ADMISSION GUIDELINES | FOR DEGREE HOLDERS' -> 'admission guidelines for degree holders'"""
+    name = SECTION_PREFIX_PATTERN.sub("", name.strip())
+    name = PARENTHESES_PATTERN.sub("", name).replace("|", " ")
+    return normalize_query(name)
+
+
+def canonical_questions(sections):
+    """(question, type, category) for every handbook section (Type -> Category -> rows index), each question once"""
+    questions = {}
+    for type_name, categories in sections.items():
+        if not type_name:
+            continue
+        templates = OFFENSE_TEMPLATES if type_name in LOOKUP_TYPES else QUESTION_TEMPLATES
+        topics = [(topic, None) for topic in [topic_name(type_name)] + TOPIC_ALIASES.get(type_name, [])]
+        topics += [(topic_name(category), category) for category in categories if category and category != type_name]
+        for topic, topic_category in topics:
+            for template in templates:
+                questions.setdefault(template.format(topic=topic), (type_name, topic_category))
+    return [(question, type_name, category) for question, (type_name, category) in questions.items()]
+
+
+class FaqArtifact:
+    """Precomputed answers, valid for one handbook version and prompt"""
+
+    def __init__(self, handbook_version, prompt_hash, entries, generated_at=None):
+        self.handbook_version = handbook_version
+        self.prompt_hash = prompt_hash
+        self.entries = entries  # [{"question", "type", "category", "answer"}]
+        self.generated_at = generated_at or time.time()
+
+    def matches(self, handbook_version, prompt_hash):
+        return self.handbook_version == handbook_version and self.prompt_hash == prompt_hash
+
+    def save(self, path):
+        """Write the artifact atomically, readers never see half a file"""
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        payload = {
+            "format": FAQ_FORMAT,
+            "handbook_version": self.handbook_version,
+            "prompt_hash": self.prompt_hash,
+            "generated_at": self.generated_at,
+            "entries": self.entries,
+        }
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, indent=1)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """The artifact at path, or None if it is missing, unreadable or of another format"""
+        try:
+            with open(path, encoding="utf-8") as f:
+                payload = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if payload.get("format") != FAQ_FORMAT:
+            return None
+        return cls(payload["handbook_version"], payload["prompt_hash"], payload["entries"], payload["generated_at"])
+
+
+class FaqIndex:
+    """Serves artifact answers for the canonical questions and close rephrasings of them"""
+
+    def __init__(self, artifact, threshold=0.9):
+        self.artifact = artifact
+        self.scope = (artifact.handbook_version, artifact.prompt_hash)
+        self.exact = {normalize_query(entry["question"]): entry["answer"] for entry in artifact.entries}
+        self.similar = ParaphraseIndex(threshold, max_entries=max(len(self.exact), 1))
+        for question, answer in self.exact.items():
+            self.similar.add(question, answer, self.scope)
+
+    def lookup(self, user_input):
+        answer = self.exact.get(normalize_query(user_input))
+        if answer is not None:
+            return answer
+        return self.similar.lookup(user_input, self.scope)
+
+
+class FaqStore:
+    """Loads the artifact when its file changes and rebuilds it in the background once it is stale
+
+    build() must write an artifact for the current handbook to the same path. Only one build runs at a
+    time, and a handbook version is built again at most every retry_seconds (when a build failed).
+    """
+
+    def __init__(self, path, threshold=0.9, build=None, retry_seconds=600):
+        self.path = path
+        self.threshold = threshold
+        self.build = build
+        self.retry_seconds = retry_seconds
+        self.index = None
+        self.file_signature = None
+        self.build_started = {}  # handbook version -> time of its last build
+        self.building = None
+        self.lock = threading.Lock()
+
+    def read_file_signature(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def get(self, handbook_version, prompt_hash):
+        """The FaqIndex for this handbook and prompt, or None while there is no matching artifact"""
+        with self.lock:
+            file_signature = self.read_file_signature()
+            if file_signature != self.file_signature:
+                artifact = FaqArtifact.load(self.path) if file_signature is not None else None
+                self.index = FaqIndex(artifact, self.threshold) if artifact is not None else None
+                self.file_signature = file_signature
+            if self.index is not None and self.index.artifact.matches(handbook_version, prompt_hash):
+                return self.index
+            self.start_build(handbook_version)
+            return None
+
+    def start_build(self, handbook_version):
+        """Rebuild for this handbook version in a background thread (call with the lock held)"""
+        if self.build is None:
+            return
+        last = self.build_started.get(handbook_version)
+        if last is not None and time.monotonic() - last < self.retry_seconds:
+            return
+        if self.building is not None and self.building.is_alive():
+            return
+        self.build_started[handbook_version] = time.monotonic()
+        debug(f"FAQ artifact missing or stale, rebuilding for handbook {handbook_version}")
+        self.building = threading.Thread(target=self.run_build, daemon=True)
+        self.building.start()
+
+    def run_build(self):
+        try:
+            self.build()
+        except Exception as e:
+            debug(f"FAQ build failed, retrying in {self.retry_seconds:.0f} s at the earliest: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute answers to the canonical handbook questions")
+    parser.add_argument("--db", default=os.path.join("database", "databasefinalnjud.db"))
+    parser.add_argument("--out", help="artifact path (default: FAQ_PATH)")
+    parser.add_argument("--concurrency", type=int, help="model calls at once (default: FAQ_BUILD_CONCURRENCY, at most LLM_QUEUE_PER_SESSION)")
+    parser.add_argument("--list", action="store_true", help="only print the canonical questions")
+    args = parser.parse_args()
+
+    # Imported here since bot_back imports this module
+    import bot_back
+
+    if args.list:
+        for question, type_name, category in canonical_questions(bot_back.get_handbook(args.db).sections):
+            print(f"{question}\t{type_name}\t{category or ''}")
+        return 0
+
+    start = time.perf_counter()
+    artifact = bot_back.build_faq(args.db, args.out, args.concurrency)
+    print(f"{len(artifact.entries)} answers for handbook {artifact.handbook_version} in {time.perf_counter() - start:.1f} s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
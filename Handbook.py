@@ -0,0 +1,91 @@
+import hashlib
+import os
+import sqlite3
+import threading
+
+from HandbookArtifact import CompiledHandbook, artifact_path, source_hash
+from Offenses import section_index
+from Retrieval import format_rows
+from Tracing import debug
+
+
+class HandbookData:
+    """Immutable view of the databaseBot table at one point in time
+
+    compiled is the CompiledHandbook these rows came from, None when they were read straight from the table.
+    """
+
+    def __init__(self, rows, compiled=None):
+        self.rows = rows
+        self.compiled = compiled
+        self.sections = compiled.sections if compiled is not None else section_index(rows)
+        self.content = format_rows(rows)
+        # Short content hash, changes only when the handbook itself changes
+        self.version = compiled.version if compiled is not None else hashlib.sha256(self.content.encode("utf-8")).hexdigest()[:16]
+
+
+class HandbookSnapshot:
+    """Loads the handbook once and reloads it only when the database file changes
+
+    With an artifact directory the handbook comes from its compiled artifact, which is (re)compiled
+    whenever it does not match the database file.
+    """
+
+    def __init__(self, db_path, artifact_dir=None):
+        self.db_path = os.path.abspath(db_path)
+        self.artifact_path = artifact_path(artifact_dir, self.db_path) if artifact_dir else None
+        self.lock = threading.Lock()
+        self.conn = None
+        self.file_signature = None
+        self.data_version = None
+        self.data = None
+
+    def open_connection(self):
+        """Open a reusable read-only connection to the database"""
+        if self.conn is not None:
+            self.conn.close()
+        # mode=ro rather than immutable=1, otherwise SQLite would hide later edits from us
+        self.conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+
+    def read_file_signature(self):
+        """mtime and size of the database file (catches the file being replaced)"""
+        stat = os.stat(self.db_path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def read_data_version(self):
+        """PRAGMA data_version changes when another connection commits to the file"""
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def load_compiled(self):
+        """The compiled handbook for the current database file, compiling it if the artifact is missing or stale"""
+        source = source_hash(self.db_path)
+        compiled = CompiledHandbook.load(self.artifact_path, source)
+        if compiled is None:
+            debug("Handbook artifact missing or stale, compiling")
+            compiled = CompiledHandbook.compile(self.conn.execute("SELECT * from databaseBot").fetchall())
+            try:
+                compiled.save(self.artifact_path, source)
+            except OSError as e:
+                debug(f"Could not write the handbook artifact, serving the compiled handbook from memory: {e}")
+        return compiled
+
+    def reload(self, file_signature):
+        self.open_connection()
+        if self.artifact_path:
+            compiled = self.load_compiled()
+            self.data = HandbookData(compiled.rows, compiled)
+        else:
+            self.data = HandbookData(self.conn.execute("SELECT * from databaseBot").fetchall())
+        self.file_signature = file_signature
+        self.data_version = self.read_data_version()
+
+    def get(self):
+        """Return the current HandbookData, reloading it only if the database changed"""
+        with self.lock:
+            file_signature = self.read_file_signature()
+            if self.data is None or file_signature != self.file_signature:
+                self.reload(file_signature)
+            elif self.read_data_version() != self.data_version:
+                self.reload(file_signature)
+            return self.data
+
@@ -0,0 +1,176 @@
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import sys
+import time
+
+from Context import count_tokens, format_entry
+from Offenses import offense_children, parse_pages, section_index
+from Retrieval import build_search_index, format_rows
+
+# File layout version || bump when the layout or the compiled structures change
+ARTIFACT_FORMAT = 3
+MAGIC = b"MMCHB\x00"
+
+# Magic, then the header length, the header (JSON) and the sections it points at
+HEADER_LENGTH = struct.Struct("<I")
+
+
+def source_hash(db_path):
+    """sha256 of the database file (and its WAL, if any), so any edit makes the artifact stale"""
+    digest = hashlib.sha256()
+    for path in (db_path, f"{db_path}-wal"):
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+def artifact_path(directory, db_path):
+    return os.path.join(directory, os.path.basename(db_path) + ".artifact")
+
+
+class CompiledHandbook:
+    """Normalized databaseBot with everything query-time components would otherwise derive per process
+
+    rows        the raw rows (tuples, in table order)
+    entries     (prompt entry, tokens) per row for the context packer
+    pages       parsed (first, last) page range per row, None when the cell is not a page number/range
+    children    offense hierarchy, '2' -> ['2.a', ...]
+    sections    Type -> Category -> row indexes, in handbook order (FAQ questions, offense categories)
+    search      serialized SQLite FTS5 index of the rows
+    """
+
+    def __init__(self, version, rows, entries, pages, children, sections, search):
+        self.version = version
+        self.rows = rows
+        self.entries = entries
+        self.pages = pages
+        self.children = children
+        self.sections = sections
+        self.search = search
+
+    @classmethod
+    def compile(cls, rows):
+        content = format_rows(rows)
+        entries = []
+        for row in rows:
+            text = format_entry(row)
+            entries.append((text, count_tokens(text)))
+        return cls(
+            hashlib.sha256(content.encode("utf-8")).hexdigest()[:16],
+            rows,
+            entries,
+            [parse_pages(row[5]) for row in rows],
+            offense_children([row[0] for row in rows if row[0]]),
+            section_index(rows),
+            build_search_index(rows).serialize(),
+        )
+
+    def save(self, path, source):
+        """Write the artifact atomically"""
+        data = json.dumps({
+            "version": self.version,
+            "rows": self.rows,
+            "entries": self.entries,
+            "pages": self.pages,
+            "children": self.children,
+            "sections": self.sections,
+        }, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        header = json.dumps({
+            "format": ARTIFACT_FORMAT,
+            "source_hash": source,
+            "built_at": time.time(),
+            "data_length": len(data),
+            "search_length": len(self.search),
+            "checksum": hashlib.sha256(data + self.search).hexdigest(),
+        }).encode("utf-8")
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(MAGIC + HEADER_LENGTH.pack(len(header)) + header + data + self.search)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path, source):
+        """The artifact at path if it was compiled from this source hash and is intact, otherwise None"""
+        try:
+            with open(path, "rb") as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                    return cls.from_view(view, source)
+        except (OSError, ValueError, KeyError, struct.error):
+            return None
+
+    @classmethod
+    def from_view(cls, view, source):
+        """The header is read and the checksum taken in place; only the data and search sections are copied out"""
+        start = len(MAGIC) + HEADER_LENGTH.size
+        if view[:len(MAGIC)] != MAGIC:
+            return None
+        (header_length,) = HEADER_LENGTH.unpack(view[len(MAGIC):start])
+        header = json.loads(view[start:start + header_length])
+        # The source hash is checked before touching the body, a stale artifact costs almost nothing
+        if header["format"] != ARTIFACT_FORMAT or header["source_hash"] != source:
+            return None
+        data_start = start + header_length
+        search_start = data_start + header["data_length"]
+        search_end = search_start + header["search_length"]
+        with memoryview(view) as buffer:
+            if hashlib.sha256(buffer[data_start:search_end]).hexdigest() != header["checksum"]:
+                return None
+
+        # json and SQLite need bytes of their own, each section is copied once
+        data = json.loads(view[data_start:search_start])
+        return cls(
+            data["version"],
+            [tuple(row) for row in data["rows"]],
+            [tuple(entry) for entry in data["entries"]],
+            [tuple(page) if page else None for page in data["pages"]],
+            data["children"],
+            data["sections"],
+            view[search_start:search_end],
+        )
+
+
+def compile_database(db_path, path):
+    """Compile the databaseBot table of db_path and write it to path"""
+    source = source_hash(db_path)
+    conn = sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True)
+    try:
+        rows = conn.execute("SELECT * from databaseBot").fetchall()
+    finally:
+        conn.close()
+    compiled = CompiledHandbook.compile(rows)
+    compiled.save(path, source)
+    return compiled
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile the handbook database into a versioned artifact")
+    parser.add_argument("--db", default=os.path.join("database", "databasefinalnjud.db"))
+    parser.add_argument("--out", help="artifact path (default: <HANDBOOK_ARTIFACT_DIR>/<db name>.artifact)")
+    parser.add_argument("--check", action="store_true", help="only report whether the artifact is current")
+    args = parser.parse_args()
+    path = args.out or artifact_path(os.getenv("HANDBOOK_ARTIFACT_DIR", "cache"), args.db)
+
+    start = time.perf_counter()
+    if args.check:
+        compiled = CompiledHandbook.load(path, source_hash(args.db))
+        state = f"current (handbook {compiled.version})" if compiled is not None else "missing or stale"
+        print(f"{path}: {state}, checked in {(time.perf_counter() - start) * 1000:.1f} ms")
+        return 0 if compiled is not None else 1
+
+    compiled = compile_database(args.db, path)
+    print(f"Compiled {len(compiled.rows)} rows (handbook {compiled.version}) to {path} in {(time.perf_counter() - start) * 1000:.1f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,208 @@
+import re
+import threading
+import time
+from collections import deque
+from functools import cached_property
+
+from Checkers import LANGUAGE_DETECTION, MATH_PATTERN, PUNCTUATION_PATTERN, SQL_KEYWORDS, SQL_SUSPICIOUS_PATTERN
+from Tracing import debug, record_stage, stage
+
+# General "what is MMCM" question
+MMCM_QUESTION_PATTERN = re.compile(r"\b(what is|who.*is|tell me about)\b.*\b(mmcm|mcm)\b")
+
+# Greetings only count for short messages (e.g. "hello there!")
+GREETING_MAX_LENGTH = 17
+
+
+class AhoCorasick:
+    """Finds every tagged keyword occurring in a text in one pass"""
+
+    def __init__(self, tagged_keywords):
+        self.goto = [{}]     # state -> {character: next state}
+        self.fail = [0]      # state -> fallback state
+        self.output = [[]]   # state -> [(tag, keyword)] ending here
+
+        for tag, keyword in tagged_keywords:
+            state = 0
+            for character in keyword:
+                if character not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[state][character] = len(self.goto) - 1
+                state = self.goto[state][character]
+            self.output[state].append((tag, keyword))
+
+        # Breadth-first so every fail link points to an already finished state
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for character, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and character not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(character, 0)
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+
+    def scan(self, text):
+        """Return {tag: first keyword found} for every tag with a match"""
+        found = {}
+        state = 0
+        for character in text:
+            while state and character not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(character, 0)
+            for tag, keyword in self.output[state]:
+                found.setdefault(tag, keyword)
+        return found
+
+
+class Message:
+    """One already stripped, lowercased message plus the work its checks share, each computed at most once"""
+
+    def __init__(self, text, router):
+        self.text = text
+        self.router = router
+
+    @cached_property
+    def stripped(self):
+        return self.text.strip()
+
+    @cached_property
+    def words(self):
+        return self.text.lower().split()
+
+    @cached_property
+    def long_enough(self):
+        """The word checks skip 1-2 word messages (more flexibility for short inputs)"""
+        return len(self.words) > 2
+
+    @cached_property
+    def raw_matches(self):
+        return self.router.raw_automaton.scan(self.text)
+
+    @cached_property
+    def cleaned_matches(self):
+        return self.router.cleaned_automaton.scan(PUNCTUATION_PATTERN.sub('', self.text))
+
+
+class Check:
+    """One reject check with its declared cost; check(message) returns the reason to reject or None"""
+
+    def __init__(self, name, cost, check, applies=None):
+        self.name = name
+        self.cost = cost
+        self.check = check
+        self.applies = applies or (lambda message: True)
+
+
+class ValidationPipeline:
+    """Runs the reject checks cheapest first and stops at the first rejection
+
+    Counts per check how often it ran, rejected, was skipped because an earlier check already
+    rejected, or did not apply to the message.
+    """
+
+    def __init__(self, checks):
+        self.checks = sorted(checks, key=lambda check: check.cost)
+        self.counters = {check.name: {"run": 0, "rejected": 0, "skipped": 0, "not_applicable": 0} for check in self.checks}
+        self.lock = threading.Lock()
+
+    def count(self, name, outcome):
+        with self.lock:
+            self.counters[name][outcome] += 1
+
+    def run(self, message):
+        """Return (check name, reason) of the first rejection, or None when every check passes"""
+        for position, check in enumerate(self.checks):
+            if not check.applies(message):
+                self.count(check.name, "not_applicable")
+                continue
+            self.count(check.name, "run")
+            with stage(f"check_{check.name}"):
+                reason = check.check(message)
+            if reason:
+                self.count(check.name, "rejected")
+                for skipped in self.checks[position + 1:]:
+                    self.count(skipped.name, "skipped")
+                return check.name, reason
+        return None
+
+    def stats(self):
+        with self.lock:
+            return {name: dict(counters) for name, counters in self.counters.items()}
+
+
+class IntentRouter:
+    """Classifies a message with the same precedence as the old if/elif cascade
+
+    Intents, in order: reject, goodbye, greeting, identity, mmcm, mmcm_general, in_scope and
+    unmatched (not a known topic, still sent to the model). Keyword lists are matched against the
+    punctuation-stripped text like contains_keywords, identity phrases and SQL keywords against the
+    raw lowercased text like before. The reject checks run first as a cost-ordered pipeline.
+    """
+
+    def __init__(self, input_checker, greeting_keywords, goodbye_keywords, identity_keywords, accepted_keywords):
+        self.input_checker = input_checker
+        self.cleaned_automaton = AhoCorasick(
+            [("goodbye", keyword) for keyword in goodbye_keywords] +
+            [("greeting", keyword) for keyword in greeting_keywords] +
+            [("accepted", keyword) for keyword in accepted_keywords]
+        )
+        self.raw_automaton = AhoCorasick(
+            [("identity", keyword) for keyword in identity_keywords] +
+            [("sql", keyword) for keyword in SQL_KEYWORDS]
+        )
+
+        def log_language(message):
+            input_checker.detect_language(message.text)  # logged only, it never rejects
+            return None
+
+        # Declared costs are rough microseconds per message || dangerous or nonsensical inputs are rejected
+        checks = [
+            Check("math", 1, lambda message: "math" if MATH_PATTERN.match(message.stripped) else None),
+            Check("sql_pattern", 1, lambda message: "sql" if SQL_SUSPICIOUS_PATTERN.search(message.text) else None),
+            Check("sql_keywords", 5, lambda message: message.raw_matches.get("sql")),
+            Check("gibberish", 5, lambda message: "nonsense" if input_checker.has_gibberish_sequence(message.words) else None,
+                  lambda message: message.long_enough),
+            Check("dictionary", 500, lambda message: "nonsense" if input_checker.has_too_many_invalid_words(message.words) else None,
+                  lambda message: message.long_enough),
+        ]
+        if LANGUAGE_DETECTION:
+            checks.append(Check("language", 5000, log_language, lambda message: message.long_enough))
+        self.pipeline = ValidationPipeline(checks)
+
+    def classify(self, user_input):
+        """Return (intent, matched keyword or None) for an already stripped, lowercased message"""
+        message = Message(user_input, self)
+
+        rejected = self.pipeline.run(message)
+        if rejected:
+            debug(f"Rejected by the {rejected[0]} check ({rejected[1]})")
+            return "reject", rejected[1]
+
+        raw_matches = message.raw_matches
+        cleaned_matches = message.cleaned_matches
+
+        if "goodbye" in cleaned_matches:
+            return "goodbye", cleaned_matches["goodbye"]
+        if "greeting" in cleaned_matches and len(user_input) <= GREETING_MAX_LENGTH:
+            return "greeting", cleaned_matches["greeting"]
+        if "identity" in raw_matches:
+            return "identity", raw_matches["identity"]
+        if message.stripped in {"mmcm", "mcm"}:
+            return "mmcm", message.stripped
+        if "accepted" not in cleaned_matches and MMCM_QUESTION_PATTERN.search(user_input):
+            return "mmcm_general", None
+        if "accepted" in cleaned_matches:
+            return "in_scope", cleaned_matches["accepted"]
+        return "unmatched", None
+
+    def route(self, user_input):
+        """Classify and time a message"""
+        start = time.perf_counter()
+        intent, keyword = self.classify(user_input)
+        elapsed = time.perf_counter() - start
+        record_stage("routing", elapsed)
+        return {"intent": intent, "keyword": keyword, "elapsed_ms": elapsed * 1000}
@@ -0,0 +1,122 @@
+import asyncio
+import os
+import random
+import re
+import time
+
+from Startup import timed_import
+
+GEMINI_MODEL = "gemini-2.5-flash-preview-05-20"
+
+
+class GeminiBackend:
+    """Gemini through LangChain (the production model)"""
+
+    def __init__(self, api_key, model_name=GEMINI_MODEL, temperature=0.2):
+        # LangChain and the Gemini client are imported here instead of at startup
+        genai = timed_import("langchain_google_genai")
+
+        # Initialize model || conversation memory is kept per chat by bot_back and written into the prompt
+        self.model = genai.ChatGoogleGenerativeAI(model=model_name, temperature=temperature, api_key=api_key)
+        #self.model = genai.ChatGoogleGenerativeAI(model="gemini-1.5-flash-8b", api_key=api_key)
+
+    def generate(self, prompt_text, question=None):
+        return self.model.invoke(prompt_text).content
+
+    async def agenerate(self, prompt_text, question=None):
+        return (await self.model.ainvoke(prompt_text)).content
+
+    def stream(self, prompt_text, question=None):
+        for chunk in self.model.stream(prompt_text):
+            if chunk.content:
+                yield chunk.content
+
+    async def astream(self, prompt_text, question=None):
+        async for chunk in self.model.astream(prompt_text):
+            if chunk.content:
+                yield chunk.content
+
+
+class StubBackend:
+    """Offline stand-in for the model with configurable latency and token rate
+
+    mode "echo" repeats the question, "canned" always gives the same answer and "unavailable"
+    answers 'Unavailable' like the real model does for off-topic questions. failure_rate is the share
+    of calls that fail after the latency, like an upstream error would.
+    """
+
+    def __init__(self, mode="echo", answer="This is a stub answer. We recommend you to check page(s) 46 in the handbook for more details.",
+                 latency=0.0, tokens_per_second=0.0, failure_rate=0.0):
+        self.mode = mode
+        self.answer = answer
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.failure_rate = failure_rate
+
+    def maybe_fail(self):
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise RuntimeError("stub backend failure")
+
+    def make_answer(self, prompt_text, question):
+        if self.mode == "unavailable":
+            return "Unavailable"
+        if self.mode == "canned":
+            return self.answer
+        return f"You asked: {question if question is not None else prompt_text}"
+
+    def tokens(self, answer):
+        return re.findall(r"\S+\s*", answer) or [answer]
+
+    def token_delay(self):
+        return 1 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+    def generate(self, prompt_text, question=None):
+        return "".join(self.stream(prompt_text, question))
+
+    async def agenerate(self, prompt_text, question=None):
+        return "".join([token async for token in self.astream(prompt_text, question)])
+
+    def stream(self, prompt_text, question=None):
+        time.sleep(self.latency)
+        self.maybe_fail()
+        for index, token in enumerate(self.tokens(self.make_answer(prompt_text, question))):
+            if index:
+                time.sleep(self.token_delay())
+            yield token
+
+    async def astream(self, prompt_text, question=None):
+        await asyncio.sleep(self.latency)
+        self.maybe_fail()
+        for index, token in enumerate(self.tokens(self.make_answer(prompt_text, question))):
+            if index:
+                await asyncio.sleep(self.token_delay())
+            yield token
+
+
+def backend_identity(name):
+    """The backend named by LLM_BACKEND plus the settings that shape its answers, without building it
+
+    Part of every cache scope, so answers of one model (or of the stub) are never served for another.
+    """
+    if name == "gemini":
+        return f"gemini:{os.getenv('GEMINI_MODEL', GEMINI_MODEL)}"
+    if name == "stub":
+        return f"stub:{os.getenv('STUB_MODE', 'echo')}:{os.getenv('STUB_ANSWER', '')}"
+    raise ValueError(f"Unknown LLM backend '{name}', expected 'gemini' or 'stub'")
+
+
+def create_backend(name, api_key=None):
+    """Build the backend named by LLM_BACKEND ('gemini' or 'stub'); stub settings come from STUB_* variables"""
+    if name == "gemini":
+        return GeminiBackend(api_key, model_name=os.getenv("GEMINI_MODEL", GEMINI_MODEL))
+    if name == "stub":
+        backend = StubBackend(
+            mode=os.getenv("STUB_MODE", "echo"),
+            latency=float(os.getenv("STUB_LATENCY", "0")),
+            tokens_per_second=float(os.getenv("STUB_TOKENS_PER_SECOND", "0")),
+            failure_rate=float(os.getenv("STUB_FAILURE_RATE", "0"))
+        )
+        if os.getenv("STUB_ANSWER"):
+            backend.answer = os.getenv("STUB_ANSWER")
+        return backend
+    raise ValueError(f"Unknown LLM backend '{name}', expected 'gemini' or 'stub'")
@@ -0,0 +1,102 @@
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+
+from Context import clip_tokens, count_tokens
+
+# Words that point back at an earlier turn || such questions cannot be answered (or cached) on their own
+FOLLOW_UP_PATTERN = re.compile(
+    r"\b(it|its|that|this|those|these|they|them|their|same|else|again|above|previous|earlier)\b"
+    r"|\b(what|how) about\b|^(and|but|so|then)\b"
+)
+
+
+def is_follow_up(question):
+    return FOLLOW_UP_PATTERN.search(question) is not None
+
+
+class ConversationMemory:
+    """The last few question/answer turns of each chat, bounded per chat and in total
+
+    A chat keeps at most max_turns turns and max_tokens tokens (oldest turns go first, a single long
+    answer is clipped). At most max_sessions chats are kept; the least recently used one is dropped
+    when a new chat arrives, and chats idle for idle_seconds are dropped as well.
+    """
+
+    def __init__(self, max_turns=3, max_tokens=600, max_sessions=1000, idle_seconds=1800):
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self.sessions = OrderedDict()  # chat_id -> (last_used, deque of (question, answer, tokens))
+        self.evicted = 0
+        self.lock = threading.Lock()
+
+    def evict_idle(self, now):
+        """Drop chats past the idle limit (call with the lock held) || the oldest are at the front"""
+        while self.sessions:
+            chat_id, (last_used, _) = next(iter(self.sessions.items()))
+            if now - last_used <= self.idle_seconds:
+                break
+            del self.sessions[chat_id]
+            self.evicted += 1
+
+    def remember(self, chat_id, question, answer):
+        if not chat_id or self.max_turns <= 0:
+            return
+        question, answer = clip_tokens(question, self.max_tokens // 4), clip_tokens(answer, self.max_tokens // 2)
+        turn = (question, answer, count_tokens(question) + count_tokens(answer))
+        now = time.time()
+        with self.lock:
+            self.evict_idle(now)
+            entry = self.sessions.pop(chat_id, None)
+            turns = entry[1] if entry is not None else deque()
+            turns.append(turn)
+            while len(turns) > self.max_turns or (len(turns) > 1 and sum(t[2] for t in turns) > self.max_tokens):
+                turns.popleft()
+            self.sessions[chat_id] = (now, turns)
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+                self.evicted += 1
+
+    def restore(self, chat_id, messages):
+        """Rebuild a chat's turns from its saved messages, unless they are still in memory"""
+        with self.lock:
+            if not chat_id or chat_id in self.sessions:
+                return
+        pairs = []
+        for previous, message in zip(messages, messages[1:]):
+            if previous["role"] == "user" and message["role"] == "assistant":
+                pairs.append((previous["content"], message["content"]))
+        for question, answer in pairs[-self.max_turns:]:
+            self.remember(chat_id, question, answer)
+
+    def history(self, chat_id):
+        """The remembered (question, answer) turns of a chat, oldest first"""
+        now = time.time()
+        with self.lock:
+            self.evict_idle(now)
+            entry = self.sessions.get(chat_id)
+            if entry is None:
+                return []
+            self.sessions[chat_id] = (now, entry[1])
+            self.sessions.move_to_end(chat_id)
+            return [(question, answer) for question, answer, _ in entry[1]]
+
+    def forget(self, chat_id):
+        with self.lock:
+            self.sessions.pop(chat_id, None)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "sessions": len(self.sessions),
+                "turns": sum(len(turns) for _, turns in self.sessions.values()),
+                "tokens": sum(turn[2] for _, turns in self.sessions.values() for turn in turns),
+                "evicted": self.evicted,
+            }
+
+
+def format_history(turns):
+    return " ".join(f"Student: {question} MMCMate: {answer}" for question, answer in turns)
@@ -0,0 +1,186 @@
+import re
+
+# Handbook types whose categories are plain lookups (offense lists and the sanctions they refer to)
+LOOKUP_TYPES = {"MAJOR OFFENSES", "MINOR OFFENSES", "TYPES OF DISCIPLINARY ACTION"}
+
+# Offense/sanction codes ('2', '2.b', '2.b.1') and words, in the order they appear
+QUESTION_TOKEN_PATTERN = re.compile(r"\d+(?:\.[a-z0-9]+)*|[a-z]+")
+CODE_PATTERN = re.compile(r"\d+(?:\.[a-z0-9]+)*")
+
+# Words allowed around an ID or category name || anything else means the question needs the model
+FILLER_WORDS = {
+    "what", "whats", "s", "is", "are", "was", "the", "a", "an", "does", "do", "mean", "means", "meaning", "of", "for",
+    "sanction", "sanctions", "offense", "offenses", "offence", "offences", "penalty", "penalties", "id", "code",
+    "number", "no", "explain", "define", "describe", "about", "tell", "me", "under", "in", "list", "show", "give",
+    "which", "category", "consequence", "consequences", "punishment", "on", "to", "please", "and", "or", "all",
+}
+
+# Most sanctions listed per offense (the same limit the model is given)
+MAX_SANCTIONS = 5
+
+PAGE_LINE = "We recommend you to check page(s) {pages} in the handbook for more details."
+
+# Page cells like '43-44' or '46'
+PAGE_PATTERN = re.compile(r"(\d+)(?:\s*-\s*(\d+))?")
+
+
+def tokenize(text):
+    return QUESTION_TOKEN_PATTERN.findall(text.lower())
+
+
+def offense_children(codes):
+    """Offense hierarchy || '2' -> ['2.a', '2.b', ...], '2.b' -> ['2.b.0', '2.b.1', ...]"""
+    children = {}
+    for code in codes:
+        parts = code.split(".")
+        for depth in range(1, len(parts)):
+            parent, child = ".".join(parts[:depth]), ".".join(parts[:depth + 1])
+            siblings = children.setdefault(parent, [])
+            if child not in siblings:
+                siblings.append(child)
+    return children
+
+
+def section_index(rows):
+    """Type -> Category -> row indexes, in handbook order ('' for an empty type or category)"""
+    sections = {}
+    for index, row in enumerate(rows):
+        sections.setdefault(row[1] or "", {}).setdefault(row[2] or "", []).append(index)
+    return sections
+
+
+def parse_pages(page):
+    """'43-44' -> (43, 44), '46' -> (46, 46), anything else -> None"""
+    match = PAGE_PATTERN.fullmatch((page or "").strip())
+    if match is None:
+        return None
+    first = int(match.group(1))
+    return (first, int(match.group(2) or first))
+
+
+def format_pages(ranges):
+    """Merge page ranges for the reader: [(43, 44), (44, 44), (47, 47)] -> '43-44, 47'"""
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], last)
+        else:
+            merged.append([first, last])
+    return ", ".join(f"{first}-{last}" if first != last else str(first) for first, last in merged)
+
+
+class OffenseResolver:
+    """Answers questions that only name an offense ID or an offense/sanction category, straight from the table
+
+    children, pages and sections come precompiled with the handbook artifact (pages parallel to rows);
+    without them they are worked out here.
+    """
+
+    def __init__(self, rows, children=None, pages=None, sections=None):
+        self.rows_by_id = {row[0]: row for row in rows if row[0]}
+        self.children = children if children is not None else offense_children(self.rows_by_id)
+        if pages is None:
+            pages = [parse_pages(row[5]) for row in rows]
+        self.pages = {row: page for row, page in zip(rows, pages)}
+
+        # Category name (as words) -> its rows
+        if sections is None:
+            sections = section_index(rows)
+        self.categories = {}
+        for type_name, categories in sections.items():
+            if type_name not in LOOKUP_TYPES:
+                continue
+            for category, indexes in categories.items():
+                if category:
+                    self.categories.setdefault(tuple(tokenize(category)), (category, []))[1].extend(rows[index] for index in indexes)
+        self.category_names = sorted(self.categories, key=len, reverse=True)  # longest name wins
+
+    def known_code(self, code):
+        return code in self.rows_by_id or code in self.children
+
+    def sanction_name(self, code):
+        """'2.a' -> 'Probation' (the part before the dash, otherwise the category, e.g. 'Supplemental Sanctions')"""
+        row = self.rows_by_id[code]
+        return row[3].split(" – ")[0] if " – " in row[3] or len(row[3]) <= 40 else row[2]
+
+    def match(self, question):
+        """Return (codes, categories) the question names, or None unless it names nothing else"""
+        tokens = tokenize(question)
+        codes, categories = [], []
+        position = 0
+        while position < len(tokens):
+            token = tokens[position]
+            if CODE_PATTERN.fullmatch(token):
+                if not self.known_code(token):
+                    return None  # an ID the handbook does not have, let the model explain
+                if token not in codes:
+                    codes.append(token)
+                position += 1
+                continue
+
+            # Longest category name starting here
+            for name in self.category_names:
+                if tuple(tokens[position:position + len(name)]) == name:
+                    if name not in categories:
+                        categories.append(name)
+                    position += len(name)
+                    break
+            else:
+                if token not in FILLER_WORDS:
+                    return None
+                position += 1
+
+        if not codes and not categories:
+            return None
+        return codes, categories
+
+    def describe_code(self, code, lines, cited, indent=""):
+        row = self.rows_by_id.get(code)
+        if row is not None:
+            lines.append(f"{indent}- {row[3]}")
+            cited.append(row)
+        for child in self.children.get(code, []):
+            self.describe_code(child, lines, cited, indent + "  " if row is not None else indent)
+
+    def answer_code(self, code, cited):
+        lines = []
+        row = self.rows_by_id.get(code)
+        if row is not None and code not in self.children:
+            cited.append(row)
+            return f"**{row[2]}:** {row[3]}"
+        self.describe_code(code, lines, cited)
+        category = row[2] if row is not None else self.rows_by_id[self.children[code][0]][2]
+        return f"**{category}:**\n" + "\n".join(lines)
+
+    def answer_category(self, name, cited):
+        title, rows = self.categories[name]
+        lines = [f"**{title}:**"]
+        top_depth = min((row[0].count(".") for row in rows if row[0]), default=0)
+        for row in rows:
+            cited.append(row)
+            if not row[4]:
+                indent = "  " * (row[0].count(".") - top_depth) if row[0] else ""
+                lines.append(f"{indent}- {row[3]}")
+                continue
+            sanctions = []
+            for code in CODE_PATTERN.findall(row[4]):
+                if code in self.rows_by_id and self.sanction_name(code) not in sanctions:
+                    sanctions.append(self.sanction_name(code))
+            lines.append(f"- {row[3]} (possible sanctions: {', '.join(sanctions[:MAX_SANCTIONS])})")
+        return "\n".join(lines)
+
+    def resolve(self, question):
+        """The answer for a pure ID/category lookup, otherwise None"""
+        matched = self.match(question)
+        if matched is None:
+            return None
+        codes, categories = matched
+        cited = []  # rows the answer draws on
+        parts = [self.answer_code(code, cited) for code in codes]
+        parts += [self.answer_category(name, cited) for name in categories]
+        ranges = [self.pages[row] for row in cited if self.pages.get(row)]
+        # Page cells that are not plain numbers or ranges are shown as they are
+        shown = [format_pages(ranges)] if ranges else []
+        shown += dict.fromkeys(row[5] for row in cited if row[5] and not self.pages.get(row))
+        parts.append(PAGE_LINE.format(pages=", ".join(shown)))
+        return "\n\n".join(parts)
@@ -0,0 +1,174 @@
+import json
+import os
+import re
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from Checkers import normalize_query
+from Retrieval import STOP_WORDS
+from Tracing import current_trace, debug
+
+# Number tokens ('2.b.1', '3') must match exactly, a single digit changes the answer
+NUMBER_PATTERN = re.compile(r"\d+(?:\.[a-z0-9]+)*")
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+# Negations flip the answer ("is smoking not allowed"), so they are kept as features and must match exactly like numbers
+NEGATIONS = {
+    "not": "not", "cannot": "not", "cant": "not", "dont": "not", "doesnt": "not", "didnt": "not",
+    "isnt": "not", "arent": "not", "wasnt": "not", "werent": "not", "wont": "not", "shouldnt": "not",
+    "mustnt": "not", "no": "no", "never": "never", "without": "without",
+}
+
+# Handbook words that mean the same thing in a question
+SYNONYMS = {
+    "sanction": "penalty", "sanctions": "penalty", "penalties": "penalty", "punishment": "penalty",
+    "consequence": "penalty", "consequences": "penalty", "happens": "penalty",
+    "offence": "offense", "offenses": "offense", "violation": "offense", "violations": "offense",
+    "allowed": "permitted", "can": "permitted",
+}
+
+
+def exact_terms(question):
+    """Numbers and negations of a normalized question || an answer is only reused when both are the same"""
+    negations = sorted(NEGATIONS[word] for word in WORD_PATTERN.findall(question) if word in NEGATIONS)
+    return NUMBER_PATTERN.findall(question) + negations
+
+
+def query_features(text):
+    """Hashed feature weights of a normalized question || whole words plus character trigrams, stop words (but not negations) left out"""
+    features = {}
+    for word in WORD_PATTERN.findall(text):
+        if word in NEGATIONS:
+            word = NEGATIONS[word]
+        else:
+            word = SYNONYMS.get(word, word)
+            if word in STOP_WORDS:
+                continue
+        features[f"w:{word}"] = features.get(f"w:{word}", 0.0) + 1.0
+        padded = f" {word} "
+        for start in range(len(padded) - 2):
+            gram = f"c:{padded[start:start + 3]}"
+            features[gram] = features.get(gram, 0.0) + 0.5
+    return features
+
+
+class ParaphraseIndex:
+    """Previously answered questions as unit vectors, searched with one matrix product
+
+    The matrix is stored dimension-major (dimensions x entries), so a question only reads the rows of
+    the few dimensions it uses. Entries are only valid for one handbook version and prompt; when either
+    changes the index starts over. Once full, the oldest entries are overwritten.
+    """
+
+    def __init__(self, threshold=0.9, dimensions=512, max_entries=20000, audit_log=None):
+        self.threshold = threshold
+        self.dimensions = dimensions
+        self.max_entries = max_entries
+        self.audit_log = audit_log
+        self.matrix = np.zeros((dimensions, 64), dtype=np.float32)
+        self.questions = []
+        self.answers = []
+        self.exact = []
+        self.slots = {}  # question -> column
+        self.next_slot = 0
+        self.scope = None
+        self.lock = threading.Lock()
+        self.log_lock = threading.Lock()
+
+    def vectorize(self, question):
+        """Return (dimension indexes, unit weights) of a normalized question"""
+        weights = {}
+        for feature, weight in query_features(question).items():
+            dimension = zlib.crc32(feature.encode("utf-8")) % self.dimensions
+            weights[dimension] = weights.get(dimension, 0.0) + weight
+        if not weights:
+            return None, None
+        dims = np.fromiter(weights.keys(), dtype=np.intp, count=len(weights))
+        values = np.fromiter(weights.values(), dtype=np.float32, count=len(weights))
+        return dims, values / np.linalg.norm(values)
+
+    def check_scope(self, scope):
+        """Forget every entry once the handbook or the prompt changes (call with the lock held)"""
+        if scope != self.scope:
+            self.scope = scope
+            self.matrix[:] = 0
+            self.questions, self.answers, self.exact = [], [], []
+            self.slots = {}
+            self.next_slot = 0
+
+    def add(self, user_input, answer, scope):
+        question = normalize_query(user_input)
+        dims, values = self.vectorize(question)
+        if dims is None:
+            return
+        with self.lock:
+            self.check_scope(scope)
+            if question in self.slots:
+                slot = self.slots[question]
+            elif len(self.questions) < self.max_entries:
+                slot = len(self.questions)
+                if slot == self.matrix.shape[1]:
+                    grown = np.zeros((self.dimensions, min(slot * 2, self.max_entries)), dtype=np.float32)
+                    grown[:, :slot] = self.matrix
+                    self.matrix = grown
+                self.questions.append(None)
+                self.answers.append(None)
+                self.exact.append(None)
+            else:
+                slot = self.next_slot
+                self.next_slot = (self.next_slot + 1) % self.max_entries
+                del self.slots[self.questions[slot]]
+
+            self.slots[question] = slot
+            self.matrix[:, slot] = 0
+            self.matrix[dims, slot] = values
+            self.questions[slot] = question
+            self.answers[slot] = answer
+            self.exact[slot] = exact_terms(question)
+
+    def lookup(self, user_input, scope):
+        """The stored answer of the closest earlier question above the threshold, otherwise None"""
+        if self.threshold <= 0:
+            return None
+        question = normalize_query(user_input)
+        dims, values = self.vectorize(question)
+        if dims is None:
+            return None
+
+        with self.lock:
+            self.check_scope(scope)
+            if not self.questions:
+                return None
+            scores = values @ self.matrix[dims, :len(self.questions)]
+            best = int(scores.argmax())
+            score = float(scores[best])
+            matched, answer, exact = self.questions[best], self.answers[best], self.exact[best]
+
+        reused = score >= self.threshold and exact == exact_terms(question)
+        self.audit(question, matched, score, reused)
+        return answer if reused else None
+
+    def audit(self, question, matched, score, reused):
+        """Record every reuse decision"""
+        debug(f"Paraphrase {'reused' if reused else 'rejected'}: {score:.3f} '{question}' ~ '{matched}'")
+        if not self.audit_log:
+            return
+        trace = current_trace()
+        record = {
+            "timestamp": time.time(),
+            "request_id": trace.request_id if trace is not None else None,
+            "question": question,
+            "matched": matched,
+            "score": round(score, 4),
+            "threshold": self.threshold,
+            "reused": reused,
+        }
+        directory = os.path.dirname(self.audit_log)
+        with self.log_lock:
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            with open(self.audit_log, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
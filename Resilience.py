@@ -0,0 +1,348 @@
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from Tracing import annotate, debug
+
+# Circuit breaker states as exported in the metrics
+BREAKER_STATES = {"closed": 0, "open": 1, "half_open": 2}
+
+
+class ModelUnavailable(Exception):
+    """The model could not answer in time (deadline missed, every attempt failed or the breaker is open)"""
+
+
+class CircuitBreaker:
+    """Stops calling the model after repeated failures and lets a single trial call through after a pause"""
+
+    def __init__(self, failure_threshold=5, reset_seconds=30):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    def enter(self):
+        """'closed' or 'trial' when a call may go ahead (trial: the single call let through while half open), else None"""
+        with self.lock:
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = "half_open"
+                self.trial_running = False
+            if self.state == "half_open":
+                if self.trial_running:
+                    return None
+                self.trial_running = True
+                return "trial"
+            return "closed" if self.state == "closed" else None
+
+    def allow(self):
+        return self.enter() is not None
+
+    def cancel_trial(self):
+        """The trial call was cancelled before it succeeded or failed || the next call gets to try"""
+        with self.lock:
+            if self.state == "half_open":
+                self.trial_running = False
+
+    def record_success(self):
+        with self.lock:
+            self.state = "closed"
+            self.failures = 0
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    debug(f"Circuit breaker open after {self.failures} failure(s)")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self.trial_running = False
+
+
+class ModelCaller:
+    """Calls the model under a per-request deadline with jittered retries, optional hedging and a circuit breaker
+
+    The deadline covers the whole answer for plain calls, and for streams the first chunk and then
+    every gap between chunks (retries and hedges only happen before anything was shown). With hedging on, a second identical request is sent
+    once the first is slower than the p95 of recent calls (hedge_delay until there are enough of them),
+    and whichever answers first wins. With a quota (the ModelScheduler), every retry and hedge spends
+    a request of it; the first request of a call is paid for when its slot is granted.
+    """
+
+    def __init__(self, deadline=20.0, retries=2, retry_delay=0.5, hedge=False, hedge_delay=5.0, breaker=None, max_workers=32,
+                 quota=None):
+        self.deadline = deadline
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.hedge = hedge
+        self.hedge_delay = hedge_delay
+        self.breaker = breaker or CircuitBreaker()
+        self.quota = quota
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="model-call")
+        self.latencies = deque(maxlen=200)
+        self.counters = {
+            "calls": 0, "failures": 0, "retries": 0, "deadline_misses": 0,
+            "hedges": 0, "hedge_wins": 0, "breaker_rejections": 0,
+        }
+        self.lock = threading.Lock()
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def hedge_after(self):
+        """Seconds to wait before hedging, or None when hedging is off"""
+        if not self.hedge:
+            return None
+        with self.lock:
+            latencies = sorted(self.latencies)
+        if len(latencies) < 20:
+            return self.hedge_delay
+        return latencies[int(len(latencies) * 0.95)]
+
+    def backoff(self, attempt):
+        """Exponential delay with full jitter"""
+        return random.uniform(0, self.retry_delay * 2 ** attempt)
+
+    def succeeded(self, start):
+        self.breaker.record_success()
+        with self.lock:
+            self.latencies.append(time.monotonic() - start)
+
+    def failed(self, error):
+        self.count("failures")
+        self.breaker.record_failure()
+        debug(f"Model call failed: {error!r}")
+
+    def admit(self):
+        """True when this call is the breaker's half-open trial"""
+        self.count("calls")
+        verdict = self.breaker.enter()
+        if verdict is None:
+            self.count("breaker_rejections")
+            annotate(model_unavailable="breaker_open")
+            raise ModelUnavailable("circuit breaker open")
+        return verdict == "trial"
+
+    def take_quota(self):
+        """Spend one request of the provider quota || True when there was one to spend"""
+        return self.quota is None or self.quota.try_take_token()
+
+    def quota_wait(self, start):
+        """Seconds until the quota has a request to spend; raises ModelUnavailable when that is past the deadline"""
+        wait_for = self.quota.token_wait()
+        if time.monotonic() - start + wait_for >= self.deadline:
+            annotate(model_unavailable="quota")
+            raise ModelUnavailable("provider quota used up")
+        return max(wait_for, 0.01)
+
+    def wait_for_quota(self, start):
+        """Block until a retry may spend a request of the quota"""
+        while not self.take_quota():
+            time.sleep(self.quota_wait(start))
+
+    async def wait_for_quota_async(self, start):
+        while not self.take_quota():
+            await asyncio.sleep(self.quota_wait(start))
+
+    def missed_deadline(self):
+        self.count("deadline_misses")
+        self.breaker.record_failure()
+        annotate(model_unavailable="deadline")
+        return ModelUnavailable(f"no answer within {self.deadline:.1f} s")
+
+    def attempt(self, fn, timeout, left_running=None):
+        """One attempt in the worker pool, hedged if it runs long; raises TimeoutError when out of time
+
+        Requests still running when it returns (a hedge that lost, a missed deadline) are added to left_running.
+        """
+        start = time.monotonic()
+        hedge_after = self.hedge_after()
+        first = self.executor.submit(fn)
+        futures = [first]
+        errors = []
+        try:
+            while futures:
+                elapsed = time.monotonic() - start
+                if elapsed >= timeout:
+                    raise TimeoutError()
+                wait_for = timeout - elapsed
+                if hedge_after is not None:
+                    wait_for = min(wait_for, max(hedge_after - elapsed, 0))
+                done, _ = wait(futures, wait_for, FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        if future is not first:
+                            self.count("hedge_wins")
+                        return future.result()
+                    errors.append(future.exception())
+                futures = [future for future in futures if not future.done()]
+                if hedge_after is not None and time.monotonic() - start >= hedge_after:
+                    # Hedge once, only while the first request is still running and the quota has room
+                    hedge_after = None
+                    if futures and self.take_quota():
+                        self.count("hedges")
+                        futures.append(self.executor.submit(fn))
+            raise errors[-1]
+        finally:
+            if left_running is not None:
+                left_running.extend(future for future in futures if not future.done())
+
+    async def attempt_async(self, fn, timeout):
+        """Async version of attempt; losing requests are cancelled"""
+        start = time.monotonic()
+        hedge_after = self.hedge_after()
+        first = asyncio.ensure_future(fn())
+        tasks = [first]
+        errors = []
+        try:
+            while tasks:
+                elapsed = time.monotonic() - start
+                if elapsed >= timeout:
+                    raise TimeoutError()
+                wait_for = timeout - elapsed
+                if hedge_after is not None:
+                    wait_for = min(wait_for, max(hedge_after - elapsed, 0))
+                done, _ = await asyncio.wait(tasks, timeout=wait_for, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first:
+                            self.count("hedge_wins")
+                        return task.result()
+                    errors.append(task.exception())
+                tasks = [task for task in tasks if not task.done()]
+                if hedge_after is not None and time.monotonic() - start >= hedge_after:
+                    hedge_after = None
+                    if tasks and self.take_quota():
+                        self.count("hedges")
+                        tasks.append(asyncio.ensure_future(fn()))
+            raise errors[-1]
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def call(self, fn, left_running=None):
+        """fn() with the deadline, retries and breaker applied; raises ModelUnavailable
+
+        Requests it gives up on keep running in the worker pool and are added to left_running.
+        """
+        trial = self.admit()
+        start = time.monotonic()
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.count("retries")
+            try:
+                result = self.attempt(fn, self.deadline - (time.monotonic() - start), left_running)
+            except TimeoutError:
+                raise self.missed_deadline()
+            except Exception as e:
+                self.failed(e)
+                delay = self.backoff(attempt)
+                if attempt == self.retries or not self.breaker.allow() or time.monotonic() - start + delay >= self.deadline:
+                    annotate(model_unavailable="failed")
+                    raise ModelUnavailable(f"model call failed: {e}") from e
+                time.sleep(delay)
+                self.wait_for_quota(start)
+                continue
+            except BaseException:
+                # Interrupted, which says nothing about the model; a trial must not keep the breaker half open
+                if trial:
+                    self.breaker.cancel_trial()
+                raise
+            self.succeeded(start)
+            return result
+
+    async def call_async(self, fn):
+        """Async version of call, fn() returns an awaitable"""
+        trial = self.admit()
+        start = time.monotonic()
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.count("retries")
+            try:
+                result = await self.attempt_async(fn, self.deadline - (time.monotonic() - start))
+            except TimeoutError:
+                raise self.missed_deadline()
+            except Exception as e:
+                self.failed(e)
+                delay = self.backoff(attempt)
+                if attempt == self.retries or not self.breaker.allow() or time.monotonic() - start + delay >= self.deadline:
+                    annotate(model_unavailable="failed")
+                    raise ModelUnavailable(f"model call failed: {e}") from e
+                await asyncio.sleep(delay)
+                await self.wait_for_quota_async(start)
+                continue
+            except BaseException:
+                # Cancelled (a task cancel, a wait_for timeout)
+                if trial:
+                    self.breaker.cancel_trial()
+                raise
+            self.succeeded(start)
+            return result
+
+    def broken_stream(self, error):
+        """A stream that failed after its first chunk"""
+        self.failed(error)
+        annotate(model_unavailable="stream_failed")
+        return ModelUnavailable(f"answer stream failed: {error}")
+
+    def next_chunk(self, chunks, left_running=None):
+        """The next chunk within the deadline, None at the end of the stream; raises ModelUnavailable"""
+        future = self.executor.submit(next, chunks, None)
+        done, _ = wait([future], self.deadline)
+        if not done:
+            # The stalled read is left to finish on its own in the pool
+            if left_running is not None:
+                left_running.append(future)
+            raise self.missed_deadline()
+        if future.exception() is not None:
+            raise self.broken_stream(future.exception()) from future.exception()
+        return future.result()
+
+    async def next_chunk_async(self, chunks):
+        try:
+            return await asyncio.wait_for(chunks.__anext__(), self.deadline)
+        except StopAsyncIteration:
+            return None
+        except asyncio.TimeoutError:
+            raise self.missed_deadline()
+        except Exception as e:
+            raise self.broken_stream(e) from e
+
+    def stream(self, open_stream, left_running=None):
+        """Chunks of open_stream(), each under the deadline; raises ModelUnavailable, also part way through"""
+        def first_chunk():
+            chunks = iter(open_stream())
+            return next(chunks, None), chunks
+
+        chunk, chunks = self.call(first_chunk, left_running)
+        while chunk is not None:
+            yield chunk
+            chunk = self.next_chunk(chunks, left_running)
+
+    async def astream(self, open_stream):
+        """Async version of stream"""
+        async def first_chunk():
+            chunks = open_stream().__aiter__()
+            try:
+                return await chunks.__anext__(), chunks
+            except StopAsyncIteration:
+                return None, chunks
+
+        chunk, chunks = await self.call_async(first_chunk)
+        while chunk is not None:
+            yield chunk
+            chunk = await self.next_chunk_async(chunks)
+
+    def stats(self):
+        with self.lock:
+            counters = dict(self.counters)
+        counters["breaker_state"] = BREAKER_STATES[self.breaker.state]
+        return counters
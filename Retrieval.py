@@ -0,0 +1,109 @@
+import re
+import sqlite3
+
+# Words that carry no meaning for the handbook search (kept small on purpose)
+STOP_WORDS = {
+    "a", "an", "the", "is", "are", "was", "were", "be", "been", "am", "do", "does", "did",
+    "what", "whats", "who", "whom", "which", "when", "where", "why", "how", "can", "could",
+    "should", "would", "will", "shall", "may", "might", "must", "i", "me", "my", "we", "our",
+    "you", "your", "he", "she", "it", "they", "them", "their", "this", "that", "these", "those",
+    "of", "in", "on", "at", "to", "for", "from", "by", "with", "about", "and", "or", "not",
+    "if", "so", "there", "any", "some", "please", "tell", "know", "mmcm", "mcm",
+}
+
+# Matches offense/sanction codes like '2.a', '2.b.1' or '4' inside the Sanctions column
+SANCTION_CODE_PATTERN = re.compile(r"\b\d+(?:\.[a-z0-9]+)*\b")
+
+
+def build_search_index(rows):
+    """In-memory SQLite database holding the FTS5 index of the rows"""
+    conn = sqlite3.connect(":memory:", check_same_thread=False)
+    conn.execute(
+        "CREATE VIRTUAL TABLE handbook_fts USING fts5("
+        "description, category, type, sanctions, tokenize='porter unicode61')"
+    )
+    conn.executemany(
+        "INSERT INTO handbook_fts (rowid, description, category, type, sanctions) VALUES (?, ?, ?, ?, ?)",
+        [(index, row[3] or "", row[2] or "", row[1] or "", row[4] or "") for index, row in enumerate(rows)]
+    )
+    conn.commit()
+    return conn
+
+
+class HandbookRetriever:
+    """BM25 search over the databaseBot rows using an in-memory SQLite FTS5 index
+
+    search_index is a serialized index from the compiled handbook; without one the index is built here.
+    """
+
+    def __init__(self, rows, top_k=8, min_score=2.0, search_index=None):
+        self.rows = rows
+        self.top_k = top_k
+        self.min_score = min_score
+
+        # Rows with an ID are the sanction definitions the other rows refer to
+        self.rows_by_id = {row[0]: index for index, row in enumerate(rows) if row[0]}
+
+        if search_index is not None:
+            self.conn = sqlite3.connect(":memory:", check_same_thread=False)
+            self.conn.deserialize(search_index)
+        else:
+            self.conn = build_search_index(rows)
+
+    def build_match_query(self, user_input):
+        """Turn free text into an FTS5 OR query of prefix terms"""
+        terms = [
+            term for term in re.findall(r"[a-z0-9]+", user_input.lower())
+            if term not in STOP_WORDS and len(term) > 1
+        ]
+        # Deduplicate while keeping the order of the question
+        terms = list(dict.fromkeys(terms))
+        return " OR ".join(f"{term}*" for term in terms)
+
+    def search(self, user_input, k=None):
+        """Return the top-k (row index, score) pairs, best first; score is the positive BM25 value"""
+        match_query = self.build_match_query(user_input)
+        if not match_query:
+            return []
+
+        # bm25() is negative (lower is better); Category and Type are short and precise, so weigh them higher
+        cursor = self.conn.execute(
+            "SELECT rowid, -bm25(handbook_fts, 1.0, 2.0, 1.5, 0.5) AS score FROM handbook_fts "
+            "WHERE handbook_fts MATCH ? ORDER BY score DESC LIMIT ?",
+            (match_query, k or self.top_k)
+        )
+        return cursor.fetchall()
+
+    def with_definitions(self, indexes):
+        """Follow each row with the sanction definitions (e.g. '2.b.1') it refers to"""
+        selected = []
+        for index in indexes:
+            if index not in selected:
+                selected.append(index)
+            sanctions = self.rows[index][4]
+            if not sanctions:
+                continue
+            for code in SANCTION_CODE_PATTERN.findall(sanctions):
+                code_index = self.rows_by_id.get(code)
+                if code_index is not None and code_index not in selected:
+                    selected.append(code_index)
+        return selected
+
+    def retrieve(self, user_input, k=None):
+        """Return the relevant rows, or None when the match is too weak to trust"""
+        hits = self.search(user_input, k)
+        if not hits or hits[0][1] < self.min_score:
+            return None
+        return [self.rows[index] for index in self.with_definitions([index for index, _ in hits])]
+
+    def rank(self, user_input):
+        """Every row, the ones matching the question first (best first), then the rest in handbook order"""
+        matched = self.with_definitions([index for index, _ in self.search(user_input, len(self.rows))])
+        matched_set = set(matched)
+        rest = [index for index in range(len(self.rows)) if index not in matched_set]
+        return [self.rows[index] for index in matched + rest]
+
+
+def format_rows(rows):
+    """Join rows into the plain text layout used in the prompt"""
+    return "\n".join([" ".join(map(str, row)) for row in rows])
@@ -0,0 +1,242 @@
+import asyncio
+import itertools
+import threading
+import time
+from collections import OrderedDict, deque
+
+from Tracing import debug
+
+
+class SchedulerBusy(Exception):
+    """The model queue is full (overall or for this chat) or the wait took too long"""
+
+
+class QueuePosition:
+    """Marker in an answer stream: the question is waiting for a model slot at this place in line"""
+
+    def __init__(self, position):
+        self.position = position
+
+    def __repr__(self):
+        return f"QueuePosition({self.position})"
+
+
+class TokenBucket:
+    """Allows rate_per_minute calls on average with bursts of up to burst calls (rate 0 means no limit)"""
+
+    def __init__(self, rate_per_minute, burst):
+        self.rate = rate_per_minute / 60
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self, now):
+        if not self.rate:
+            return True
+        self.refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self, now):
+        """Seconds until the next call is allowed"""
+        if not self.rate:
+            return 0.0
+        self.refill(now)
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class Ticket:
+    __slots__ = ("session", "granted", "cancelled", "enqueued_at")
+
+    def __init__(self, session):
+        self.session = session
+        self.granted = False
+        self.cancelled = False
+        self.enqueued_at = time.monotonic()
+
+
+class ModelScheduler:
+    """Process-wide admission control for model calls
+
+    At most max_concurrent calls run at once and the token bucket keeps them under the provider quota.
+    A granted slot pays for one request, retries and hedges take their own (try_take_token).
+    Waiting questions are queued per chat and served round robin, so one chat asking many questions
+    cannot starve the others. A question is turned away straight away (SchedulerBusy) when the queue
+    holds max_queue questions or its chat already has max_per_session waiting, and after waiting
+    queue_timeout seconds.
+    """
+
+    def __init__(self, max_concurrent=8, rate_per_minute=0, burst=None, max_queue=64, max_per_session=2,
+                 queue_timeout=30.0, poll_interval=0.05):
+        self.max_concurrent = max_concurrent
+        self.bucket = TokenBucket(rate_per_minute, burst or max_concurrent)
+        self.max_queue = max_queue
+        self.max_per_session = max_per_session
+        self.queue_timeout = queue_timeout
+        self.poll_interval = poll_interval
+        self.waiting = OrderedDict()  # session -> deque of tickets || front session is served next
+        self.queued = 0
+        self.active = 0
+        self.anonymous = itertools.count()
+        self.counters = {"admitted": 0, "queued": 0, "rejected_busy": 0, "timed_out": 0}
+        self.condition = threading.Condition()
+
+    def submit(self, session):
+        """Queue a question for a model slot; raises SchedulerBusy if there is no room"""
+        # Questions without a chat are not grouped, each one queues on its own
+        session = session if session else f"anonymous-{next(self.anonymous)}"
+        ticket = Ticket(session)
+        with self.condition:
+            queue = self.waiting.get(session)
+            if self.queued >= self.max_queue or (queue is not None and len(queue) >= self.max_per_session):
+                self.counters["rejected_busy"] += 1
+                debug(f"Model queue full ({self.queued} waiting, {self.active} running)")
+                raise SchedulerBusy("model queue full")
+            if queue is None:
+                queue = self.waiting[session] = deque()
+            queue.append(ticket)
+            self.queued += 1
+            self.dispatch()
+            if not ticket.granted:
+                self.counters["queued"] += 1
+        return ticket
+
+    def dispatch(self):
+        """Grant free slots round robin across chats (call with the condition held)"""
+        now = time.monotonic()
+        granted = False
+        while self.waiting and self.active < self.max_concurrent and self.bucket.try_take(now):
+            session, queue = next(iter(self.waiting.items()))
+            ticket = queue.popleft()
+            if queue:
+                self.waiting.move_to_end(session)
+            else:
+                del self.waiting[session]
+            self.queued -= 1
+            self.active += 1
+            ticket.granted = True
+            self.counters["admitted"] += 1
+            granted = True
+        if granted:
+            self.condition.notify_all()
+
+    def position(self, ticket):
+        """1-based place in line, following the round robin order (call with the condition held)"""
+        position = 0
+        for depth in itertools.count():
+            found = False
+            for queue in self.waiting.values():
+                if depth < len(queue):
+                    found = True
+                    position += 1
+                    if queue[depth] is ticket:
+                        return position
+            if not found:
+                return position
+
+    def cancel(self, ticket):
+        """Take a ticket out of the queue (call with the condition held)"""
+        ticket.cancelled = True
+        queue = self.waiting.get(ticket.session)
+        if queue is not None and ticket in queue:
+            queue.remove(ticket)
+            self.queued -= 1
+            if not queue:
+                del self.waiting[ticket.session]
+
+    def check(self, ticket, last_position):
+        """(granted, position or None when unchanged, seconds to sleep) for a waiting ticket (call with the condition held)"""
+        self.dispatch()
+        if ticket.granted:
+            return True, None, 0.0
+        if time.monotonic() - ticket.enqueued_at >= self.queue_timeout:
+            self.cancel(ticket)
+            self.counters["timed_out"] += 1
+            raise SchedulerBusy(f"no model slot within {self.queue_timeout:.0f} s")
+        position = self.position(ticket)
+        sleep = min(self.poll_interval * 5, max(self.bucket.wait_time(time.monotonic()), self.poll_interval))
+        return False, position if position != last_position else None, sleep
+
+    def discard(self, ticket):
+        """Done with a ticket, whether it holds a slot or is still queued || safe to call more than once"""
+        with self.condition:
+            if ticket.granted:
+                self.release(ticket)
+            elif not ticket.cancelled:
+                self.cancel(ticket)
+
+    def wait(self, ticket):
+        """Block until the ticket gets a slot, yielding its place in line whenever it changes
+
+        A waiter closed before the wait returns (a rerun, a client that went away) never keeps a slot.
+        """
+        position = None
+        handed_over = False
+        try:
+            while True:
+                with self.condition:
+                    granted, changed, sleep = self.check(ticket, position)
+                    if granted:
+                        handed_over = True
+                        return
+                    if changed is None:
+                        self.condition.wait(sleep)
+                        continue
+                position = changed
+                yield position
+        finally:
+            if not handed_over:
+                self.discard(ticket)
+
+    async def wait_async(self, ticket):
+        """Async version of wait || polls so it works across threads and event loops"""
+        position = None
+        handed_over = False
+        try:
+            while True:
+                with self.condition:
+                    granted, changed, sleep = self.check(ticket, position)
+                if granted:
+                    handed_over = True
+                    return
+                if changed is None:
+                    await asyncio.sleep(self.poll_interval)
+                    continue
+                position = changed
+                yield position
+        finally:
+            if not handed_over:
+                self.discard(ticket)
+
+    def try_take_token(self):
+        """Spend one request of the quota outside a slot grant (retries and hedges) || False when it is used up"""
+        with self.condition:
+            return self.bucket.try_take(time.monotonic())
+
+    def token_wait(self):
+        """Seconds until the quota allows another request"""
+        with self.condition:
+            return self.bucket.wait_time(time.monotonic())
+
+    def release(self, ticket):
+        """Hand a granted slot back || safe to call more than once"""
+        with self.condition:
+            if not ticket.granted:
+                return
+            ticket.granted = False
+            self.active -= 1
+            self.dispatch()
+            self.condition.notify_all()
+
+    def stats(self):
+        with self.condition:
+            counters = dict(self.counters)
+            counters["active"] = self.active
+            counters["waiting"] = self.queued
+        return counters
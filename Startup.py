@@ -0,0 +1,93 @@
+import argparse
+import gzip
+import importlib
+import os
+import sys
+import time
+
+# Word list shipped with the app so startup never needs to download the NLTK corpus
+WORDS_ARTIFACT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "database", "words.txt.gz")
+
+# Module or resource name -> seconds it took the first time
+IMPORT_TIMES = {}
+
+
+def timed_import(module_name):
+    """Import a module on first use and record how long it took"""
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    start = time.perf_counter()
+    module = importlib.import_module(module_name)
+    IMPORT_TIMES[module_name] = time.perf_counter() - start
+    return module
+
+
+def record_time(name, start):
+    """Record the time since start under name (for singletons built on first use)"""
+    IMPORT_TIMES[name] = time.perf_counter() - start
+
+
+def build_word_list(path=WORDS_ARTIFACT):
+    """Write the NLTK words corpus to the bundled artifact (run where NLTK data can be downloaded)"""
+    import nltk
+    try:
+        nltk.data.find("corpora/words")
+    except LookupError:
+        nltk.download("words")
+    from nltk.corpus import words
+
+    word_list = sorted(set(words.words()))
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        f.write("\n".join(word_list))
+    return len(word_list)
+
+
+def load_word_list(path=WORDS_ARTIFACT):
+    """Read the bundled word list into a set"""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return set(f.read().split("\n"))
+
+
+def report_import_times(total_seconds, budget_ms=None):
+    """Format the recorded timings, slowest first, and flag the wall-clock total against the budget"""
+    # Entries can nest (the word list is loaded inside InputChecker), so the total is measured, not summed
+    total_ms = total_seconds * 1000
+    lines = [f"{seconds * 1000:9.1f} ms  {name}" for name, seconds in
+             sorted(IMPORT_TIMES.items(), key=lambda item: item[1], reverse=True)]
+    lines.append(f"{total_ms:9.1f} ms  total")
+    if budget_ms is not None:
+        status = "OK" if total_ms <= budget_ms else "OVER BUDGET"
+        lines.append(f"{budget_ms:9.1f} ms  budget ({status})")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MMCMate cold start tools")
+    parser.add_argument("--build-words", action="store_true", help="write the bundled word list from NLTK")
+    parser.add_argument("--warm", action="store_true", help="also build the InputChecker, handbook and model backend")
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("COLD_START_BUDGET_MS", "0")) or None,
+                        help="fail when the total cold start exceeds this many milliseconds")
+    args = parser.parse_args()
+
+    if args.build_words:
+        print(f"Wrote {build_word_list()} words to {WORDS_ARTIFACT}")
+        return 0
+
+    # What a fresh server process pays before the first page render
+    start = time.perf_counter()
+    back = timed_import("bot_back")
+    if args.warm:
+        back.get_input_checker()
+        back.get_handbook(os.path.join("database", "databasefinalnjud.db"))
+        back.get_backend()
+    total_seconds = time.perf_counter() - start
+
+    print(report_import_times(total_seconds, args.budget_ms))
+    if args.budget_ms is not None and total_seconds * 1000 > args.budget_ms:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    # Run through the imported module so the app records its timings into the same IMPORT_TIMES
+    sys.exit(importlib.import_module("Startup").main())
@@ -0,0 +1,160 @@
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Verbose [DEBUG] output || set MMCMATE_DEBUG=0 in production to silence it entirely
+DEBUG_ENABLED = os.getenv("MMCMATE_DEBUG", "1") != "0"
+
+# One JSON line per finished request is appended here when set
+TRACE_LOG = os.getenv("TRACE_LOG")
+
+# Histogram bucket upper bounds in seconds
+BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# The request being handled in this thread/task, if any
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+class Histogram:
+    """Cumulative latency histogram in the Prometheus layout"""
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.total = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self.lock:
+            for index, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    self.counts[index] += 1
+            self.total += seconds
+            self.count += 1
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.counts), self.total, self.count
+
+
+# Stage name -> Histogram (stages are timed per request; nested stages overlap)
+_histograms = {}
+_histograms_lock = threading.Lock()
+_log_lock = threading.Lock()
+
+
+def observe(name, seconds):
+    with _histograms_lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+    histogram.observe(seconds)
+
+
+class Trace:
+    """Stage timings for one request"""
+
+    def __init__(self, request_id=None):
+        self.request_id = request_id or uuid.uuid4().hex[:8]
+        self.started = time.perf_counter()
+        self.stages = {}  # stage name -> seconds (summed when a stage runs more than once)
+        self.fields = {}
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+
+def debug(message):
+    """Print a [DEBUG] line tagged with the current request ID, unless debug output is off"""
+    if not DEBUG_ENABLED:
+        return
+    trace = _current_trace.get()
+    if trace is not None:
+        print(f"[DEBUG] [{trace.request_id}] {message}")
+    else:
+        print(f"[DEBUG] {message}")
+
+
+def start_trace(request_id=None):
+    """Begin timing a request in the current context"""
+    trace = Trace(request_id)
+    _current_trace.set(trace)
+    return trace
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def annotate(**fields):
+    """Attach extra fields (intent, cache hit, ...) to the current request"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.fields.update(fields)
+
+
+def record_stage(name, seconds):
+    """Add a stage timing to the current request, or straight to the histogram outside a request"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(name, seconds)
+    else:
+        observe(name, seconds)
+
+
+@contextmanager
+def stage(name):
+    """Time the enclosed block as one stage of the current request"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+def finish_trace(trace=None):
+    """Close the request: feed its stages into the histograms and write the JSONL record"""
+    trace = trace or _current_trace.get()
+    if trace is None:
+        return None
+    total = time.perf_counter() - trace.started
+    for name, seconds in trace.stages.items():
+        observe(name, seconds)
+    observe("request", total)
+    if _current_trace.get() is trace:
+        _current_trace.set(None)
+
+    record = {
+        "request_id": trace.request_id,
+        "timestamp": time.time(),
+        "total_ms": round(total * 1000, 3),
+        "stages_ms": {name: round(seconds * 1000, 3) for name, seconds in trace.stages.items()},
+    }
+    record.update(trace.fields)
+    if TRACE_LOG:
+        with _log_lock:
+            with open(TRACE_LOG, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    return record
+
+
+def export_prometheus():
+    """All stage histograms in the Prometheus text exposition format"""
+    lines = [
+        "# HELP mmcmate_stage_seconds Time spent per request in each pipeline stage",
+        "# TYPE mmcmate_stage_seconds histogram",
+    ]
+    with _histograms_lock:
+        histograms = sorted(_histograms.items())
+    for name, histogram in histograms:
+        counts, total, count = histogram.snapshot()
+        for bound, bucket_count in zip(BUCKETS, counts):
+            lines.append(f'mmcmate_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {bucket_count}')
+        lines.append(f'mmcmate_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {count}')
+        lines.append(f'mmcmate_stage_seconds_sum{{stage="{name}"}} {total}')
+        lines.append(f'mmcmate_stage_seconds_count{{stage="{name}"}} {count}')
+    return "\n".join(lines) + "\n"
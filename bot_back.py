@@ -1,36 +1,235 @@
 # history managing
-from ChatHistory import init_chat, add_message, display_chat
+from ChatHistory import init_chat, add_message, display_chat, justified_html, message_html, USER_AVATAR, ASSISTANT_AVATAR
 
 # for database and api
-import sqlite3 
 import os
-from langchain_google_genai import ChatGoogleGenerativeAI
+import asyncio
 from gemini_tone.tone import gem_tone
-import re
-
-# Import necessary LangChain components
-from langchain.memory import ConversationBufferMemory
-from langchain.prompts import PromptTemplate
-from langchain.chains import LLMChain
+from Retrieval import HandbookRetriever
+from Context import ContextBuilder, clip_tokens, count_tokens, WHITESPACE_PATTERN
+from Offenses import OffenseResolver, format_pages, parse_pages
+from Paraphrase import ParaphraseIndex
+from Faq import FaqArtifact, FaqStore, canonical_questions
+from Memory import ConversationMemory, format_history, is_follow_up
+from Handbook import HandbookSnapshot
+from Startup import record_time
+from AnswerCache import AnswerCache, hash_prompt, make_cache_key
+from Coalescing import SingleFlight
+from IntentRouter import IntentRouter
+from LLMBackend import backend_identity, create_backend
+from Resilience import CircuitBreaker, ModelCaller, ModelUnavailable
+from Scheduler import ModelScheduler, QueuePosition, SchedulerBusy
+from Tracing import annotate, debug, export_prometheus, finish_trace, record_stage, stage, start_trace
 
 # to deal with gui and secret keys
 import streamlit as st
 from dotenv import load_dotenv
+from contextlib import asynccontextmanager, contextmanager
 import time
 
 load_dotenv()
 
-# Initialize the input checker
-import Checkers as input_checker
-input_checker = input_checker.InputChecker()
+# Input checker class || the instance (word list + index) is built on first use
+import Checkers
 
 # Access the API_KEY environment variable
 api_key = os.getenv('API_KEY')
 
-# Initialize memory (this is where the conversation will be stored) || Initialize model with memory
-memory = ConversationBufferMemory(memory_key="messages", return_messages=True)
-model = ChatGoogleGenerativeAI(model="gemini-2.5-flash-preview-05-20", temperature=0.2, memory=memory, api_key=api_key)
-#model = ChatGoogleGenerativeAI(model="gemini-1.5-flash-8b", memory=memory, api_key=api_key)
+# Heavy singletons || built on first use and shared by every session through Streamlit resource caching
+@st.cache_resource(show_spinner=False)
+def get_input_checker():
+    start = time.perf_counter()
+    input_checker = Checkers.InputChecker()
+    record_time("InputChecker", start)
+    return input_checker
+
+# Which model answers || "gemini" in production, "stub" for offline benchmarks and tests
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
+
+@st.cache_resource(show_spinner=False)
+def get_backend():
+    return create_backend(LLM_BACKEND, api_key)
+
+# Model call policy || deadline per answer (per chunk when streaming), retries, hedging and the circuit breaker
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", "20"))
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "2"))
+LLM_RETRY_DELAY = float(os.getenv("LLM_RETRY_DELAY", "0.5"))
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0") == "1"
+LLM_HEDGE_DELAY = float(os.getenv("LLM_HEDGE_DELAY", "5"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET = float(os.getenv("LLM_BREAKER_RESET", "30"))
+
+# Retries and hedges spend the scheduler's provider quota like first requests do
+@st.cache_resource(show_spinner=False)
+def get_model_caller():
+    breaker = CircuitBreaker(LLM_BREAKER_FAILURES, LLM_BREAKER_RESET)
+    return ModelCaller(LLM_DEADLINE, LLM_RETRIES, LLM_RETRY_DELAY, LLM_HEDGE, LLM_HEDGE_DELAY, breaker, quota=get_scheduler())
+
+# Admission control in front of the model || concurrent calls, provider quota (0 means none) and the waiting line
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_RATE_PER_MINUTE = float(os.getenv("LLM_RATE_PER_MINUTE", "0"))
+LLM_RATE_BURST = int(os.getenv("LLM_RATE_BURST", "0"))
+LLM_QUEUE_SIZE = int(os.getenv("LLM_QUEUE_SIZE", "64"))
+LLM_QUEUE_PER_SESSION = int(os.getenv("LLM_QUEUE_PER_SESSION", "2"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+
+@st.cache_resource(show_spinner=False)
+def get_scheduler():
+    return ModelScheduler(LLM_MAX_CONCURRENCY, LLM_RATE_PER_MINUTE, LLM_RATE_BURST or None,
+                          LLM_QUEUE_SIZE, LLM_QUEUE_PER_SESSION, LLM_QUEUE_TIMEOUT)
+
+# Shown instead of waiting when the model queue is full
+BUSY_MESSAGE = "MMCMate is answering a lot of questions right now. Please try again in a moment."
+
+# Shown while a streamed question waits for a model slot
+QUEUE_MESSAGE = "Many students are asking right now, you are number {position} in line..."
+
+def busy_response(e):
+    annotate(busy=True)
+    debug(f"Turned away: {e}")
+    return BUSY_MESSAGE
+
+# Give a ticket back once the requests a model call left running in the worker pool have finished
+def discard_when_done(scheduler, ticket, left_running):
+    running = [future for future in left_running if not future.done()]
+    if not running:
+        scheduler.discard(ticket)
+        return
+    debug(f"Keeping the model slot until {len(running)} abandoned request(s) finish")
+
+    def finished(_):
+        if all(future.done() for future in running):
+            scheduler.discard(ticket)
+
+    for future in running:
+        future.add_done_callback(finished)
+
+# Hold a model slot around a plain model call || yields the list of requests the call leaves running, raises SchedulerBusy when there is no room
+@contextmanager
+def model_slot(chat_id):
+    scheduler = get_scheduler()
+    ticket = scheduler.submit(chat_id)
+    left_running = []
+    try:
+        start = time.perf_counter()
+        for position in scheduler.wait(ticket):
+            annotate(queue_position=position)
+        record_stage("queue_wait", time.perf_counter() - start)
+        yield left_running
+    finally:
+        discard_when_done(scheduler, ticket, left_running)
+
+@asynccontextmanager
+async def model_slot_async(chat_id):
+    scheduler = get_scheduler()
+    ticket = scheduler.submit(chat_id)
+    try:
+        start = time.perf_counter()
+        async for position in scheduler.wait_async(ticket):
+            annotate(queue_position=position)
+        record_stage("queue_wait", time.perf_counter() - start)
+        yield
+    finally:
+        scheduler.discard(ticket)
+
+# Prompt sent with every handbook question
+PROMPT_TEMPLATE = "{tone} Answer the query based on the following data: {user_input}. Limit up to 500 words. Here is the data: {db_content}"
+
+# Added for follow-up questions || the earlier turns of the same chat
+HISTORY_TEMPLATE = " Earlier in this conversation: {history}. Use it only to understand what the query refers to."
+
+def build_prompt(tone, user_input, db_content, history=None):
+    prompt_text = PROMPT_TEMPLATE.format(tone=tone, user_input=user_input, db_content=db_content)
+    if history:
+        prompt_text += HISTORY_TEMPLATE.format(history=format_history(history))
+    return prompt_text
+
+# Where compiled handbook artifacts live || "" reads the raw table instead
+HANDBOOK_ARTIFACT_DIR = os.getenv("HANDBOOK_ARTIFACT_DIR", "cache")
+
+@st.cache_resource(show_spinner=False)
+def get_handbook_snapshot(db_path):
+    return HandbookSnapshot(db_path, HANDBOOK_ARTIFACT_DIR)
+
+# The shared handbook data || reloaded only when the database file changes
+def get_handbook(db_path):
+    return get_handbook_snapshot(os.path.abspath(db_path)).get()
+
+# Answer cache settings || memory tier per process, SQLite tier shared by all processes
+ANSWER_CACHE_PATH = os.getenv("ANSWER_CACHE_PATH", os.path.join("cache", "answers.db"))
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "512"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_DISK_TTL = float(os.getenv("ANSWER_CACHE_DISK_TTL", str(7 * 24 * 3600)))
+
+@st.cache_resource(show_spinner=False)
+def get_answer_cache():
+    return AnswerCache(ANSWER_CACHE_PATH, ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL, ANSWER_CACHE_DISK_TTL)
+
+# Paraphrase reuse settings || how similar a rephrased question must be to reuse an answer (0 turns reuse off)
+PARAPHRASE_THRESHOLD = float(os.getenv("PARAPHRASE_THRESHOLD", "0.9"))
+PARAPHRASE_MAX_ENTRIES = int(os.getenv("PARAPHRASE_MAX_ENTRIES", "20000"))
+PARAPHRASE_AUDIT_LOG = os.getenv("PARAPHRASE_AUDIT_LOG", os.path.join("cache", "paraphrase_audit.jsonl"))
+
+@st.cache_resource(show_spinner=False)
+def get_paraphrase_index():
+    return ParaphraseIndex(PARAPHRASE_THRESHOLD, max_entries=PARAPHRASE_MAX_ENTRIES, audit_log=PARAPHRASE_AUDIT_LOG)
+
+# Conversation memory settings || turns and tokens kept per chat, how many chats and for how long
+CONVERSATION_MAX_TURNS = int(os.getenv("CONVERSATION_MAX_TURNS", "3"))
+CONVERSATION_MAX_TOKENS = int(os.getenv("CONVERSATION_MAX_TOKENS", "600"))
+CONVERSATION_MAX_SESSIONS = int(os.getenv("CONVERSATION_MAX_SESSIONS", "1000"))
+CONVERSATION_IDLE_SECONDS = float(os.getenv("CONVERSATION_IDLE_SECONDS", "1800"))
+
+@st.cache_resource(show_spinner=False)
+def get_conversation_memory():
+    return ConversationMemory(CONVERSATION_MAX_TURNS, CONVERSATION_MAX_TOKENS, CONVERSATION_MAX_SESSIONS, CONVERSATION_IDLE_SECONDS)
+
+# Earlier turns of the chat, only for questions that refer back to them
+def follow_up_history(chat_id, user_input):
+    if not chat_id or not is_follow_up(user_input):
+        return []
+    return get_conversation_memory().history(chat_id)
+
+# Remember a handbook answer for follow-up questions in the same chat || refusals, blank, busy and fallback replies are not remembered
+def remember_turn(chat_id, user_input, response):
+    if chat_id and response.strip() and "Unavailable" not in response and not response.startswith(NOT_ANSWERED) and not response.endswith(ANSWER_CUT_SHORT):
+        get_conversation_memory().remember(chat_id, user_input, response)
+
+# Remember a model answer for exact repeats and rephrasings || blank answers (e.g. safety blocked) are never kept, refusals are not reused for rephrasings
+def store_answer(user_input, cache_key, response):
+    if cache_key is None or not response.strip():
+        return
+    get_answer_cache().put(user_input, *cache_key, response)
+    if "Unavailable" not in response:
+        get_paraphrase_index().add(user_input, response, cache_key)
+
+# Cache hit/miss counters || each hit is one model call saved
+def answer_cache_stats():
+    return get_answer_cache().stats()
+
+# Stage latency histograms and cache counters in the Prometheus text format
+def export_metrics():
+    lines = [export_prometheus()]
+    for name, value in answer_cache_stats().items():
+        lines.append(f"mmcmate_answer_cache_{name} {value}\n")
+    for name, value in get_single_flight().stats().items():
+        suffix = "" if name == "in_flight" else "_total"
+        lines.append(f"mmcmate_single_flight_{name}{suffix} {value}\n")
+    # Ranked, never labelled with the question || student text stays out of metrics and the series stay bounded
+    for rank, (_, waiters) in enumerate(get_single_flight().hot_questions(), 1):
+        lines.append(f'mmcmate_single_flight_recent_waiters{{rank="{rank}"}} {waiters}\n')
+    for name, value in get_scheduler().stats().items():
+        suffix = "" if name in {"active", "waiting"} else "_total"
+        lines.append(f"mmcmate_llm_queue_{name}{suffix} {value}\n")
+    for name, value in get_model_caller().stats().items():
+        suffix = "" if name == "breaker_state" else "_total"
+        lines.append(f"mmcmate_llm_{name}{suffix} {value}\n")
+    for name, value in get_conversation_memory().stats().items():
+        lines.append(f"mmcmate_conversation_memory_{name} {value}\n")
+    for check, counters in get_intent_router().pipeline.stats().items():
+        for outcome, value in counters.items():
+            lines.append(f'mmcmate_validation_checks_total{{check="{check}",outcome="{outcome}"}} {value}\n')
+    return "".join(lines)
 
 # Keywords for conversation || FACTS - Lists
 GREETING_KEYWORDS = ["hi", "hello", "hey", "greetings", "whats up", "what's up", "yo", "how are you", "how are you doing"]
@@ -42,96 +241,609 @@ IDENTITY_KEYWORDS = [ "what are you", "who are you", "are you a bot", "what is y
                      "what can you do", "your purpose", "are you human",  "describe yourself", "tell me about yourself",
                      "what do you do", "what is your function", "what is your role", "what are you here for",]
 
-# Connect to SQLite database and fetch the raw data
+# Keyword sets and guard patterns compiled once
+@st.cache_resource(show_spinner=False)
+def get_intent_router():
+    return IntentRouter(get_input_checker(), GREETING_KEYWORDS, GOODBYE_KEYWORDS, IDENTITY_KEYWORDS, ACCEPTED_KEYWORDS)
+
+# Retrieval settings || how many rows go to the model and how sure the search must be
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "8"))
+RETRIEVAL_MIN_SCORE = float(os.getenv("RETRIEVAL_MIN_SCORE", "2.0"))
+
+# Most handbook tokens put into one prompt || lower is faster and cheaper, 0 means no limit
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "8000"))
+context_builder = ContextBuilder(CONTEXT_TOKEN_BUDGET)
+
+# Connect to SQLite database and fetch the raw data || served from the shared snapshot, reloaded only when the file changes
 def extract_raw_data_from_db(db_path):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    return get_handbook(db_path).content
 
-    cursor.execute("SELECT * from databaseBot") 
-    rows = cursor.fetchall()
+# One search index per database file, rebuilt when the handbook version changes
+_retrievers = {}
 
-    # Joining the rows as a string for the API input
-    db_content = "\n".join([" ".join(map(str, row)) for row in rows])
-    
-    conn.close()
+def get_retriever(db_path):
+    handbook = get_handbook(db_path)
+    cached = _retrievers.get(db_path)
+    if cached is None or cached[0] != handbook.version:
+        compiled = handbook.compiled
+        search_index = compiled.search if compiled is not None else None
+        retriever = HandbookRetriever(handbook.rows, top_k=RETRIEVAL_TOP_K, min_score=RETRIEVAL_MIN_SCORE, search_index=search_index)
+        if compiled is not None:
+            context_builder.preload(compiled.rows, compiled.entries)
+        _retrievers[db_path] = cached = (handbook.version, retriever)
+    return cached[1]
+
+# Offense ID and category index per database file, rebuilt when the handbook version changes
+_offense_resolvers = {}
+
+def get_offense_resolver(db_path):
+    handbook = get_handbook(db_path)
+    cached = _offense_resolvers.get(db_path)
+    if cached is None or cached[0] != handbook.version:
+        compiled = handbook.compiled
+        if compiled is not None:
+            resolver = OffenseResolver(compiled.rows, compiled.children, compiled.pages, compiled.sections)
+        else:
+            resolver = OffenseResolver(handbook.rows, sections=handbook.sections)
+        _offense_resolvers[db_path] = cached = (handbook.version, resolver)
+    return cached[1]
+
+# Questions that only name an offense ID or category are answered from the table || None sends it on to the model
+def resolve_offense_question(db_path, user_input):
+    with stage("offense_lookup"):
+        response = get_offense_resolver(db_path).resolve(user_input)
+    if response is not None:
+        annotate(fast_path="offense_lookup")
+        debug("Answered from the offense index")
+    return response
+
+# Only the rows relevant to the question || falls back to the whole handbook (best matches first) when the search is unsure
+def extract_relevant_data_from_db(db_path, user_input, k=None):
+    retriever = get_retriever(db_path)
+    rows = retriever.retrieve(user_input, k)
+    if rows is None:
+        debug("Low retrieval confidence, using full handbook")
+        rows = retriever.rank(user_input)
+    db_content, tokens, packed = context_builder.build(rows)
+    annotate(context_tokens=tokens, context_rows=packed)
+    debug(f"Context: {packed}/{len(rows)} rows, {tokens} tokens (budget {CONTEXT_TOKEN_BUDGET})")
     return db_content
 
-# Modify your query_gemini_api function to utilize memory
-def query_gemini_api(db_path, user_input):
-    tone = gem_tone() 
+# Cache scope of a model answer || the handbook it came from, the prompt and the model that produced it
+def answer_scope(db_path, tone):
+    return (get_handbook(db_path).version, hash_prompt(tone, PROMPT_TEMPLATE, str(CONTEXT_TOKEN_BUDGET), backend_identity(LLM_BACKEND)))
 
-    # Default full database content
-    db_content = extract_raw_data_from_db(db_path)
+# Precomputed FAQ answers || FAQ_PATH="" turns them off, FAQ_AUTO_BUILD=0 leaves rebuilding to `python Faq.py`
+FAQ_PATH = os.getenv("FAQ_PATH", os.path.join("cache", "faq.json"))
+FAQ_THRESHOLD = float(os.getenv("FAQ_THRESHOLD", "0.9"))
+FAQ_AUTO_BUILD = os.getenv("FAQ_AUTO_BUILD", "1") == "1"
+FAQ_BUILD_CONCURRENCY = int(os.getenv("FAQ_BUILD_CONCURRENCY", "4"))
+FAQ_RETRY_SECONDS = float(os.getenv("FAQ_RETRY_SECONDS", "600"))
 
-    # Define the prompt
-    prompt = PromptTemplate(
-        input_variables=["db_content", "user_input", "tone"],
-        template="{tone} Answer the query based on the following data: {user_input}. Limit up to 500 words. Here is the data: {db_content}"
-    )
+# The build queues for model slots as one chat, so live questions get their round robin turns in between
+FAQ_BUILD_SESSION = "faq-build"
 
-    user_input = user_input.strip().lower()
-    llm_chain = LLMChain(prompt=prompt, llm=model)
+@st.cache_resource(show_spinner=False)
+def get_faq_store(db_path):
+    build = (lambda: build_faq(db_path)) if FAQ_AUTO_BUILD else None
+    return FaqStore(FAQ_PATH, FAQ_THRESHOLD, build, FAQ_RETRY_SECONDS)
+
+# Answer every canonical question with the live prompt and write the artifact for the current handbook
+def build_faq(db_path, path=None, concurrency=None):
+    handbook = get_handbook(db_path)
+    tone = gem_tone()
+    questions = canonical_questions(handbook.sections)
+    # No more at once than one chat may have waiting, the build is never turned away for queueing too much
+    slots = asyncio.Semaphore(max(min(concurrency or FAQ_BUILD_CONCURRENCY, LLM_QUEUE_PER_SESSION), 1))
+
+    async def generate(question):
+        async with slots:
+            prompt_text = build_prompt(tone, question, extract_relevant_data_from_db(db_path, question))
+            # Same admission control, deadline, retries and circuit breaker as live questions
+            async with model_slot_async(FAQ_BUILD_SESSION):
+                return await get_model_caller().call_async(lambda: get_backend().agenerate(prompt_text, question))
+
+    async def generate_all():
+        return await asyncio.gather(*(generate(question) for question, _, _ in questions), return_exceptions=True)
+
+    entries = []
+    for (question, type_name, category), answer in zip(questions, asyncio.run(generate_all())):
+        if isinstance(answer, Exception) or not answer.strip() or "Unavailable" in answer:
+            debug(f"FAQ: no answer for '{question}' ({answer if isinstance(answer, Exception) else 'Unavailable'})")
+            continue
+        entries.append({"question": question, "type": type_name, "category": category, "answer": answer})
+    if not entries:
+        # Nothing to serve (model down, breaker open), leave the old artifact and try again later
+        raise RuntimeError(f"no answers for any of the {len(questions)} questions")
+
+    artifact = FaqArtifact(*answer_scope(db_path, tone), entries)
+    artifact.save(path or FAQ_PATH)
+    debug(f"FAQ artifact: {len(entries)}/{len(questions)} answers for handbook {artifact.handbook_version}")
+    return artifact
+
+# Canonical questions (and close rephrasings) answered from the artifact || None when there is no current artifact
+def lookup_faq(db_path, user_input, scope):
+    if not FAQ_PATH:
+        return None
+    with stage("faq_lookup"):
+        faq = get_faq_store(os.path.abspath(db_path)).get(*scope)
+        response = faq.lookup(user_input) if faq is not None else None
+    annotate(faq_hit=response is not None)
+    if response is not None:
+        debug("Answered from the FAQ artifact")
+    return response
+
+# Rows shown when the model cannot answer in time
+FALLBACK_ROWS = int(os.getenv("FALLBACK_ROWS", "3"))
+
+FALLBACK_INTRO = "I couldn't get a complete answer right now, so here are the handbook sections closest to your question:"
+FALLBACK_NO_MATCH = "I'm sorry, I couldn't get an answer right now. Please try again in a moment."
+
+# Ends an answer that stopped part way || what was shown stays, but it is never cached or remembered
+ANSWER_CUT_SHORT = "\n\nI'm sorry, the rest of this answer could not be loaded. Please ask again."
+
+# Retrieval-only answer || the best matching raw handbook rows with their page numbers, never cached
+def retrieval_fallback(db_path, user_input):
+    annotate(fallback=True)
+    retriever = get_retriever(db_path)
+    rows = [retriever.rows[index] for index, _ in retriever.search(user_input, FALLBACK_ROWS)]
+    if not rows:
+        return FALLBACK_NO_MATCH
+    lines = [FALLBACK_INTRO]
+    for offense_id, type_name, category, description, sanctions, page in rows:
+        description = clip_tokens(WHITESPACE_PATTERN.sub(" ", description or "").strip(), 120)
+        title = f"{category or type_name} ({offense_id})" if offense_id else (category or type_name)
+        lines.append(f"- **{title}:** {description}" + (f" Sanctions: {sanctions}." if sanctions else ""))
+    ranges = [parse_pages(row[5]) for row in rows]
+    pages = format_pages([page for page in ranges if page])
+    if pages:
+        lines.append(f"We recommend you to check page(s) {pages} in the handbook for more details.")
+    return "\n\n".join(lines)
+
+# Replies that stand in for an answer
+NOT_ANSWERED = (BUSY_MESSAGE, FALLBACK_INTRO, FALLBACK_NO_MATCH)
+
+# Everything a model call needs || the cached answer when there is one, otherwise the assembled prompt
+def prepare_model_call(db_path, user_input, tone, history=None):
+    if history:
+        # A follow-up depends on its own chat, so it never reads or fills the shared caches
+        annotate(follow_up=True, cache_hit=False)
+        debug(f"Follow-up question, {len(history)} earlier turn(s) in the prompt")
+        with stage("retrieval"):
+            db_content = extract_relevant_data_from_db(db_path, f"{history[-1][0]} {user_input}")
+        with stage("prompt_assembly"):
+            prompt_text = build_prompt(tone, user_input, db_content, history)
+        annotate(prompt_tokens=count_tokens(prompt_text))
+        return None, prompt_text, None
+
+    cache_key = answer_scope(db_path, tone)
+    response = lookup_faq(db_path, user_input, cache_key)
+    if response is not None:
+        return response, None, cache_key
+
+    with stage("cache_lookup"):
+        response = get_answer_cache().get(user_input, *cache_key)
+    annotate(cache_hit=response is not None)
+    if response is not None:
+        debug("Answer cache hit")
+        return response, None, cache_key
+
+    with stage("paraphrase_lookup"):
+        response = get_paraphrase_index().lookup(user_input, cache_key)
+    annotate(paraphrase_hit=response is not None)
+    if response is not None:
+        return response, None, cache_key
+
+    with stage("retrieval"):
+        db_content = extract_relevant_data_from_db(db_path, user_input)
+    with stage("prompt_assembly"):
+        prompt_text = build_prompt(tone, user_input, db_content)
+    annotate(prompt_tokens=count_tokens(prompt_text))
+    return None, prompt_text, cache_key
+
+# Single-flight coalescing || identical questions asked at the same time share one model call
+@st.cache_resource(show_spinner=False)
+def get_single_flight():
+    return SingleFlight()
 
+# Same question, handbook and prompt share a flight || follow-ups depend on their chat and never do
+def flight_key(user_input, cache_key):
+    return make_cache_key(user_input, *cache_key) if cache_key is not None else None
+
+# The model's answer to a cache miss || a busy or retrieval-only answer when the model cannot be used
+def generate_answer(db_path, user_input, prompt_text, cache_key, chat_id):
+    try:
+        with model_slot(chat_id) as left_running, stage("llm_call"):
+            response = get_model_caller().call(lambda: get_backend().generate(prompt_text, user_input), left_running)
+    except SchedulerBusy as e:
+        return busy_response(e)
+    except ModelUnavailable as e:
+        debug(f"{e}, answering from retrieval")
+        return retrieval_fallback(db_path, user_input)
+    store_answer(user_input, cache_key, response)
+    return response
+
+# Async version of generate_answer
+async def generate_answer_async(db_path, user_input, prompt_text, cache_key, chat_id):
+    try:
+        async with model_slot_async(chat_id):
+            with stage("llm_call"):
+                response = await get_model_caller().call_async(lambda: get_backend().agenerate(prompt_text, user_input))
+    except SchedulerBusy as e:
+        return busy_response(e)
+    except ModelUnavailable as e:
+        debug(f"{e}, answering from retrieval")
+        return retrieval_fallback(db_path, user_input)
+    await asyncio.to_thread(store_answer, user_input, cache_key, response)
+    return response
+
+# Ask the model about the handbook || repeated questions are answered from the cache
+def ask_model(db_path, user_input, tone, chat_id=None):
+    response, prompt_text, cache_key = prepare_model_call(db_path, user_input, tone, follow_up_history(chat_id, user_input))
+    if response is None:
+        key = flight_key(user_input, cache_key)
+        generate = lambda: generate_answer(db_path, user_input, prompt_text, cache_key, chat_id)
+        response = get_single_flight().run(key, user_input, generate) if key else generate()
+    remember_turn(chat_id, user_input, response)
+    return response
+
+# Async version of ask_model || used by the query service so the event loop is never blocked on the model
+# The cache, paraphrase and retrieval lookups (SQLite and file I/O) run in a worker thread
+async def ask_model_async(db_path, user_input, tone, chat_id=None):
+    history = follow_up_history(chat_id, user_input)
+    response, prompt_text, cache_key = await asyncio.to_thread(prepare_model_call, db_path, user_input, tone, history)
+    if response is None:
+        key = flight_key(user_input, cache_key)
+        generate = lambda: generate_answer_async(db_path, user_input, prompt_text, cache_key, chat_id)
+        response = await (get_single_flight().run_async(key, user_input, generate) if key else generate())
+    remember_turn(chat_id, user_input, response)
+    return response
+
+# The model's answer to a cache miss chunk by chunk || QueuePosition markers while it waits for a slot
+def stream_answer(db_path, user_input, prompt_text, cache_key, chat_id):
+    scheduler = get_scheduler()
+    try:
+        ticket = scheduler.submit(chat_id)
+    except SchedulerBusy as e:
+        yield busy_response(e)
+        return
+
+    # The ticket goes back however the stream ends, including a reader that leaves while it is queued
+    left_running = []
+    try:
+        start = time.perf_counter()
+        try:
+            for position in scheduler.wait(ticket):
+                annotate(queue_position=position)
+                yield QueuePosition(position)
+        except SchedulerBusy as e:
+            yield busy_response(e)
+            return
+        record_stage("queue_wait", time.perf_counter() - start)
+
+        parts = []
+        start = time.perf_counter()
+        try:
+            for chunk in get_model_caller().stream(lambda: get_backend().stream(prompt_text, user_input), left_running):
+                if not parts:
+                    record_stage("llm_first_token", time.perf_counter() - start)
+                parts.append(chunk)
+                yield chunk
+        except ModelUnavailable as e:
+            # Part of the answer may already be on screen, it is ended there and never cached
+            debug(f"{e}, {'cutting the answer short' if parts else 'answering from retrieval'}")
+            yield ANSWER_CUT_SHORT if parts else retrieval_fallback(db_path, user_input)
+            return
+        record_stage("llm_call", time.perf_counter() - start)
+    finally:
+        discard_when_done(scheduler, ticket, left_running)
+
+    # Only complete answers are cached (not ones cut short by the reader)
+    store_answer(user_input, cache_key, "".join(parts))
+
+# Async version of stream_answer
+async def stream_answer_async(db_path, user_input, prompt_text, cache_key, chat_id):
+    scheduler = get_scheduler()
+    try:
+        ticket = scheduler.submit(chat_id)
+    except SchedulerBusy as e:
+        yield busy_response(e)
+        return
+
+    try:
+        start = time.perf_counter()
+        try:
+            async for position in scheduler.wait_async(ticket):
+                annotate(queue_position=position)
+                yield QueuePosition(position)
+        except SchedulerBusy as e:
+            yield busy_response(e)
+            return
+        record_stage("queue_wait", time.perf_counter() - start)
+
+        parts = []
+        start = time.perf_counter()
+        try:
+            async for chunk in get_model_caller().astream(lambda: get_backend().astream(prompt_text, user_input)):
+                if not parts:
+                    record_stage("llm_first_token", time.perf_counter() - start)
+                parts.append(chunk)
+                yield chunk
+        except ModelUnavailable as e:
+            debug(f"{e}, {'cutting the answer short' if parts else 'answering from retrieval'}")
+            yield ANSWER_CUT_SHORT if parts else retrieval_fallback(db_path, user_input)
+            return
+        record_stage("llm_call", time.perf_counter() - start)
+    finally:
+        scheduler.discard(ticket)
+
+    await asyncio.to_thread(store_answer, user_input, cache_key, "".join(parts))
+
+# Same as ask_model but yields the answer chunk by chunk as the model produces it
+def stream_model(db_path, user_input, tone, chat_id=None):
+    response, prompt_text, cache_key = prepare_model_call(db_path, user_input, tone, follow_up_history(chat_id, user_input))
+    if response is not None:
+        remember_turn(chat_id, user_input, response)
+        yield response
+        return
+
+    key = flight_key(user_input, cache_key)
+    open_stream = lambda: stream_answer(db_path, user_input, prompt_text, cache_key, chat_id)
+    parts = []
+    try:
+        for chunk in get_single_flight().stream(key, user_input, open_stream) if key else open_stream():
+            if isinstance(chunk, str):
+                parts.append(chunk)
+            yield chunk
+    except Exception as e:
+        # The shared model call failed, or the chat leading it left before it could be finished
+        debug(f"Shared answer failed: {e!r}")
+        yield ANSWER_CUT_SHORT if parts else retrieval_fallback(db_path, user_input)
+        return
+    # Only complete answers are remembered (not ones cut short by the reader)
+    remember_turn(chat_id, user_input, "".join(parts))
+
+# Async version of stream_model
+async def stream_model_async(db_path, user_input, tone, chat_id=None):
+    history = follow_up_history(chat_id, user_input)
+    response, prompt_text, cache_key = await asyncio.to_thread(prepare_model_call, db_path, user_input, tone, history)
+    if response is not None:
+        remember_turn(chat_id, user_input, response)
+        yield response
+        return
+
+    key = flight_key(user_input, cache_key)
+    open_stream = lambda: stream_answer_async(db_path, user_input, prompt_text, cache_key, chat_id)
+    parts = []
+    try:
+        async for chunk in get_single_flight().astream(key, user_input, open_stream) if key else open_stream():
+            if isinstance(chunk, str):
+                parts.append(chunk)
+            yield chunk
+    except Exception as e:
+        debug(f"Shared answer failed: {e!r}")
+        yield ANSWER_CUT_SHORT if parts else retrieval_fallback(db_path, user_input)
+        return
+    remember_turn(chat_id, user_input, "".join(parts))
+
+# Shown instead of a vague "Unavailable" answer from the model
+UNAVAILABLE_MESSAGE = "I'm sorry, I couldn't find an answer to your question. Could you please rephrase it or ask something else?"
+
+# How much of a streamed answer is held back before showing it || enough to catch a bare "Unavailable"
+UNAVAILABLE_HOLD_CHARS = int(os.getenv("UNAVAILABLE_HOLD_CHARS", "24"))
+
+class UnavailableFilter:
+    """Holds back the opening of a streamed answer so a bare 'Unavailable' never reaches the screen"""
+
+    def __init__(self):
+        self.buffered = ""
+        self.rejected = False
+        self.blank = True
+
+    def feed(self, chunk):
+        """Return the text that can be shown now ('' while holding back)"""
+        self.blank = self.blank and not chunk.strip()
+        if self.buffered is None:
+            return chunk
+
+        self.buffered += chunk
+        if "Unavailable" in self.buffered:
+            debug("Unavailable response detected.")
+            self.rejected = True
+            return UNAVAILABLE_MESSAGE
+        if len(self.buffered) >= UNAVAILABLE_HOLD_CHARS:
+            text, self.buffered = self.buffered, None
+            return text
+        return ""
+
+    def flush(self):
+        """Whatever is still held back once the stream ends || a stream with no text at all is an unavailable answer"""
+        if self.blank:
+            debug("Blank response detected.")
+            self.buffered = None
+            return UNAVAILABLE_MESSAGE
+        text, self.buffered = self.buffered or "", None
+        return text
+
+def filter_unavailable(chunks):
+    unavailable_filter = UnavailableFilter()
+    for chunk in chunks:
+        if isinstance(chunk, QueuePosition):
+            yield chunk
+            continue
+        text = unavailable_filter.feed(chunk)
+        if text:
+            yield text
+        if unavailable_filter.rejected:
+            return
+    text = unavailable_filter.flush()
+    if text:
+        yield text
+
+async def filter_unavailable_async(chunks):
+    unavailable_filter = UnavailableFilter()
+    async for chunk in chunks:
+        if isinstance(chunk, QueuePosition):
+            yield chunk
+            continue
+        text = unavailable_filter.feed(chunk)
+        if text:
+            yield text
+        if unavailable_filter.rejected:
+            return
+    text = unavailable_filter.flush()
+    if text:
+        yield text
+
+# Fixed answers for everything the router can answer without the model || None means ask the model
+def canned_response(intent):
     # Reject dangerous or nonsensical inputs
-    if any([
-        input_checker.is_mathematical_expression(user_input),
-        input_checker.is_nonsensical_input(user_input),
-        input_checker.is_sql_injection_attempt(user_input)
-    ]):
-        print("[DEBUG] Reject")
+    if intent == "reject":
         return "I'm sorry, I can't help you with that. Please ask questions regarding the handbook. Could you please ask something else or clarify your question?"
 
     # Check for greetings, goodbye, keywords
-    elif input_checker.contains_keywords(user_input, GOODBYE_KEYWORDS):
-        print("[DEBUG] Goodbye")
+    elif intent == "goodbye":
         return "You are very much welcome! I am glad I could help!"
 
-    elif input_checker.contains_keywords(user_input, GREETING_KEYWORDS) and len(user_input) <= 17:
-        print("[DEBUG] Greeting")
+    elif intent == "greeting":
         return "Hello! How may I assist you today?"
     
     # Identity queries
-    elif any(phrase in user_input.lower() for phrase in IDENTITY_KEYWORDS):
-        print("[DEBUG] Identity")
+    elif intent == "identity":
         return "I'm MMCMate, your AI chatbot assistant designed to help students understand Mapúa MCM’s school policies, rights, and responsibilities."
 
-    # User ONLY typed "mmcm" or "mcm" (nothing else)
-    elif user_input.strip() in {"mmcm", "mcm"}:
-        print("[DEBUG] MMCM or MCM")
+    # User ONLY typed "mmcm" or "mcm" (nothing else) || or a general identity query (but NOT handbook-related)
+    elif intent in {"mmcm", "mmcm_general"}:
         return (
             "MMCM is the acronym for Mapúa Malayan Colleges Mindanao, a private educational institution in the Philippines. "
             "It is part of the Mapúa University system. If you have specific questions about MMCM, feel free to ask!"
         )
 
-    # General identity query (but NOT handbook-related)
-    elif (
-        re.search(r"\b(what is|who.*is|tell me about)\b.*\b(mmcm|mcm)\b", user_input)
-        and not input_checker.contains_keywords(user_input, ACCEPTED_KEYWORDS)
-    ):
-        print("[DEBUG] MMCM or MCM - General Identity")
-        return (
-            "MMCM is the acronym for Mapúa Malayan Colleges Mindanao, a private educational institution in the Philippines. "
-            "It is part of the Mapúa University system. If you have specific questions about MMCM, feel free to ask!"
-        )
-    
-    # Only now check for valid handbook-related queries
-    elif input_checker.contains_keywords(user_input, ACCEPTED_KEYWORDS):
-        print("[DEBUG] In LLM - acceppted keywords")
-        response = llm_chain.run({"db_content": db_content, "user_input": user_input, "tone": tone})
+    # Valid handbook-related queries and everything else go to the model
+    return None
 
-    else:
-        print("[DEBUG] In LLM - not accepted keywords")
-        response = llm_chain.run({"db_content": db_content, "user_input": user_input, "tone": tone})
-
-    # Catch vague LLM responses
+# Catch vague and blank LLM responses
+def check_unavailable(response):
+    if not response.strip():
+        debug("Blank response detected.")
+        return UNAVAILABLE_MESSAGE
     if "Unavailable" in response:
-        print("[DEBUG] Unavailable response detected.")
-        return "I'm sorry, I couldn't find an answer to your question. Could you please rephrase it or ask something else?"
-
+        debug("Unavailable response detected.")
+        return UNAVAILABLE_MESSAGE
     return response
 
+def route_message(user_input):
+    route = get_intent_router().route(user_input)
+    annotate(intent=route["intent"])
+    debug(f"Intent: {route['intent']} ({route['keyword']}) in {route['elapsed_ms']:.2f} ms")
+    return route
+
+# Modify your query_gemini_api function to utilize memory || stream=True returns a generator of chunks for model answers
+# chat_id gives follow-up questions the earlier turns of their own chat
+def query_gemini_api(db_path, user_input, stream=False, chat_id=None):
+    tone = gem_tone() 
+
+    user_input = user_input.strip().lower()
+
+    route = route_message(user_input)
+
+    # Exact offense ID/category lookups first || also catches names the keyword checks misread (e.g. "academic dishonesty")
+    if route["intent"] != "reject":
+        response = resolve_offense_question(db_path, user_input)
+        if response is not None:
+            remember_turn(chat_id, user_input, response)
+            return response
+
+    response = canned_response(route["intent"])
+    if response is not None:
+        return response
+
+    if stream:
+        return filter_unavailable(stream_model(db_path, user_input, tone, chat_id))
+    return check_unavailable(ask_model(db_path, user_input, tone, chat_id))
+
+# Async version of query_gemini_api || the CPU-bound input checks and the handbook lookups run in a worker thread
+async def query_gemini_api_async(db_path, user_input, stream=False, chat_id=None):
+    tone = gem_tone()
 
-def handle_conversation(db_path):
+    user_input = user_input.strip().lower()
+
+    route = await asyncio.to_thread(route_message, user_input)
+
+    if route["intent"] != "reject":
+        response = await asyncio.to_thread(resolve_offense_question, db_path, user_input)
+        if response is not None:
+            remember_turn(chat_id, user_input, response)
+            return response
+
+    response = canned_response(route["intent"])
+    if response is not None:
+        return response
+
+    if stream:
+        return filter_unavailable_async(stream_model_async(db_path, user_input, tone, chat_id))
+    return check_unavailable(await ask_model_async(db_path, user_input, tone, chat_id))
+
+# Minimum time between chat bubble updates while streaming
+STREAM_RENDER_INTERVAL = float(os.getenv("STREAM_RENDER_INTERVAL", "0.05"))
+
+def render_stream(placeholder, chunks):
+    """Render chunks into the placeholder as they arrive, batching updates; returns the full message"""
+    assistant_message = ""
+    start = time.perf_counter()
+    last_render = None
+    for chunk in chunks:
+        # Still waiting for a model slot
+        if isinstance(chunk, QueuePosition):
+            placeholder.markdown(f"_{QUEUE_MESSAGE.format(position=chunk.position)}_")
+            continue
+        if not assistant_message:
+            record_stage("first_chunk_shown", time.perf_counter() - start)
+            debug(f"Time to first token: {(time.perf_counter() - start) * 1000:.0f} ms")
+        assistant_message += chunk
+
+        now = time.perf_counter()
+        if last_render is None or now - last_render >= STREAM_RENDER_INTERVAL:
+            # Partial answers are never shown again, so they stay out of the message cache
+            with stage("render"):
+                placeholder.markdown(justified_html(assistant_message), unsafe_allow_html=True)
+            last_render = now
+
+    # "Unavailable" can also show up after the held-back opening, and an empty stream has nothing to show
+    if not assistant_message.strip() or "Unavailable" in assistant_message:
+        debug("Unavailable response detected.")
+        assistant_message = UNAVAILABLE_MESSAGE
+
+    with stage("render"):
+        placeholder.markdown(message_html(assistant_message), unsafe_allow_html=True)
+    return assistant_message
+
+
+# The answer from this process
+def local_stream(db_path, user_input, chat_id):
+    # A chat loaded from history (or dropped while idle) gets its last turns back
+    get_conversation_memory().restore(chat_id, st.session_state.messages[:-1])
+    result_gen = query_gemini_api(db_path, user_input, stream=True, chat_id=chat_id)
+    if isinstance(result_gen, str):
+        result_gen = [result_gen]
+    return result_gen
+
+# The answer from the query service || answered here instead when the service is down, times out or reports an error
+def service_stream(client, db_path, user_input, chat_id):
+    shown = False
+    try:
+        for chunk in client.stream(user_input, chat_id):
+            shown = shown or isinstance(chunk, str)
+            yield chunk
+    except Exception as e:
+        # Part of the answer may already be on screen, it is ended there like a model stream that stops
+        debug(f"Query service failed: {e!r}, {'cutting the answer short' if shown else 'answering here'}")
+        if shown:
+            yield ANSWER_CUT_SHORT
+        else:
+            yield from local_stream(db_path, user_input, chat_id)
+
+def handle_conversation(db_path, client=None):
     # Initialize chat history
     init_chat()
     
@@ -139,25 +851,30 @@ def handle_conversation(db_path):
     user_input = st.chat_input("Ask me anything about the school's handbook!")
 
     if user_input:
+        # Time every stage of this message
+        trace = start_trace()
+
         # Add user message to session state
         add_message("user", user_input)
+        if not st.session_state.current_chat_id:
+            st.session_state.current_chat_id = st.session_state.chat_manager.generate_chat_id()
+        chat_id = st.session_state.current_chat_id
         
         # Display user message immediately
-        with st.chat_message("user", avatar='https://raw.githubusercontent.com/vennDiagramm/MMCMate_An_AI_Chatbot_for_School_Policy_Assistance/main/icons/user_icon.ico'):
+        with st.chat_message("user", avatar=USER_AVATAR):
             st.markdown(user_input)
 
-        # Get assistant response
-        result_gen = query_gemini_api(db_path, user_input)
+        # Get assistant response || model answers come back as a stream of chunks, from the query service if one is set
+        if client is not None:
+            result_gen = service_stream(client, db_path, user_input, chat_id)
+        else:
+            result_gen = local_stream(db_path, user_input, chat_id)
 
-        # Display assistant response with typing effect
-        with st.chat_message("assistant", avatar='https://raw.githubusercontent.com/vennDiagramm/MMCMate_An_AI_Chatbot_for_School_Policy_Assistance/main/icons/mapua_icon_83e_icon.ico'):
-            assistant_message = ""
+        # Display assistant response as it streams in
+        with st.chat_message("assistant", avatar=ASSISTANT_AVATAR):
             placeholder = st.empty()
-            for word in result_gen:
-                assistant_message += word
-                justified_html = f"<div style='text-align: justify;'>{assistant_message}</div>"
-                placeholder.markdown(justified_html, unsafe_allow_html=True)
-                time.sleep(0.02)
+            assistant_message = render_stream(placeholder, result_gen)
 
         # Add assistant response to session state
-        add_message("assistant", assistant_message)
\ No newline at end of file
+        add_message("assistant", assistant_message)
+        finish_trace(trace)
\ No newline at end of file
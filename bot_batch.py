@@ -0,0 +1,170 @@
+import argparse
+import asyncio
+import csv
+import json
+import os
+import sys
+import tempfile
+import time
+
+from Tracing import annotate, finish_trace, start_trace
+
+# Path to the database
+DB_PATH = os.path.join("database", "databasefinalnjud.db")
+
+
+def read_questions(path):
+    """Questions from a .csv (question column) or JSONL file ({"question": ...} or {"user_input": ...} per line)
+
+    An optional id and expected answer are kept for the report.
+    """
+    if path.lower().endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as f:
+            records = list(csv.DictReader(f))
+    else:
+        with open(path, encoding="utf-8") as f:
+            records = [json.loads(line) for line in f if line.strip()]
+
+    questions = []
+    for index, record in enumerate(records):
+        question = record.get("question") or record.get("user_input")
+        if not question:
+            raise ValueError(f"{path}: record {index + 1} has no question")
+        questions.append({"id": record.get("id") or str(index + 1), "question": question, "expected": record.get("expected")})
+    return questions
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of an already sorted list"""
+    if not values:
+        return 0.0
+    rank = max(1, -(-len(values) * p // 100))  # ceil without floats
+    return values[int(rank) - 1]
+
+
+class BatchRunner:
+    """Runs questions through query_gemini_api_async with at most `concurrency` in flight"""
+
+    def __init__(self, back, db_path=DB_PATH, concurrency=8, timeout=60):
+        self.back = back
+        self.db_path = db_path
+        self.slots = asyncio.Semaphore(concurrency)
+        self.timeout = timeout
+
+    async def run_one(self, item):
+        async with self.slots:
+            trace = start_trace()
+            annotate(question_id=item["id"])
+            answer, error = None, None
+            try:
+                answer = await asyncio.wait_for(self.back.query_gemini_api_async(self.db_path, item["question"]), self.timeout)
+            except asyncio.TimeoutError:
+                error = "timeout"
+            except Exception as e:
+                error = str(e)
+            record = finish_trace(trace)
+
+        result = {
+            "id": item["id"],
+            "question": item["question"],
+            "answer": answer,
+            "error": error,
+            "intent": record.get("intent"),
+            "cache_hit": record.get("cache_hit"),
+            "paraphrase_hit": record.get("paraphrase_hit"),
+            "fast_path": record.get("fast_path"),
+            "total_ms": record["total_ms"],
+            "stages_ms": record["stages_ms"],
+        }
+        if item["expected"] is not None:
+            result["expected"] = item["expected"]
+            result["matches_expected"] = answer is not None and answer.strip() == item["expected"].strip()
+        return result
+
+    async def run(self, questions, output):
+        results = []
+        for task in asyncio.as_completed([self.run_one(item) for item in questions]):
+            result = await task
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            results.append(result)
+        return results
+
+
+def summarize(results, wall_seconds):
+    """Throughput, latency percentiles and per-stage p50/p95 of a finished run"""
+    latencies = sorted(result["total_ms"] for result in results)
+    stages = {}
+    for result in results:
+        for name, ms in result["stages_ms"].items():
+            stages.setdefault(name, []).append(ms)
+
+    intents = {}
+    for result in results:
+        intents[result["intent"]] = intents.get(result["intent"], 0) + 1
+
+    lines = [
+        f"Questions: {len(results)}  errors: {sum(1 for result in results if result['error'])}  "
+        f"wall time: {wall_seconds:.2f} s  throughput: {len(results) / wall_seconds if wall_seconds else 0:.2f} q/s",
+        f"Latency ms  p50 {percentile(latencies, 50):.1f}  p95 {percentile(latencies, 95):.1f}  p99 {percentile(latencies, 99):.1f}  "
+        f"max {latencies[-1] if latencies else 0:.1f}",
+        "Intents: " + ", ".join(f"{intent}={count}" for intent, count in sorted(intents.items(), key=lambda item: -item[1])),
+    ]
+    compared = [result for result in results if "matches_expected" in result]
+    if compared:
+        lines.append(f"Matches expected: {sum(result['matches_expected'] for result in compared)}/{len(compared)}")
+    lines.append("Stage                     count    p50 ms    p95 ms")
+    for name, values in sorted(stages.items(), key=lambda item: -sum(item[1])):
+        values.sort()
+        lines.append(f"{name:<24} {len(values):>6} {percentile(values, 50):>9.2f} {percentile(values, 95):>9.2f}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a question set through MMCMate and report latency")
+    parser.add_argument("input", help="questions as .jsonl or .csv")
+    parser.add_argument("-o", "--output", help="answers, routing and stage timings as JSONL (default: stdout)")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--timeout", type=float, default=60, help="seconds per question")
+    parser.add_argument("--backend", choices=["gemini", "stub"], help="overrides LLM_BACKEND")
+    parser.add_argument("--fresh", action="store_true", help="no rephrasing matches within the run either, so every answer comes from the model")
+    parser.add_argument("--shared-cache", action="store_true",
+                        help="read and write the app's answer cache, paraphrase log and FAQ (default: a throwaway cache per run)")
+    args = parser.parse_args()
+    if args.fresh and args.shared_cache:
+        parser.error("--fresh and --shared-cache cannot be combined")
+
+    # Settings bot_back reads at import time
+    if args.backend:
+        os.environ["LLM_BACKEND"] = args.backend
+    if not args.shared_cache:
+        # Scores answers from the model, not from earlier runs, and never leaves answers behind for the app
+        scratch = tempfile.mkdtemp(prefix="mmcmate_batch_")
+        os.environ["ANSWER_CACHE_PATH"] = os.path.join(scratch, "answers.db")
+        os.environ["PARAPHRASE_AUDIT_LOG"] = os.path.join(scratch, "paraphrase_audit.jsonl")
+        os.environ["FAQ_PATH"] = ""
+    if args.fresh:
+        os.environ["PARAPHRASE_THRESHOLD"] = "0"
+    import bot_back
+
+    questions = read_questions(args.input)
+    output = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        # Pay for the input checker and the handbook before the clock starts
+        bot_back.get_input_checker()
+        bot_back.get_handbook(args.db)
+
+        runner = BatchRunner(bot_back, args.db, args.concurrency, args.timeout)
+        start = time.perf_counter()
+        results = asyncio.run(runner.run(questions, output))
+        wall_seconds = time.perf_counter() - start
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    print(summarize(results, wall_seconds), file=sys.stderr)
+    return 1 if any(result["error"] for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,24 @@
 import bot_back as back
+from bot_service import QueryServiceClient
 from ChatHistory import (
     init_chat, add_message, display_chat, start_new_chat, 
-    save_current_chat, load_chat_session, get_chat_sessions, 
+    save_current_chat, load_chat_session, get_chat_sessions, count_chat_sessions,
     delete_chat_session, export_chat_session
 )
 import streamlit as st
 from datetime import datetime
 import os
 
+# Optional shared backend (e.g. http://127.0.0.1:8765 or unix:///tmp/mmcmate.sock) || answers locally when unset
+QUERY_SERVICE_URL = os.getenv("QUERY_SERVICE_URL")
+
+# Saved chats shown per sidebar page
+CHATS_PER_PAGE = int(os.getenv("CHATS_PER_PAGE", "10"))
+
+@st.cache_resource
+def get_service_client():
+    return QueryServiceClient(QUERY_SERVICE_URL) if QUERY_SERVICE_URL else None
+
 # Function to handle GUI
 def main():
     # Streamlit set up
@@ -60,12 +71,16 @@ def main():
         
         st.divider()
         
-        # -- Display saved chats --
-        saved_chats = get_chat_sessions()
+        # -- Display saved chats (one page at a time) --
+        chat_count = count_chat_sessions()
         
-        if saved_chats:
+        if chat_count:
             st.subheader("💬 Saved Conversations")
             
+            page_count = (chat_count + CHATS_PER_PAGE - 1) // CHATS_PER_PAGE
+            page = min(st.session_state.get("chat_page", 0), page_count - 1)
+            saved_chats = get_chat_sessions(CHATS_PER_PAGE, page * CHATS_PER_PAGE)
+            
             for chat in saved_chats:
                 with st.expander(f"📝 {chat['title']}", expanded=False):
                     st.write(f"**Messages:** {chat['message_count']}")
@@ -83,15 +98,20 @@ def main():
                                 st.error("Failed to load chat!")
                     
                     with col_export:
-                        json_data = export_chat_session(chat['chat_id'])
-                        if json_data:
-                            st.download_button(
-                                label="📥 JSON",
-                                data=json_data,
-                                file_name=f"chat_{chat['chat_id']}.json",
-                                mime="application/json",
-                                key=f"export_{chat['chat_id']}"
-                            )
+                        # The JSON is only built once export is asked for
+                        if st.session_state.get("export_chat_id") == chat['chat_id']:
+                            json_data = export_chat_session(chat['chat_id'])
+                            if json_data:
+                                st.download_button(
+                                    label="📥 JSON",
+                                    data=json_data,
+                                    file_name=f"chat_{chat['chat_id']}.json",
+                                    mime="application/json",
+                                    key=f"export_{chat['chat_id']}"
+                                )
+                        elif st.button("📤 Export", key=f"prepare_export_{chat['chat_id']}"):
+                            st.session_state.export_chat_id = chat['chat_id']
+                            st.rerun()
                     
                     with col_delete:
                         if st.button("🗑️ Del", key=f"delete_{chat['chat_id']}"):
@@ -100,6 +120,20 @@ def main():
                                 st.rerun()
                             else:
                                 st.error("Failed to delete chat!")
+            
+            # -- Page controls --
+            if page_count > 1:
+                col_prev, col_page, col_next = st.columns([1, 2, 1])
+                with col_prev:
+                    if st.button("◀", key="chat_page_prev", disabled=page == 0):
+                        st.session_state.chat_page = page - 1
+                        st.rerun()
+                with col_page:
+                    st.write(f"Page {page + 1} of {page_count}")
+                with col_next:
+                    if st.button("▶", key="chat_page_next", disabled=page >= page_count - 1):
+                        st.session_state.chat_page = page + 1
+                        st.rerun()
         
         # Current session info
         st.divider()
@@ -115,7 +149,7 @@ def main():
     display_chat()
     
     # Handle new messages (this will add and display new messages)
-    back.handle_conversation(db_path)
+    back.handle_conversation(db_path, get_service_client())
 
 # To run main
 if __name__ == "__main__":
@@ -0,0 +1,253 @@
+import argparse
+import asyncio
+import http.client
+import json
+import os
+import socket
+from urllib.parse import urlparse
+
+from Scheduler import QueuePosition
+from Tracing import annotate, finish_trace, start_trace
+
+# Service settings || how many questions run at once and how long one may take
+SERVICE_MAX_CONCURRENCY = int(os.getenv("SERVICE_MAX_CONCURRENCY", "8"))
+SERVICE_REQUEST_TIMEOUT = float(os.getenv("SERVICE_REQUEST_TIMEOUT", "60"))
+
+# Path to the database
+DB_PATH = os.path.join("database", "databasefinalnjud.db")
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 504: "Gateway Timeout", 500: "Internal Server Error"}
+
+
+class QueryService:
+    """Runs query_gemini_api behind a small asyncio HTTP server (TCP or Unix socket)
+
+    POST /query   {"user_input": "...", "chat_id": "..."} -> {"response": "..."}
+    POST /stream  {"user_input": "...", "chat_id": "..."} -> one JSON object per line: {"chunk": "..."} then {"done": true}
+                  ({"queue_position": n} lines come first while the question waits for a model slot)
+    GET  /health  -> {"status": "ok", "active": n}
+    GET  /metrics -> stage latency histograms and cache counters (Prometheus text format)
+    """
+
+    def __init__(self, db_path=DB_PATH, max_concurrency=SERVICE_MAX_CONCURRENCY, timeout=SERVICE_REQUEST_TIMEOUT):
+        # Imported here so the client side never pays for the backend imports
+        import bot_back
+        self.back = bot_back
+        self.db_path = db_path
+        self.timeout = timeout
+        self.slots = asyncio.Semaphore(max_concurrency)
+        self.active = 0
+
+    async def read_request(self, reader):
+        """Parse the request line, headers and JSON body"""
+        request_line = (await reader.readline()).decode("latin-1").strip()
+        if not request_line:
+            return None, None, None
+        method, path, _ = request_line.split(" ", 2)
+
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1").strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        body = {}
+        length = int(headers.get("content-length", "0"))
+        if length:
+            body = json.loads((await reader.readexactly(length)).decode("utf-8"))
+        return method, path, body
+
+    async def send_body(self, writer, status, data, content_type):
+        writer.write(
+            f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode("latin-1") + data
+        )
+        await writer.drain()
+
+    async def send_json(self, writer, status, payload):
+        await self.send_body(writer, status, json.dumps(payload, ensure_ascii=False).encode("utf-8"), "application/json")
+
+    async def send_line(self, writer, payload):
+        """Write one JSON line as an HTTP chunk"""
+        data = (json.dumps(payload, ensure_ascii=False) + "\n").encode("utf-8")
+        writer.write(f"{len(data):x}\r\n".encode("latin-1") + data + b"\r\n")
+        await writer.drain()
+
+    async def answer(self, user_input, chat_id=None):
+        return await self.back.query_gemini_api_async(self.db_path, user_input, chat_id=chat_id)
+
+    async def stream_answer(self, writer, user_input, chat_id=None):
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\n"
+            b"Transfer-Encoding: chunked\r\nConnection: close\r\n\r\n"
+        )
+        result = await self.back.query_gemini_api_async(self.db_path, user_input, stream=True, chat_id=chat_id)
+        if isinstance(result, str):
+            await self.send_line(writer, {"chunk": result})
+        else:
+            async for chunk in result:
+                if isinstance(chunk, QueuePosition):
+                    await self.send_line(writer, {"queue_position": chunk.position})
+                    continue
+                await self.send_line(writer, {"chunk": chunk})
+
+    async def handle(self, reader, writer):
+        try:
+            method, path, body = await self.read_request(reader)
+            if method is None:
+                return
+            if method == "GET" and path == "/health":
+                await self.send_json(writer, 200, {"status": "ok", "active": self.active})
+                return
+            if method == "GET" and path == "/metrics":
+                metrics = await asyncio.to_thread(self.back.export_metrics)
+                await self.send_body(writer, 200, metrics.encode("utf-8"), "text/plain; version=0.0.4")
+                return
+            if method != "POST" or path not in {"/query", "/stream"}:
+                await self.send_json(writer, 404, {"error": "not found"})
+                return
+            user_input = body.get("user_input", "")
+            if not user_input.strip():
+                await self.send_json(writer, 400, {"error": "user_input is required"})
+                return
+            chat_id = body.get("chat_id")  # optional, gives follow-up questions their chat's earlier turns
+
+            # Each request runs in its own task, so its trace never mixes with another request's
+            trace = start_trace()
+            annotate(endpoint=path)
+            async with self.slots:
+                self.active += 1
+                try:
+                    if path == "/query":
+                        response = await asyncio.wait_for(self.answer(user_input, chat_id), self.timeout)
+                        await self.send_json(writer, 200, {"response": response})
+                    else:
+                        try:
+                            await asyncio.wait_for(self.stream_answer(writer, user_input, chat_id), self.timeout)
+                            await self.send_line(writer, {"done": True})
+                        except asyncio.TimeoutError:
+                            await self.send_line(writer, {"error": "timeout"})
+                        except Exception as e:
+                            # Headers are already out, so errors travel inside the stream
+                            print(f"[ERROR] Service error: {e}")
+                            await self.send_line(writer, {"error": str(e)})
+                        writer.write(b"0\r\n\r\n")
+                finally:
+                    self.active -= 1
+                    finish_trace(trace)
+        except asyncio.TimeoutError:
+            await self.send_json(writer, 504, {"error": "timeout"})
+        except ValueError as e:
+            await self.send_json(writer, 400, {"error": str(e)})
+        except Exception as e:
+            print(f"[ERROR] Service error: {e}")
+            await self.send_json(writer, 500, {"error": str(e)})
+        finally:
+            try:
+                await writer.drain()
+            except ConnectionError:
+                pass
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8765, unix_path=None):
+        # Warm the input checker before taking requests so the first question is not charged for it
+        await asyncio.to_thread(self.back.get_input_checker)
+        if unix_path:
+            if os.path.exists(unix_path):
+                os.remove(unix_path)
+            server = await asyncio.start_unix_server(self.handle, path=unix_path)
+            print(f"MMCMate query service on unix:{unix_path}")
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+            print(f"MMCMate query service on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """http.client connection over a Unix domain socket"""
+
+    def __init__(self, unix_path, timeout):
+        super().__init__("localhost", timeout=timeout)
+        self.unix_path = unix_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_path)
+
+
+class QueryServiceClient:
+    """Thin blocking client for the Streamlit front end (http://host:port or unix:///path.sock)"""
+
+    def __init__(self, url, timeout=SERVICE_REQUEST_TIMEOUT + 5):
+        self.url = urlparse(url)
+        self.timeout = timeout
+
+    def connect(self):
+        if self.url.scheme == "unix":
+            return UnixHTTPConnection(self.url.path, self.timeout)
+        return http.client.HTTPConnection(self.url.hostname, self.url.port or 80, timeout=self.timeout)
+
+    def post(self, path, user_input, chat_id=None):
+        conn = self.connect()
+        payload = {"user_input": user_input}
+        if chat_id:
+            payload["chat_id"] = chat_id
+        body = json.dumps(payload).encode("utf-8")
+        conn.request("POST", path, body=body, headers={"Content-Type": "application/json"})
+        return conn, conn.getresponse()
+
+    def query(self, user_input, chat_id=None):
+        """Return the full answer"""
+        conn, response = self.post("/query", user_input, chat_id)
+        try:
+            payload = json.loads(response.read().decode("utf-8"))
+        finally:
+            conn.close()
+        if response.status != 200:
+            raise RuntimeError(f"Query service error {response.status}: {payload.get('error')}")
+        return payload["response"]
+
+    def stream(self, user_input, chat_id=None):
+        """Yield the answer chunk by chunk as the service sends it (QueuePosition while it waits in line)"""
+        conn, response = self.post("/stream", user_input, chat_id)
+        try:
+            if response.status != 200:
+                payload = json.loads(response.read().decode("utf-8"))
+                raise RuntimeError(f"Query service error {response.status}: {payload.get('error')}")
+            for line in response:
+                message = json.loads(line.decode("utf-8"))
+                if "error" in message:
+                    raise RuntimeError(f"Query service error: {message['error']}")
+                if message.get("done"):
+                    break
+                if "queue_position" in message:
+                    yield QueuePosition(message["queue_position"])
+                    continue
+                yield message["chunk"]
+        finally:
+            conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MMCMate query service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", help="listen on this Unix socket instead of TCP")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--max-concurrency", type=int, default=SERVICE_MAX_CONCURRENCY)
+    parser.add_argument("--timeout", type=float, default=SERVICE_REQUEST_TIMEOUT)
+    args = parser.parse_args()
+
+    async def run():
+        service = QueryService(args.db, args.max_concurrency, args.timeout)
+        await service.serve(args.host, args.port, args.unix)
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from Coalescing import SingleFlight
+
+CHUNKS = ["Students ", "must ", "wear ", "their ", "ID."]
+
+
+def wait_for_waiters(single_flight, key, count):
+    for _ in range(500):
+        flight = single_flight.flights.get(key)
+        if flight is not None and flight.waiters >= count:
+            return
+        time.sleep(0.01)
+    raise AssertionError("nobody joined the flight")
+
+
+def in_thread(fn):
+    result = {}
+
+    def target():
+        try:
+            result["value"] = fn()
+        except Exception as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=target)
+    thread.start()
+    return thread, result
+
+
+def test_concurrent_callers_share_one_call():
+    single_flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def answer():
+        calls.append(1)
+        release.wait(5)
+        return "one answer"
+
+    leader = in_thread(lambda: single_flight.run("key", "question", answer))
+    wait_for_waiters(single_flight, "key", 0)
+    followers = [in_thread(lambda: single_flight.run("key", "question", answer)) for _ in range(2)]
+    wait_for_waiters(single_flight, "key", 2)
+    release.set()
+    for thread, result in [leader] + followers:
+        thread.join(5)
+        assert result == {"value": "one answer"}
+    assert len(calls) == 1
+    assert single_flight.stats()["coalesced"] == 2
+    assert single_flight.hot_questions() == [("question", 2)]
+
+
+def test_model_errors_reach_every_caller():
+    single_flight = SingleFlight()
+    release = threading.Event()
+
+    def failing():
+        release.wait(5)
+        raise ConnectionError("model down")
+
+    leader = in_thread(lambda: single_flight.run("key", "question", failing))
+    wait_for_waiters(single_flight, "key", 0)
+    follower = in_thread(lambda: single_flight.run("key", "question", failing))
+    wait_for_waiters(single_flight, "key", 1)
+    release.set()
+    for thread, result in (leader, follower):
+        thread.join(5)
+        assert isinstance(result["error"], ConnectionError)
+
+
+def test_follower_gets_the_whole_answer_when_the_leader_leaves():
+    single_flight = SingleFlight()
+    opened = []
+
+    def open_stream():
+        opened.append(1)
+        for chunk in CHUNKS:
+            time.sleep(0.01)
+            yield chunk
+
+    leader = single_flight.stream("key", "question", open_stream)
+    assert next(leader) == CHUNKS[0]
+    follower = in_thread(lambda: list(single_flight.stream("key", "question", open_stream)))
+    wait_for_waiters(single_flight, "key", 1)
+
+    # A rerun closes the leader's reader between chunks
+    leader.close()
+    follower[0].join(5)
+    assert follower[1] == {"value": CHUNKS}
+    assert len(opened) == 1
+    assert single_flight.stats()["handed_over"] == 1
+
+
+def test_leader_without_followers_is_delisted_when_it_leaves():
+    single_flight = SingleFlight()
+    leader = single_flight.stream("key", "question", lambda: iter(CHUNKS))
+    next(leader)
+    leader.close()
+    assert single_flight.stats()["in_flight"] == 0
+    assert list(single_flight.stream("key", "question", lambda: iter(CHUNKS))) == CHUNKS
+
+
+def test_followers_ask_again_when_the_leader_is_cancelled():
+    single_flight = SingleFlight()
+    opened = []
+
+    async def open_stream():
+        opened.append(1)
+        if len(opened) == 1:
+            await asyncio.sleep(10)
+        for chunk in CHUNKS:
+            yield chunk
+
+    async def read():
+        return [chunk async for chunk in single_flight.astream("key", "question", open_stream)]
+
+    async def main():
+        leader = asyncio.ensure_future(read())
+        await asyncio.sleep(0.05)
+        follower = asyncio.ensure_future(read())
+        await asyncio.sleep(0.05)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await asyncio.wait_for(follower, 5)
+
+    assert asyncio.run(main()) == CHUNKS
+    assert len(opened) == 2
+    assert single_flight.stats()["abandoned"] == 1
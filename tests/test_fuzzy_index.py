@@ -0,0 +1,79 @@
+import random
+import string
+
+import pytest
+from fuzzywuzzy import fuzz
+
+from Checkers import FuzzyWordIndex
+
+# Handbook and chat vocabulary, from one letter to long words, plus generated words of every length
+WORDS = [
+    "a", "i", "an", "by", "id", "is", "of", "on", "to", "act", "bag", "cap", "law", "pet",
+    "cheat", "dress", "grade", "guard", "penalty", "offense", "sanction", "student", "campus",
+    "uniform", "tuition", "academic", "conduct", "discipline", "violation", "attendance",
+    "dishonesty", "plagiarism", "suspension", "expulsion", "harassment", "responsibilities",
+    "identification", "administration", "extracurricular", "misrepresentation",
+]
+
+
+def generated_words(count, seed):
+    rng = random.Random(seed)
+    return ["".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(1, 14))) for _ in range(count)]
+
+
+def typos(word, rng):
+    """Deletions, insertions, substitutions and swaps of a word"""
+    letters = string.ascii_lowercase
+    position = rng.randrange(len(word) + 1)
+    variants = [
+        word[:position] + rng.choice(letters) + word[position:],
+        word[:position] + rng.choice(letters) + rng.choice(letters) + word[position:],
+    ]
+    if len(word) > 1:
+        position = rng.randrange(len(word))
+        variants.append(word[:position] + word[position + 1:])
+        variants.append(word[:position] + rng.choice(letters) + word[position + 1:])
+        position = rng.randrange(len(word) - 1)
+        variants.append(word[:position] + word[position + 1] + word[position] + word[position + 2:])
+    return variants
+
+
+def brute_force(word, words, threshold):
+    return any(fuzz.ratio(word, candidate) >= threshold for candidate in words)
+
+
+@pytest.fixture(scope="module")
+def words():
+    return set(WORDS + generated_words(400, seed=1))
+
+
+@pytest.fixture(scope="module")
+def index(words):
+    return FuzzyWordIndex(words)
+
+
+@pytest.fixture(scope="module")
+def queries(words):
+    rng = random.Random(2)
+    queries = set(words)
+    for word in sorted(words):
+        queries.update(typos(word, rng))
+    queries.update(generated_words(300, seed=3))
+    return sorted(query for query in queries if query)
+
+
+@pytest.mark.parametrize("threshold", [50, 60, 70, 80, 90, 100])
+def test_has_similar_word_matches_brute_force(index, words, queries, threshold):
+    mismatches = [query for query in queries
+                  if index.has_similar_word(query, threshold) != brute_force(query, words, threshold)]
+    assert mismatches == []
+
+
+def test_empty_word_is_never_similar(index):
+    assert not index.has_similar_word("")
+
+
+def test_typos_of_handbook_words_are_similar(index):
+    assert index.has_similar_word("sanctoin")
+    assert index.has_similar_word("plagiarsm")
+    assert not index.has_similar_word("qzxvbnm")
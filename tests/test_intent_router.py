@@ -0,0 +1,140 @@
+import re
+
+import pytest
+
+import bot_back
+from Checkers import InputChecker
+from IntentRouter import IntentRouter
+
+# Today's routing decisions, quirks included || messages come in stripped and lowercased
+CASES = [
+    # Rejects: math, SQL and nonsense
+    ("2 + 3 * (4 - 1)", "reject"),
+    ("12", "reject"),
+    ("select * from users", "reject"),
+    ("drop table students", "reject"),
+    ("name' or 1=1", "reject"),
+    ("what is the dress code;", "reject"),
+    ("asdfghjkl qwrtyp zxcvb", "reject"),
+    ("zzzzzz xxxxx yyyyy", "reject"),
+    ("quixafobel zorpinuvexa blimfazoqu", "reject"),
+    ("ojaxuqe ivuzoqa exuqoja ujaqixo", "reject"),
+    # The gibberish and dictionary checks skip 1-2 word messages
+    ("asdfghjkl", "unmatched"),
+    ("qwrtzp bcdfg", "unmatched"),
+    ("qwrtzp bcdfg please", "reject"),
+    ("quixafobel zorpinuvexa", "unmatched"),
+    # 3 of 5 unknown words is not more than 60%
+    ("the quixafobel zorpinuvexa blimfazoqu rules", "in_scope"),
+    # Goodbye wins over everything but rejects, "ty" also matches inside words
+    ("thank you", "goodbye"),
+    ("bye", "goodbye"),
+    ("thanks mmcmate", "goodbye"),
+    ("what is the penalty for cheating", "goodbye"),
+    ("property damage rules", "goodbye"),
+    # Greetings only up to 17 characters, punctuation included; "hi" and "yo" also match inside words
+    ("hello", "greeting"),
+    ("hey", "greeting"),
+    ("hi there", "greeting"),
+    ("hello there!!", "greeting"),
+    ("hello how are you", "greeting"),
+    ("hello how are you!", "unmatched"),
+    ("what is this", "greeting"),
+    ("who are you", "greeting"),
+    ("what is your name", "greeting"),
+    ("yo what is up with the grading", "unmatched"),
+    # Identity phrases in longer messages
+    ("tell me about yourself please", "identity"),
+    ("are you a bot or a person", "identity"),
+    # "mmcm" alone, and questions about it (mmcm is an accepted keyword, so those are in scope)
+    ("mmcm", "mmcm"),
+    ("mcm", "mmcm"),
+    ("what is mmcm", "in_scope"),
+    ("tell me about mcm history", "in_scope"),
+    # Handbook topics, and everything else the model still gets
+    ("what are the rules on dress code", "in_scope"),
+    ("student rights and responsibilities", "in_scope"),
+    ("what is the code of conduct for students here", "in_scope"),
+    ("hello, what are the sanctions for cheating", "in_scope"),
+    ("where is the library", "unmatched"),
+    ("can i park my car on campus", "unmatched"),
+    ("random words about nothing particular", "unmatched"),
+]
+
+
+@pytest.fixture(scope="module")
+def input_checker():
+    return InputChecker()
+
+
+@pytest.fixture(scope="module")
+def router(input_checker):
+    return IntentRouter(input_checker, bot_back.GREETING_KEYWORDS, bot_back.GOODBYE_KEYWORDS,
+                        bot_back.IDENTITY_KEYWORDS, bot_back.ACCEPTED_KEYWORDS)
+
+
+def cascade(input_checker, user_input):
+    """The if/elif cascade the router replaced"""
+    if any([
+        input_checker.is_mathematical_expression(user_input),
+        input_checker.is_nonsensical_input(user_input),
+        input_checker.is_sql_injection_attempt(user_input)
+    ]):
+        return "reject"
+    elif input_checker.contains_keywords(user_input, bot_back.GOODBYE_KEYWORDS):
+        return "goodbye"
+    elif input_checker.contains_keywords(user_input, bot_back.GREETING_KEYWORDS) and len(user_input) <= 17:
+        return "greeting"
+    elif any(phrase in user_input.lower() for phrase in bot_back.IDENTITY_KEYWORDS):
+        return "identity"
+    elif user_input.strip() in {"mmcm", "mcm"}:
+        return "mmcm"
+    elif (
+        re.search(r"\b(what is|who.*is|tell me about)\b.*\b(mmcm|mcm)\b", user_input)
+        and not input_checker.contains_keywords(user_input, bot_back.ACCEPTED_KEYWORDS)
+    ):
+        return "mmcm_general"
+    elif input_checker.contains_keywords(user_input, bot_back.ACCEPTED_KEYWORDS):
+        return "in_scope"
+    return "unmatched"
+
+
+@pytest.mark.parametrize("user_input, intent", CASES)
+def test_classify(router, user_input, intent):
+    assert router.classify(user_input)[0] == intent
+
+
+@pytest.mark.parametrize("user_input, intent", CASES)
+def test_classify_matches_old_cascade(router, input_checker, user_input, intent):
+    assert router.classify(user_input)[0] == cascade(input_checker, user_input)
+
+
+def test_reject_reasons(router):
+    assert router.classify("2 + 3 * (4 - 1)") == ("reject", "math")
+    assert router.classify("name' or 1=1") == ("reject", "sql")
+    assert router.classify("drop table students") == ("reject", "drop")
+    assert router.classify("zuqivo bexojax wafuzeq") == ("reject", "nonsense")
+
+
+def test_greeting_length_limit(router):
+    assert len("hello how are you") == 17
+    assert router.classify("hello how are you")[0] == "greeting"
+    assert router.classify("hello how are you!")[0] != "greeting"
+
+
+def test_short_messages_skip_word_checks(router):
+    before = router.pipeline.stats()
+    router.classify("qwrtzp bcdfg")
+    after = router.pipeline.stats()
+    for check in ("gibberish", "dictionary"):
+        assert after[check]["not_applicable"] == before[check]["not_applicable"] + 1
+        assert after[check]["run"] == before[check]["run"]
+
+
+def test_first_rejection_skips_later_checks(router):
+    before = router.pipeline.stats()
+    router.classify("select * from a table of students")
+    after = router.pipeline.stats()
+    assert after["sql_keywords"]["rejected"] == before["sql_keywords"]["rejected"] + 1
+    assert after["dictionary"]["skipped"] == before["dictionary"]["skipped"] + 1
+    assert after["dictionary"]["run"] == before["dictionary"]["run"]
@@ -0,0 +1,70 @@
+import asyncio
+import time
+
+import pytest
+
+from Resilience import CircuitBreaker, ModelCaller, ModelUnavailable
+from Scheduler import ModelScheduler
+
+
+def test_cancelled_trial_lets_the_next_call_try():
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=0)
+    breaker.record_failure()
+    assert breaker.enter() == "trial"
+    assert breaker.enter() is None
+    breaker.cancel_trial()
+    assert breaker.enter() == "trial"
+
+
+def test_trial_cancelled_by_a_timeout_does_not_keep_the_breaker_half_open():
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=0.05)
+    caller = ModelCaller(deadline=5, retries=0, breaker=breaker)
+
+    async def failing():
+        raise ConnectionError("model down")
+
+    async def slow():
+        await asyncio.sleep(1)
+        return "late"
+
+    async def fast():
+        return "answer"
+
+    async def main():
+        with pytest.raises(ModelUnavailable):
+            await caller.call_async(failing)
+        assert breaker.state == "open"
+        await asyncio.sleep(0.06)
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(caller.call_async(slow), 0.05)
+        return await caller.call_async(fast)
+
+    assert asyncio.run(main()) == "answer"
+    assert breaker.state == "closed"
+
+
+def test_requests_past_the_deadline_are_left_running():
+    caller = ModelCaller(deadline=0.1, retries=0)
+    left_running = []
+    with pytest.raises(ModelUnavailable):
+        caller.call(lambda: time.sleep(0.3) or "late", left_running)
+    assert len(left_running) == 1 and not left_running[0].done()
+    assert left_running[0].result(5) == "late"
+
+
+def test_every_retry_spends_a_request_of_the_quota():
+    scheduler = ModelScheduler(max_concurrent=4, rate_per_minute=6000, burst=2)
+    caller = ModelCaller(deadline=5, retries=3, retry_delay=0, breaker=CircuitBreaker(failure_threshold=10), quota=scheduler)
+    ticket = scheduler.submit("a")
+    list(scheduler.wait(ticket))
+    calls = []
+
+    def failing():
+        calls.append(time.monotonic())
+        raise ConnectionError("429")
+
+    with pytest.raises(ModelUnavailable):
+        caller.call(failing)
+    assert len(calls) == 4
+    # The slot grant and the first retry used the burst, the last two retries waited for the bucket
+    assert calls[3] - calls[1] >= 0.015
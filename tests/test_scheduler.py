@@ -0,0 +1,75 @@
+import asyncio
+
+from Scheduler import ModelScheduler
+
+
+def granted(scheduler, session):
+    ticket = scheduler.submit(session)
+    list(scheduler.wait(ticket))
+    assert ticket.granted
+    return ticket
+
+
+def test_stream_closed_after_its_ticket_was_granted_gives_the_slot_back():
+    scheduler = ModelScheduler(max_concurrent=1, poll_interval=0.01)
+    holder = granted(scheduler, "a")
+    ticket = scheduler.submit("b")
+    waiter = scheduler.wait(ticket)
+    assert next(waiter) == 1
+
+    # The slot is granted to the queued ticket, then its reader goes away before the wait returns
+    scheduler.discard(holder)
+    assert ticket.granted
+    waiter.close()
+
+    assert scheduler.stats()["active"] == 0
+    assert scheduler.stats()["waiting"] == 0
+    granted(scheduler, "c")
+
+
+def test_discard_is_safe_more_than_once():
+    scheduler = ModelScheduler(max_concurrent=2)
+    ticket = granted(scheduler, "a")
+    scheduler.discard(ticket)
+    scheduler.discard(ticket)
+    assert scheduler.stats()["active"] == 0
+
+
+def test_discard_takes_a_queued_ticket_out_of_line():
+    scheduler = ModelScheduler(max_concurrent=1)
+    holder = granted(scheduler, "a")
+    ticket = scheduler.submit("b")
+    assert scheduler.stats()["waiting"] == 1
+    scheduler.discard(ticket)
+    scheduler.discard(holder)
+    stats = scheduler.stats()
+    assert (stats["active"], stats["waiting"], stats["admitted"]) == (0, 0, 1)
+
+
+def test_wait_async_cancelled_while_queued_leaves_nothing_behind():
+    scheduler = ModelScheduler(max_concurrent=1, poll_interval=0.01)
+    holder = granted(scheduler, "a")
+
+    async def wait_for_slot():
+        ticket = scheduler.submit("b")
+        async for _ in scheduler.wait_async(ticket):
+            pass
+
+    async def main():
+        task = asyncio.ensure_future(wait_for_slot())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(main())
+    assert scheduler.stats()["waiting"] == 0
+    scheduler.discard(holder)
+    assert scheduler.stats()["active"] == 0
+
+
+def test_retries_and_hedges_spend_the_quota():
+    scheduler = ModelScheduler(max_concurrent=4, rate_per_minute=60, burst=2)
+    granted(scheduler, "a")
+    assert scheduler.try_take_token()
+    assert not scheduler.try_take_token()
+    assert 0 < scheduler.token_wait() <= 1